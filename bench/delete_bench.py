@@ -0,0 +1,95 @@
+# Admin batch delete: removing N items (guides and vault packs, half each) one
+# confirm tap at a time the old way (find_one_and_delete on guides, then on
+# vaults, per item) vs. the multi-select screens driven through their
+# handlers: "Select page" on every page, or "Select all" once per listing,
+# then one "Delete selected". Against bench/memory_mongo.py with a fake round
+# trip; counts the admin's taps, message edits and Mongo round trips for the
+# whole flow.
+#   python bench/delete_bench.py [items] [latency]
+import os, sys, time, asyncio
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+import bot
+from bson import ObjectId
+from memory_mongo import MemoryDatabase
+
+async def legacy_catalog_remove(folder, oid):
+    await bot.col_catalog.update_one({"_id": folder}, {"$inc": {"count": -1}, "$pull": {"items": {"id": oid}}})
+    await bot.col_catalog.delete_one({"_id": folder, "count": {"$lte": 0}})
+
+async def legacy_delete(oid):
+    gone = await bot.col_guides.find_one_and_delete({"_id": ObjectId(oid)}, {"type": 1})
+    if gone:
+        await bot.counters.incr(f"guides:{gone.get('type')}", -1)
+        bot.render_cache.invalidate("list", gone.get("type"))
+    else:
+        gone = await bot.col_vaults.find_one_and_delete({"_id": ObjectId(oid)}, {"folder": 1})
+        if gone:
+            await legacy_catalog_remove(gone.get("folder"), gone["_id"])
+            await bot.col_vault_files.delete_many({"vault_id": gone["_id"]})
+            bot.invalidate_vault_pages(gone.get("folder"))
+    bot.search_index.remove(ObjectId(oid))
+    bot.ordinal_index.remove(ObjectId(oid))
+
+async def seed(n, latency):
+    db = MemoryDatabase(latency=latency)
+    db.attach(bot)
+    guides = [{"type": bot.GUIDE_TYPES[i % 2], "name": f"Guide {i}", "search_keys": []} for i in range(n // 2)]
+    await bot.col_guides.insert_many(guides)
+    vaults = []
+    for i in range(n - n // 2):
+        v = {"folder": f"Folder {i % 20}", "sub_name": f"Pack {i}", "key": f"K{i}", "file_count": 3}
+        await bot.col_vaults.insert_one(v)
+        await bot.save_manifest(v["_id"], [{"id": f"f{i}_{j}", "type": "video"} for j in range(3)])
+        await bot.catalog_add(v)
+        vaults.append(v)
+    for t in bot.GUIDE_TYPES: await bot.counters.get(f"guides:{t}", (bot.col_guides, {"type": t}))
+    return db, [str(g["_id"]) for g in guides], [str(v["_id"]) for v in vaults]
+
+class Screen:
+    def __init__(self): self.taps, self.edits, self.markup = 0, 0, None
+
+    async def tap(self, handler, data, context):
+        async def edit(text, reply_markup=None):
+            self.edits += 1
+            self.markup = reply_markup
+        async def answer(*args, **kwargs): pass
+        self.taps += 1
+        await handler(SimpleNamespace(callback_query=SimpleNamespace(data=data, edit_message_text=edit, answer=answer)), context)
+
+    def button(self, label):
+        return next((b.callback_data for row in self.markup.inline_keyboard for b in row if b.text.startswith(label)), None)
+
+async def run(mode, n, latency):
+    db, g, v = await seed(n, latency)
+    calls = sum(db.calls.values())
+    screen, context = Screen(), SimpleNamespace(user_data={})
+    t = time.perf_counter()
+    if mode == "per-item":
+        for oid in g + v:
+            screen.taps += 1
+            screen.edits += 1
+            await legacy_delete(oid)
+    else:
+        for dtype in (*bot.GUIDE_TYPES, "vault"):
+            await screen.tap(bot.admin_del_process, f"del_{dtype}", context)
+            while mode == "by page":
+                await screen.tap(bot.admin_del_page, "dpg", context)
+                nxt = screen.button("Next")
+                if not nxt: break
+                await screen.tap(bot.admin_del_process, nxt, context)
+            if mode == "select all": await screen.tap(bot.admin_del_all, "dall", context)
+        await screen.tap(bot.admin_del_selected, "dgo", context)
+    elapsed = time.perf_counter() - t
+    left = await bot.col_guides.count_documents({}) + await bot.col_vaults.count_documents({})
+    folders = await bot.col_catalog.count_documents({})
+    print(f"{mode:>10} | {n:,} items | {elapsed:6.2f}s | taps {screen.taps:5,} | edits {screen.edits:5,}"
+          f" | mongo round trips {sum(db.calls.values()) - calls:6,} | left {left} | catalog folders {folders}")
+
+async def main(n, latency):
+    for mode in ("per-item", "by page", "select all"): await run(mode, n, latency)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if args else 1000, float(args[1]) if len(args) > 1 else 0.001))
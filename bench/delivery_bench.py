@@ -0,0 +1,68 @@
+# Vault delivery queue: one big pack unlocked just before many small ones,
+# against bench/fake_telegram.py and bench/memory_mongo.py. Reports when the
+# small packs got their first file and finished (round-robin keeps them from
+# waiting behind the big one), then kills the workers mid-delivery and checks
+# that a second "replica" resumes from the checkpoint without resending.
+#   python bench/delivery_bench.py [big_files] [small_users] [workers]
+import os, sys, time, asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update(TG_CHAT_RATE="1000", TG_CHAT_BURST="1000", TG_GLOBAL_RATE="100000")
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+import bot
+from fake_telegram import FakeTelegram
+from memory_mongo import MemoryDatabase
+
+def pct(xs, p): return sorted(xs)[min(len(xs) - 1, int(len(xs) * p))]
+
+async def pack(n):
+    v = {"folder": "Bench", "sub_name": f"{n} files", "key": f"K{n}-{time.monotonic()}", "file_count": n}
+    await bot.col_vaults.insert_one(v)
+    await bot.save_manifest(v["_id"], [{"id": f"f{i}", "type": "photo"} for i in range(n)])
+    return v["_id"]
+
+async def main(big, small, workers):
+    MemoryDatabase().attach(bot)
+    fake = FakeTelegram(latency=0.02)
+    await fake.start()
+    app = bot.build_app("1:delivery", base_url=fake.base_url, webhook=True)
+    await app.initialize()
+
+    q = bot.DeliveryQueue(workers)
+    runner = asyncio.create_task(q.run(app.bot))
+    big_id, small_id = await pack(big), await pack(5)
+    t = time.monotonic()
+    await q.submit(1, 1, big_id, big, None)
+    jobs = [await q.submit(100 + u, 100 + u, small_id, 5, None) for u in range(small)]
+    done = {}
+    while q.pending(1) or any(q.pending(100 + u) for u in range(small)):
+        for u in range(small):
+            if 100 + u not in done and not q.pending(100 + u): done[100 + u] = time.monotonic() - t
+        await asyncio.sleep(0.005)
+    big_done = time.monotonic() - t
+    first = [j["first_file"] for j in jobs]
+    print(f"{workers} workers | {big}-file pack + {small} x 5-file packs | small first file p50 {pct(first, .5):.2f}s"
+          f" p95 {pct(first, .95):.2f}s | small done p95 {pct(list(done.values()), .95):.2f}s | big done {big_done:.2f}s")
+
+    # Resume: stop mid-pack, let the lease lapse, a new queue under another instance id picks it up.
+    job = await q.submit(1, 1, big_id, big, None)
+    while job["sent"] < big // 2: await asyncio.sleep(0.005)
+    runner.cancel()
+    await asyncio.sleep(0.1)
+    cut = job["sent"]
+    sends_before = fake.calls["sendMediaGroup"]
+    await bot.col_deliveries.update_many({}, {"$set": {"lease_until": bot.datetime.utcnow()}})
+    bot.INSTANCE = "other-replica"
+    q2 = bot.DeliveryQueue(workers)
+    runner = asyncio.create_task(q2.run(app.bot))
+    while not q2.resumed or q2.pending(1): await asyncio.sleep(0.005)
+    runner.cancel()
+    doc = await bot.col_deliveries.find_one({"_id": job["_id"]})
+    albums = fake.calls["sendMediaGroup"] - sends_before
+    print(f"resume | stopped at {cut}/{big}, resumed by {doc['owner']} | status {doc['status']} {doc['sent']}/{big}"
+          f" | {albums} albums after restart (expected {-(-(big - cut) // bot.ALBUM_SIZE)})")
+    await app.shutdown()
+    await fake.stop()
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]]
+    asyncio.run(main(args[0] if args else 500, args[1] if len(args) > 1 else 50, args[2] if len(args) > 2 else bot.DELIVERY_WORKERS))
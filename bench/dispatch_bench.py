@@ -0,0 +1,51 @@
+# Handler latency under a simulated user population: the per-user ordered
+# dispatcher vs. one-at-a-time processing (concurrency 1). Most updates are
+# quick button presses; a few are long vault deliveries that used to stall
+# everyone. Also checks that no user ever sees updates run out of order.
+#   python bench/dispatch_bench.py [users] [updates/s] [seconds] [concurrency]
+import os, sys, time, random, asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram import Update
+import bot
+
+def update(i, uid, data=None):
+    user = {"id": uid, "is_bot": False, "first_name": "U"}
+    chat = {"id": uid, "type": "private"}
+    if data:
+        return Update.de_json({"update_id": i, "callback_query": {"id": str(i), "from": user, "chat_instance": "x", "data": data,
+                               "message": {"message_id": 1, "date": 0, "chat": chat}}}, None)
+    return Update.de_json({"update_id": i, "message": {"message_id": i, "date": 0, "chat": chat, "from": user, "text": "1"}}, None)
+
+async def run(users, rate, seconds, concurrency, slow_share=0.01, slow=1.0, fast=0.01):
+    rnd = random.Random(1)
+    proc = bot.UserOrderedProcessor(concurrency, max_pending=10 ** 6, per_user=10 ** 6)
+    last_seen, disorder, fast_lat, tasks = {}, 0, [], []
+
+    async def handler(i, uid, cost, arrived):
+        nonlocal disorder
+        if last_seen.get(uid, -1) > i: disorder += 1
+        last_seen[uid] = i
+        await asyncio.sleep(cost)
+        if cost == fast: fast_lat.append(time.monotonic() - arrived)
+
+    started, i = time.monotonic(), 0
+    while time.monotonic() - started < seconds:
+        i += 1
+        uid = rnd.randrange(users)
+        cost = slow if rnd.random() < slow_share else fast
+        tasks.append(asyncio.create_task(proc.process_update(update(i, uid, f"list_anime_{i}" if i % 2 else None),
+                                                             handler(i, uid, cost, time.monotonic()))))
+        await asyncio.sleep(rnd.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    print(f"concurrency {concurrency:>3} | {i:,} updates from {users:,} users in {elapsed:5.1f}s"
+          f" | quick p50 {bot.percentile(fast_lat, .5) * 1000:7.0f}ms p99 {bot.percentile(fast_lat, .99) * 1000:7.0f}ms"
+          f" | out of order {disorder}")
+
+async def main(users, rate, seconds, concurrency):
+    for c in (1, concurrency): await run(users, rate, seconds, c)
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]]
+    defaults = [1000, 200, 5, bot.UPDATE_CONCURRENCY]
+    asyncio.run(main(*(args + defaults[len(args):])))
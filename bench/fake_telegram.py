@@ -0,0 +1,76 @@
+# A local stand-in for the Bot API: answers every method with a plausible
+# result, records calls per method and hands out queued updates to getUpdates.
+# Can add latency (global or per method) and answer a share of sends with 429.
+# Point a bot at it with Application.builder().base_url(fake.base_url).
+import asyncio, itertools, json, random, time
+from collections import Counter
+from aiohttp import web
+
+class FakeTelegram:
+    def __init__(self, port=8089, latency=0.0, method_latency=None, flood_rate=0.0, retry_after=1, seed=0):
+        self.port, self.latency, self.method_latency = port, latency, method_latency or {}
+        self.flood_rate, self.retry_after = flood_rate, retry_after
+        self._rnd = random.Random(seed)
+        self.calls = Counter()
+        self.floods = Counter()
+        self.last = {}   # chat_id -> (method, params) of the latest call for that chat
+        self.updates = asyncio.Queue()
+        self.webhook = None
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self): return f"http://127.0.0.1:{self.port}/bot"
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id") or 1)
+        return {"message_id": next(self._ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"}, "text": params.get("text", "")}
+
+    async def _updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        batch = []
+        try: batch.append(await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty): return []
+        while len(batch) < 100 and not self.updates.empty(): batch.append(self.updates.get_nowait())
+        return batch
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] += 1
+        delay = self.method_latency.get(method, self.latency)
+        if delay: await asyncio.sleep(delay)
+        if self.flood_rate and method.startswith("send") and self._rnd.random() < self.flood_rate:
+            self.floods[method] += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                                      "parameters": {"retry_after": self.retry_after}}, status=429)
+        if params.get("chat_id"): self.last[int(params["chat_id"])] = (method, params)
+        if method == "getMe": result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getUpdates": result = await self._updates(params)
+        elif method == "setWebhook":
+            self.webhook = params.get("url")
+            result = True
+        elif method == "sendMediaGroup": result = [self._message(params) for _ in json.loads(params.get("media") or "[{}]")]
+        elif method.startswith(("send", "copy", "forward", "edit")): result = self._message(params)
+        else: result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        server = web.Application()
+        server.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        if self._runner: await self._runner.cleanup()
+
+    # Callback data of the buttons in the latest message sent or edited for a chat.
+    def buttons(self, chat_id):
+        markup = json.loads(self.last.get(chat_id, (None, {}))[1].get("reply_markup") or "{}")
+        return {b.get("text"): b.get("callback_data") for row in markup.get("inline_keyboard", []) for b in row}
+
+    async def wait_for(self, method, n, timeout=120):
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < n and time.monotonic() < deadline: await asyncio.sleep(0.01)
@@ -0,0 +1,88 @@
+# Bulk import/export: N synthetic guides (JSONL and CSV) and N/10 vault packs
+# through bot.import_records, against bench/memory_mongo.py with a fake round
+# trip, or a real server with --mongo-url (scratch db, dropped afterwards).
+# The per-item baseline replays what the add-guide conversation does for each
+# record (insert_one + counter $inc) on a sample and extrapolates.
+#   python bench/import_bench.py --records 100000 --latency 0.001
+import os, sys, io, csv, json, time, random, asyncio, argparse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+p = argparse.ArgumentParser()
+p.add_argument("--records", type=int, default=100_000)
+p.add_argument("--latency", type=float, default=0.001, help="memory_mongo round trip")
+p.add_argument("--mongo-url", default="")
+p.add_argument("--sample", type=int, default=2000, help="records for the per-item baseline")
+args = p.parse_args()
+os.environ.setdefault("MONGO_URL", args.mongo_url or "mongodb://127.0.0.1:1")
+import bot
+from memory_mongo import MemoryDatabase
+from search_bench import names
+
+def guides(n, rnd):
+    return [{"type": rnd.choice(bot.GUIDE_TYPES), "name": name, "file": f"file_{i}", "media_type": rnd.choice(["photo", "video"]),
+             "desc": "Synthetic description " * 5, "link": "https://example.org/watch", "chan_name": "Channel",
+             "chan_link": "https://t.me/example"} for i, name in enumerate(names(n, rnd))]
+
+def vaults(n, rnd):
+    return [{"folder": f"Folder {i % 50}", "sub_name": f"Pack {i}", "poster": f"poster_{i}", "desc": "Pack",
+             "files": [{"id": f"v{i}_{j}", "type": rnd.choice(["photo", "video", "document"])} for j in range(rnd.randint(1, 30))]}
+            for i in range(n)]
+
+def jsonl(records): return "".join(json.dumps(r) + "\n" for r in records).encode()
+
+def as_csv(records, fields):
+    out = io.StringIO()
+    w = csv.DictWriter(out, fields, extrasaction="ignore")
+    w.writeheader()
+    w.writerows(records)
+    return out.getvalue().encode()
+
+async def fresh():
+    if args.mongo_url:
+        await bot.client.drop_database("vault_bot_import_bench")
+        db = bot.client["vault_bot_import_bench"]
+        for attr in dir(bot):
+            if attr.startswith("col_"): setattr(bot, attr, db[getattr(bot, attr).name])
+        bot.db = db
+        await bot.ensure_indexes()
+    else: MemoryDatabase(latency=args.latency).attach(bot)
+    for t in bot.GUIDE_TYPES: await bot.counters.get(f"guides:{t}", (bot.col_guides, {"type": t}))
+
+async def timed_import(kind, data, filename):
+    await fresh()
+    t = time.perf_counter()
+    report = await bot.import_records(kind, bot.read_records(data, filename))
+    elapsed = time.perf_counter() - t
+    print(f"import {kind:>6} {filename:>12} | {report.added:,} added, {report.rejected:,} rejected"
+          f" | {elapsed:6.2f}s = {report.read / elapsed:9,.0f} records/s | {len(data) / 2**20:5.1f} MiB")
+    return elapsed
+
+async def main():
+    rnd = random.Random(1)
+    g, v = guides(args.records, rnd), vaults(max(1, args.records // 10), rnd)
+    g[5]["type"] = "cartoons"   # a couple of bad records to show rejection
+    del g[7]["file"]
+    bulk = await timed_import("guides", jsonl(g), "guides.jsonl")
+    await timed_import("guides", as_csv(g, bot.GUIDE_FIELDS), "guides.csv")
+
+    await fresh()
+    sample = [bot.clean_guide(r) for r in g[:args.sample] if r.get("file") and r["type"] in bot.GUIDE_TYPES]
+    t = time.perf_counter()
+    for d in sample:
+        await bot.col_guides.insert_one(d)
+        await bot.counters.incr(f"guides:{d['type']}")
+    per_item = (time.perf_counter() - t) / len(sample) * args.records
+    print(f"per-item baseline ({len(sample):,} sampled) | ~{per_item:6.1f}s for {args.records:,} | bulk is {per_item / bulk:.0f}x faster")
+
+    await timed_import("vaults", jsonl(v), "vaults.jsonl")
+    for kind in ("vaults", "guides"):
+        if kind == "guides": await timed_import("guides", jsonl(g), "guides.jsonl")
+        for fmt in ("jsonl", "csv"):
+            out = io.StringIO()
+            t = time.perf_counter()
+            n = await bot.export_records(kind, out, fmt)
+            elapsed = time.perf_counter() - t
+            print(f"export {kind:>6} {fmt:>12} | {n:,} records | {elapsed:6.2f}s = {n / elapsed:9,.0f} records/s")
+    if args.mongo_url: await bot.client.drop_database("vault_bot_import_bench")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+# Offline load test: the real handlers from bot.build_app() against the fake
+# Bot API (bench/fake_telegram.py) and the in-memory Mongo stand-in
+# (bench/memory_mongo.py), or a local mongod with --mongo-url. A scripted
+# population replays /start, list browsing, search, numbered picks and vault
+# unlocks; the JSON report has throughput, per-flow p50/p95/p99 and per-flow
+# Mongo/API call counts (measured once per flow in isolation), so two commits
+# can be compared with a plain diff. --members simulates a replica set in the
+# stand-in (browse reads spread over the secondaries) with --mongo-pool
+# connections per member and --mongo-capacity concurrent operations each.
+#   python bench/loadtest.py --users 200 --sessions 5 --guides 20000 --out report.json
+#   python bench/loadtest.py --mongo-latency 0.005 --mongo-capacity 4 --members 3
+import os, sys, json, time, random, asyncio, argparse, subprocess
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+FLOWS = {"start": 2, "browse": 3, "search": 2, "pick": 3, "unlock": 1}
+
+def parse():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--sessions", type=int, default=5, help="flows per user")
+    p.add_argument("--guides", type=int, default=20_000)
+    p.add_argument("--vaults", type=int, default=500)
+    p.add_argument("--folders", type=int, default=20)
+    p.add_argument("--files", type=int, default=10, help="files per vault")
+    p.add_argument("--api-latency", type=float, default=0.02)
+    p.add_argument("--flood-rate", type=float, default=0.0, help="share of sends answered with 429")
+    p.add_argument("--mongo-latency", type=float, default=0.0, help="in-memory stand-in only")
+    p.add_argument("--members", type=int, default=1, help="simulated replica-set members (stand-in only)")
+    p.add_argument("--mongo-pool", type=int, default=0, help="connections per member (stand-in only; default MONGO_POOL_MAX)")
+    p.add_argument("--mongo-capacity", type=int, default=0, help="operations each member serves at once (stand-in only; 0 = unlimited)")
+    p.add_argument("--mongo-url", default="", help="use a local mongod (scratch db, dropped afterwards)")
+    p.add_argument("--throttle", action="store_true", help="keep Telegram's per-chat send limits")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default="")
+    return p.parse_args()
+
+args = parse()
+if not args.throttle:
+    # The per-chat pacing would dominate every vault unlock; the harness measures the bot, not Telegram.
+    os.environ.update(TG_CHAT_RATE="1000", TG_CHAT_BURST="1000", TG_GLOBAL_RATE="100000")
+os.environ.setdefault("MONGO_URL", args.mongo_url or "mongodb://127.0.0.1:1")
+
+import bot
+from telegram import Update
+from fake_telegram import FakeTelegram
+from memory_mongo import MemoryDatabase
+from search_bench import names
+
+def pct(xs, p): return round(sorted(xs)[min(len(xs) - 1, int(len(xs) * p))] * 1000, 2) if xs else None
+
+# --- DATA ---
+async def seed(rnd):
+    guides = []
+    for g_type, n in (("anime", args.guides // 2), ("movies", args.guides - args.guides // 2)):
+        for name in names(n, rnd):
+            guides.append({"type": g_type, "name": name, "file": f"photo_{len(guides)}", "media_type": rnd.choice(["photo", "video"]),
+                           "desc": "Synthetic description " * 5, "link": "https://example.org/watch", "chan_name": "Channel",
+                           "chan_link": "https://t.me/example", "search_keys": bot.search_keys(name)})
+    for i in range(0, len(guides), 10_000): await bot.col_guides.insert_many(guides[i:i + 10_000])
+    vaults = {}
+    for i in range(args.vaults):
+        v = {"folder": f"Folder {i % args.folders}", "sub_name": f"Pack {i}", "poster": f"poster_{i}", "desc": "Pack description",
+             "key": f"KEY{i:09d}", "file_count": args.files}
+        v["search_keys"] = bot.search_keys(v["sub_name"], v["folder"])
+        await bot.col_vaults.insert_one(v)
+        await bot.save_manifest(v["_id"], [{"id": f"file_{i}_{j}", "type": rnd.choice(["photo", "video", "document"])} for j in range(args.files)])
+        await bot.catalog_add(v)
+        vaults[v["_id"]] = v["key"]
+    return [g["name"] for g in guides], vaults
+
+# --- USERS ---
+class User:
+    def __init__(self, app, fake, uid, rnd, titles, vault_keys):
+        self.app, self.fake, self.uid, self.rnd = app, fake, uid, rnd
+        self.titles, self.vault_keys = titles, vault_keys
+        self.updates = 0
+
+    def _update(self, message=None, data=None):
+        self.updates += 1
+        user = {"id": self.uid, "is_bot": False, "first_name": f"User{self.uid}"}
+        chat = {"id": self.uid, "type": "private"}
+        uid = self.uid * 100_000 + self.updates
+        if data is not None:
+            raw = {"update_id": uid, "callback_query": {"id": str(uid), "from": user, "chat_instance": str(self.uid), "data": data,
+                   "message": {"message_id": uid, "date": int(time.time()), "chat": chat, "text": "menu",
+                               "from": {"id": 1, "is_bot": True, "first_name": "Bench"}}}}
+        else:
+            entities = [{"type": "bot_command", "offset": 0, "length": len(message)}] if message.startswith("/") else []
+            raw = {"update_id": uid, "message": {"message_id": uid, "date": int(time.time()), "chat": chat, "from": user,
+                                                 "text": message, "entities": entities}}
+        return Update.de_json(raw, self.app.bot)
+
+    async def send(self, message=None, data=None):
+        update = self._update(message, data)
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+
+    def button(self, label, default):
+        return next((cb for text, cb in self.fake.buttons(self.uid).items() if text and label in text), default)
+
+    async def start(self): await self.send("/start")
+
+    async def browse(self):
+        g_type = self.rnd.choice(["anime", "movies"])
+        await self.send(data=f"list_{g_type}_0")
+        for _ in range(self.rnd.randint(1, 3)):
+            nxt = self.button("Next", None)
+            if not nxt: break
+            await self.send(data=nxt)
+
+    async def search(self):
+        g_type = self.rnd.choice(["anime", "movies"])
+        await self.send(data=f"search_{g_type}")
+        title = self.rnd.choice(self.titles)
+        a = self.rnd.randrange(0, max(1, len(title) - 4))
+        await self.send(title[a:a + self.rnd.randint(3, 8)])
+
+    async def pick(self):
+        await self.send(data=f"list_{self.rnd.choice(['anime', 'movies'])}_0")
+        await self.send(str(self.rnd.randint(1, 50)))
+
+    async def unlock(self):
+        await self.send(data="u_vault_folders")
+        folder = f"Folder {self.rnd.randrange(args.folders)}"
+        await self.send(data=f"vfold_{folder}")
+        items, count = await bot.catalog_items(folder, 0, 100)
+        if not items: return
+        n = self.rnd.randrange(len(items))
+        await self.send(str(n + 1))
+        await self.send(self.vault_keys[items[n]["id"]])
+        # Delivery runs in the background; the flow ends when the pack is out.
+        while bot.deliveries.pending(self.uid): await asyncio.sleep(0.005)
+
+# --- COUNTS ---
+def mongo_calls(db):
+    if isinstance(db, MemoryDatabase): return Counter({f"{c}.{op}": n for (c, op), n in db.calls.items()})
+    with bot.mongo_seconds.lock: return Counter({f"{c}.{op}": s[-1] for (c, op), s in bot.mongo_seconds.series.items()})
+
+async def calibrate(app, fake, db, rnd, titles, vault_keys):
+    out = {}
+    for i, flow in enumerate(FLOWS):
+        user = User(app, fake, 9_000_000 + i, rnd, titles, vault_keys)
+        await user.start()
+        await asyncio.sleep(0)
+        m0, a0 = mongo_calls(db), Counter(fake.calls)
+        await getattr(user, flow)()
+        mongo, api = mongo_calls(db) - m0, Counter(fake.calls) - a0
+        out[flow] = {"updates": user.updates - 1, "mongo_calls": sum(mongo.values()), "api_calls": sum(api.values()),
+                     "mongo": dict(sorted(mongo.items())), "api": dict(sorted(api.items()))}
+    return out
+
+def mongo_report(db, members0, waits0):
+    if isinstance(db, MemoryDatabase):
+        waits = db.pool_waits[waits0:]
+        calls = Counter(db.member_calls) - members0
+        members = {("primary" if m == 0 else f"secondary{m}"): n for m, n in sorted(calls.items())}
+    else: waits, members = list(bot.pool_monitor.waits), {}
+    return {"members": args.members if isinstance(db, MemoryDatabase) else None, "calls_per_member": members,
+            "pool_wait_p50_ms": pct(waits, .5), "pool_wait_p95_ms": pct(waits, .95), "pool_wait_p99_ms": pct(waits, .99)}
+
+async def main():
+    rnd = random.Random(args.seed)
+    if args.mongo_url:
+        db = bot.client["vault_bot_loadtest"]
+        await bot.client.drop_database("vault_bot_loadtest")
+        for attr in dir(bot):
+            if attr.startswith("col_"): setattr(bot, attr, db[getattr(bot, attr).name])
+        bot.db = db
+        await bot.ensure_indexes()
+    else:
+        db = MemoryDatabase(latency=args.mongo_latency, members=args.members, pool=args.mongo_pool or bot.MONGO_POOL_MAX,
+                            capacity=args.mongo_capacity)
+        db.attach(bot)
+    t = time.perf_counter()
+    titles, vault_keys = await seed(rnd)
+    seeded = time.perf_counter() - t
+
+    fake = FakeTelegram(latency=args.api_latency, flood_rate=args.flood_rate, seed=args.seed)
+    await fake.start()
+    app = bot.build_app("1:loadtest", base_url=fake.base_url, webhook=True)
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    while not (bot.search_index.ready and bot.ordinal_index.ready): await asyncio.sleep(0.05)
+
+    per_flow = await calibrate(app, fake, db, rnd, titles, vault_keys)
+    latencies, errors = defaultdict(list), Counter()
+    flows, weights = list(FLOWS), list(FLOWS.values())
+
+    async def session(uid):
+        user = User(app, fake, uid, random.Random(args.seed * 1_000_003 + uid), titles, vault_keys)
+        for _ in range(args.sessions):
+            flow = user.rnd.choices(flows, weights)[0]
+            t = time.perf_counter()
+            try: await getattr(user, flow)()
+            except Exception as e: errors[f"{flow}: {type(e).__name__}"] += 1
+            latencies[flow].append(time.perf_counter() - t)
+        return user.updates
+
+    api0, handler_errors0 = sum(fake.calls.values()), sum(bot.handler_errors.series.values())
+    members0, waits0 = Counter(getattr(db, "member_calls", {})), len(getattr(db, "pool_waits", bot.pool_monitor.waits))
+    t = time.perf_counter()
+    updates = sum(await asyncio.gather(*(session(uid) for uid in range(1, args.users + 1))))
+    elapsed = time.perf_counter() - t
+
+    await app.stop()
+    await bot.stop_background()
+    await app.shutdown()
+    await fake.stop()
+    if args.mongo_url: await bot.client.drop_database("vault_bot_loadtest")
+
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=HERE).stdout.strip()
+    except OSError: commit = ""
+    report = {
+        "commit": commit,
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "seed_seconds": round(seeded, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "updates": updates,
+        "updates_per_second": round(updates / elapsed, 1),
+        "flows_per_second": round(sum(len(v) for v in latencies.values()) / elapsed, 1),
+        "api_calls": sum(fake.calls.values()) - api0,
+        "api_429s": sum(fake.floods.values()),
+        "handler_errors": sum(bot.handler_errors.series.values()) - handler_errors0,
+        "errors": dict(errors),
+        "mongo": mongo_report(db, members0, waits0),
+        "flows": {f: {"count": len(latencies[f]), "p50_ms": pct(latencies[f], .5), "p95_ms": pct(latencies[f], .95),
+                      "p99_ms": pct(latencies[f], .99), **per_flow[f]} for f in FLOWS},
+    }
+    text = json.dumps(report, indent=2, sort_keys=False)
+    if args.out:
+        with open(args.out, "w") as fh: fh.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,414 @@
+# An in-memory stand-in for the slice of Motor that bot.py uses: enough query,
+# projection and update operators for the bot's own queries, async cursors,
+# bulk_write with pymongo's op classes, a small aggregate, and per-(collection,
+# op) call counts.
+# No change streams, so the bot falls back to polling. `latency` adds a fake
+# round trip to every call, `index_build` a fake build time per created index.
+# `members` simulates a replica set: member 0 takes writes and primary reads,
+# reads made through with_options(read_preference=<not primary>) rotate over
+# the secondaries. Each member has a client pool of `pool` connections and
+# serves `capacity` operations at once (0 = unlimited); pool_waits records
+# every checkout wait. A cursor counts the index keys a server would walk for
+# it (skip + limit, as on a matching index) in `examined`, per collection.
+import re, copy, time, asyncio
+from contextlib import nullcontext
+from collections import Counter
+from types import SimpleNamespace
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne, DeleteOne, ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError
+
+MISSING = object()
+READS = {"find", "count", "distinct"}
+
+def get_path(doc, path):
+    for part in path.split("."):
+        if isinstance(doc, dict): doc = doc.get(part, MISSING)
+        elif isinstance(doc, list) and part.isdigit(): doc = doc[int(part)] if int(part) < len(doc) else MISSING
+        else: return MISSING
+        if doc is MISSING: return MISSING
+    return doc
+
+def _parent(doc, path, create=True):
+    *parents, last = path.split(".")
+    for part in parents:
+        if isinstance(doc, list): doc = doc[int(part)]
+        else: doc = doc.setdefault(part, {}) if create else doc.get(part, {})
+    return doc, last
+
+def _cmp(val, op, arg):
+    if val is MISSING or val is None: return False
+    try:
+        if op == "$gt": return val > arg
+        if op == "$gte": return val >= arg
+        if op == "$lt": return val < arg
+        return val <= arg
+    except TypeError: return False
+
+def _eq(val, arg):
+    return val == arg or (isinstance(val, list) and not isinstance(arg, list) and arg in val)
+
+# $in/$nin against a set when everything hashes; the last list is kept so a
+# scan tests every document against the same set.
+_in_set = (None, None)
+
+def _in(val, arg):
+    global _in_set
+    if not isinstance(val, (list, dict)):
+        if _in_set[0] is not arg:
+            try: _in_set = (arg, frozenset(arg))
+            except TypeError: _in_set = (arg, None)
+        if _in_set[1] is not None:
+            try: return val in _in_set[1]
+            except TypeError: pass
+    return any(_eq(val, a) for a in arg)
+
+def match_value(val, cond):
+    if not (isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond)): return _eq(val, cond)
+    for op, arg in cond.items():
+        if op in ("$gt", "$gte", "$lt", "$lte"):
+            vals = val if isinstance(val, list) else [val]
+            if not any(_cmp(v, op, arg) for v in vals): return False
+        elif op == "$ne":
+            if _eq(val, arg): return False
+        elif op == "$in":
+            if not _in(val, arg): return False
+        elif op == "$nin":
+            if _in(val, arg): return False
+        elif op == "$exists":
+            if (val is not MISSING) != bool(arg): return False
+        elif op == "$all":
+            if not isinstance(val, list) or not all(a in val for a in arg): return False
+        elif op == "$size":
+            if not isinstance(val, list) or len(val) != arg: return False
+        elif op == "$regex":
+            rx = re.compile(arg, re.I if "i" in cond.get("$options", "") else 0)
+            vals = val if isinstance(val, list) else [val]
+            if not any(isinstance(v, str) and rx.search(v) for v in vals): return False
+        elif op == "$options": continue
+        else: raise OperationFailure(f"memory_mongo: unsupported operator {op}")
+    return True
+
+def matches(doc, flt):
+    for key, cond in (flt or {}).items():
+        if key == "$or":
+            if not any(matches(doc, f) for f in cond): return False
+        elif key == "$and":
+            if not all(matches(doc, f) for f in cond): return False
+        elif not match_value(get_path(doc, key), cond): return False
+    return True
+
+def project(doc, projection):
+    if not projection: return copy.deepcopy(doc)
+    slices = {k: v["$slice"] for k, v in projection.items() if isinstance(v, dict) and "$slice" in v}
+    include = {k for k, v in projection.items() if v and k not in slices and k != "_id"}
+    if include or (slices and not any(v == 0 for v in projection.values())):
+        out = {k: copy.deepcopy(doc[k]) for k in include | set(slices) if k in doc}
+        if projection.get("_id", 1) and "_id" in doc: out["_id"] = doc["_id"]
+    else:
+        out = {k: copy.deepcopy(v) for k, v in doc.items() if projection.get(k, 1) != 0}
+    for k, sl in slices.items():
+        if isinstance(out.get(k), list):
+            skip, limit = sl if isinstance(sl, list) else (0, sl)
+            out[k] = out[k][skip:skip + limit]
+    return out
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            parent, last = _parent(doc, path)
+            if op == "$set" or (op == "$setOnInsert" and inserting): parent[last] = copy.deepcopy(arg)
+            elif op == "$unset":
+                if isinstance(parent, list): parent[int(last)] = None
+                else: parent.pop(last, None)
+            elif op == "$inc": parent[last] = parent.get(last, 0) + arg
+            elif op == "$push":
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                parent.setdefault(last, []).extend(copy.deepcopy(items))
+            elif op == "$addToSet":
+                lst = parent.setdefault(last, [])
+                for item in (arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]):
+                    if item not in lst: lst.append(copy.deepcopy(item))
+            elif op == "$pull":
+                if isinstance(parent.get(last), list):
+                    parent[last] = [x for x in parent[last] if not (matches(x, arg) if isinstance(arg, dict) and isinstance(x, dict) else match_value(x, arg))]
+            elif op != "$setOnInsert": raise OperationFailure(f"memory_mongo: unsupported update {op}")
+
+def _sort_key(spec):
+    def key(doc):
+        out = []
+        for field, direction in spec:
+            v = get_path(doc, field)
+            out.append((0, 0) if v is MISSING or v is None else (1, v))
+        return out
+    return key
+
+def _expr(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        v = get_path(doc, expr[1:])
+        return None if v is MISSING else v
+    if isinstance(expr, dict): return {k: _expr(doc, e) for k, e in expr.items()}
+    return expr
+
+def _group(docs, spec):
+    groups = {}
+    for d in docs:
+        key = _expr(d, spec["_id"])
+        g = groups.setdefault(repr(key), {"_id": key})
+        for field, acc in spec.items():
+            if field == "_id": continue
+            (op, expr), = acc.items()
+            if op == "$sum": g[field] = g.get(field, 0) + _expr(d, expr)
+            elif op == "$push": g.setdefault(field, []).append(_expr(d, expr))
+            else: raise OperationFailure(f"memory_mongo: unsupported accumulator {op}")
+    return list(groups.values())
+
+class MemoryCursor:
+    def __init__(self, col, flt, projection):
+        self.col, self.flt, self.projection = col, flt, projection
+        self._sort, self._skip, self._limit = [], 0, 0
+
+    def sort(self, key, direction=1):
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n): return self
+
+    def _run(self):
+        docs = self.col.scan(self.flt)
+        self.col.database.examined[self.col.name] += min(len(docs), self._skip + self._limit) if self._limit else len(docs)
+        # Stable sorts applied last key first give a multi-key sort with per-key direction.
+        for field, direction in reversed(self._sort):
+            docs.sort(key=_sort_key([(field, direction)]), reverse=direction == -1)
+        docs = docs[self._skip:self._skip + self._limit if self._limit else None]
+        return [project(d, self.projection) for d in docs]
+
+    async def to_list(self, length=None):
+        await self.col._op("find")
+        docs = self._run()
+        return docs[:length] if length else docs
+
+    def __aiter__(self): return self._iterate()
+
+    async def _iterate(self):
+        await self.col._op("find")
+        for d in self._run(): yield d
+
+class MemoryCollection:
+    def __init__(self, db, name):
+        self.database, self.name = db, name
+        self.docs = {}
+        self.indexes = {"_id_": {"_id": 1}}
+        self.read_preference = None
+
+    # A handle on the same documents that reads with another preference.
+    def with_options(self, read_preference=None, **kwargs):
+        view = copy.copy(self)
+        view.read_preference = read_preference
+        return view
+
+    # Docs that may match: direct lookups for _id equality / $in, else a full scan.
+    def scan(self, flt):
+        cond = (flt or {}).get("_id", MISSING)
+        if cond is MISSING: docs = list(self.docs.values())
+        elif isinstance(cond, dict) and set(cond) == {"$in"}: docs = [self.docs[i] for i in dict.fromkeys(cond["$in"]) if i in self.docs]
+        elif not isinstance(cond, dict): docs = [self.docs[cond]] if cond in self.docs else []
+        else: docs = list(self.docs.values())
+        return [d for d in docs if matches(d, flt)]
+
+    async def _op(self, op):
+        self.database.calls[(self.name, op)] += 1
+        rp = self.read_preference
+        await self.database.round_trip(op in READS and rp is not None and rp.mode != 0)
+
+    def _first(self, flt, sort=None):
+        docs = self.scan(flt)
+        if sort: docs.sort(key=_sort_key(sort), reverse=sort[0][1] == -1)
+        return docs[0] if docs else None
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs: raise DuplicateKeyError("E11000 duplicate key error")
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+
+    def _upsert(self, flt, update, replace=False):
+        doc = {k: v for k, v in flt.items() if not k.startswith("$") and not isinstance(v, dict)}
+        if replace: doc.update(copy.deepcopy(update))
+        else: apply_update(doc, update, inserting=True)
+        self._insert(doc)
+        return doc["_id"]
+
+    def _update(self, flt, update, upsert=False, many=False):
+        hits = self.scan(flt)
+        if not many: hits = hits[:1]
+        for d in hits: apply_update(d, update)
+        upserted = self._upsert(flt, update) if upsert and not hits else None
+        return SimpleNamespace(matched_count=len(hits), modified_count=len(hits), upserted_id=upserted)
+
+    def find(self, filter=None, projection=None): return MemoryCursor(self, filter or {}, projection)
+
+    async def find_one(self, filter=None, projection=None, sort=None):
+        await self._op("find")
+        doc = self._first(filter or {}, sort)
+        return project(doc, projection) if doc else None
+
+    async def insert_one(self, doc):
+        await self._op("insert")
+        self._insert(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        await self._op("insert")
+        for d in docs: self._insert(d)
+        return SimpleNamespace(inserted_ids=[d["_id"] for d in docs])
+
+    async def update_one(self, filter, update, upsert=False):
+        await self._op("update")
+        return self._update(filter, update, upsert)
+
+    async def update_many(self, filter, update, upsert=False):
+        await self._op("update")
+        return self._update(filter, update, upsert, many=True)
+
+    async def replace_one(self, filter, doc, upsert=False):
+        await self._op("update")
+        hit = self._first(filter)
+        if hit: self.docs[hit["_id"]] = dict(copy.deepcopy(doc), _id=hit["_id"])
+        elif upsert: self._upsert(filter, doc, replace=True)
+        return SimpleNamespace(matched_count=int(bool(hit)))
+
+    async def delete_one(self, filter):
+        await self._op("delete")
+        hit = self._first(filter)
+        if hit: del self.docs[hit["_id"]]
+        return SimpleNamespace(deleted_count=int(bool(hit)))
+
+    async def delete_many(self, filter):
+        await self._op("delete")
+        ids = [d["_id"] for d in self.scan(filter)]
+        for i in ids: del self.docs[i]
+        return SimpleNamespace(deleted_count=len(ids))
+
+    async def find_one_and_delete(self, filter, projection=None):
+        await self._op("findAndModify")
+        hit = self._first(filter)
+        if hit: del self.docs[hit["_id"]]
+        return project(hit, projection) if hit else None
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False, return_document=ReturnDocument.BEFORE):
+        await self._op("findAndModify")
+        hit = self._first(filter)
+        before = copy.deepcopy(hit) if hit else None
+        if hit: apply_update(hit, update)
+        elif upsert: hit = self.docs[self._upsert(filter, update)]
+        doc = hit if return_document == ReturnDocument.AFTER else before
+        return project(doc, projection) if doc else None
+
+    async def count_documents(self, filter):
+        await self._op("count")
+        return len(self.scan(filter))
+
+    async def estimated_document_count(self):
+        await self._op("count")
+        return len(self.docs)
+
+    async def distinct(self, key, filter=None):
+        await self._op("distinct")
+        out = []
+        for d in self.docs.values():
+            v = get_path(d, key)
+            if v is not MISSING and matches(d, filter or {}) and v not in out: out.append(v)
+        return out
+
+    # $match, inclusion $project, $sort and $group with $sum/$push of "$field" expressions.
+    async def aggregate(self, pipeline):
+        await self._op("aggregate")
+        docs = [copy.deepcopy(d) for d in self.docs.values()]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match": docs = [d for d in docs if matches(d, arg)]
+            elif op == "$project": docs = [project(d, arg) for d in docs]
+            elif op == "$sort":
+                spec = list(arg.items())
+                docs.sort(key=_sort_key(spec), reverse=spec[0][1] < 0)
+            elif op == "$group": docs = _group(docs, arg)
+            else: raise OperationFailure(f"memory_mongo: unsupported stage {op}")
+        for d in docs: yield d
+
+    async def bulk_write(self, ops, ordered=True):
+        await self._op("bulk_write")
+        for op in ops:
+            if isinstance(op, UpdateOne): self._update(op._filter, op._doc, op._upsert)
+            elif isinstance(op, ReplaceOne):
+                hit = self._first(op._filter)
+                if hit: self.docs[hit["_id"]] = dict(copy.deepcopy(op._doc), _id=hit["_id"])
+                elif op._upsert: self._upsert(op._filter, op._doc, replace=True)
+            elif isinstance(op, DeleteOne):
+                hit = self._first(op._filter)
+                if hit: del self.docs[hit["_id"]]
+            else: raise OperationFailure(f"memory_mongo: unsupported bulk op {type(op).__name__}")
+        return SimpleNamespace(acknowledged=True)
+
+    async def create_index(self, keys, **kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = "_".join(f"{k}_{d}" for k, d in keys)
+        if name not in self.indexes and self.database.index_build: await asyncio.sleep(self.database.index_build)
+        self.indexes[name] = dict(keys, **({"unique": True} if kwargs.get("unique") else {}))
+        return name
+
+    async def create_indexes(self, models):
+        return [await self.create_index(list(m.document["key"].items()), unique=m.document.get("unique", False)) for m in models]
+
+    async def list_indexes(self):
+        await self._op("listIndexes")
+        for name, spec in self.indexes.items():
+            keys = {k: v for k, v in spec.items() if k != "unique"}
+            yield {"name": name, "key": keys, **({"unique": True} if spec.get("unique") else {})}
+
+    async def drop(self): self.docs.clear()
+
+    def watch(self, *args, **kwargs): raise NotImplementedError("memory_mongo has no change streams")
+
+class MemoryDatabase:
+    def __init__(self, name="vault_bot_db", latency=0.0, index_build=0.0, members=1, pool=0, capacity=0):
+        self.name, self.latency, self.index_build = name, latency, index_build
+        self.calls, self.examined = Counter(), Counter()
+        self.members, self.member_calls, self.pool_waits = members, Counter(), []
+        self._pools = [asyncio.Semaphore(pool) if pool else nullcontext() for _ in range(members)]
+        self._servers = [asyncio.Semaphore(capacity) if capacity else nullcontext() for _ in range(members)]
+        self._turn = 0
+        self._cols = {}
+
+    async def round_trip(self, secondary_ok):
+        member = 0
+        if secondary_ok and self.members > 1:
+            self._turn += 1
+            member = 1 + self._turn % (self.members - 1)
+        self.member_calls[member] += 1
+        if not self.latency: return
+        asked = time.perf_counter()
+        async with self._pools[member]:
+            self.pool_waits.append(time.perf_counter() - asked)
+            async with self._servers[member]: await asyncio.sleep(self.latency)
+
+    def __getitem__(self, name):
+        if name not in self._cols: self._cols[name] = MemoryCollection(self, name)
+        return self._cols[name]
+
+    async def command(self, cmd, **kwargs):
+        if cmd == "ping" or cmd == {"ping": 1}: return {"ok": 1.0}
+        raise OperationFailure(f"memory_mongo: unsupported command {cmd}")
+
+    # Points every col_* global of the bot module (and its db) at this database.
+    def attach(self, bot):
+        bot.db = self
+        for attr in dir(bot):
+            if attr.startswith("col_"): setattr(bot, attr, self[getattr(bot, attr).name])
@@ -0,0 +1,51 @@
+# Instrumentation overhead: the timed() handler wrapper around a list-page
+# render (escape + keyboard build, no I/O, so the worst case for relative
+# cost), plus the per-command cost of the Mongo listener and a /metrics scrape.
+#   python bench/metrics_bench.py [iterations]
+import os, sys, time, html, asyncio
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import bot
+
+NAMES = [f"Some <Title> & Friends {i}" for i in range(50)]
+UPDATE = SimpleNamespace(callback_query=SimpleNamespace(data="list_anime_3"))
+
+async def user_router(update, context):
+    txt = "".join(f"<b>{i + 1}.</b> {html.escape(n)}\n" for i, n in enumerate(NAMES))
+    kb = [[InlineKeyboardButton("⬅️ Prev", callback_data="list_anime_2"), InlineKeyboardButton("Next ➡️", callback_data="list_anime_4")],
+          [InlineKeyboardButton("🔍 Search", callback_data="search_anime")], [InlineKeyboardButton("🔙 Back", callback_data="main")]]
+    return txt, InlineKeyboardMarkup(kb)
+
+async def per_call(fn, n):
+    t = time.perf_counter()
+    for _ in range(n): await fn(UPDATE, None)
+    return (time.perf_counter() - t) / n
+
+async def main(n):
+    bare = min([await per_call(user_router, n) for _ in range(3)])
+    wrapped = min([await per_call(bot.timed(user_router), n) for _ in range(3)])
+    print(f"handler {bare * 1e6:7.1f}us bare, {wrapped * 1e6:7.1f}us timed -> +{(wrapped - bare) * 1e6:.1f}us"
+          f" ({(wrapped - bare) / bare:.1%} of a handler with no I/O at all, {(wrapped - bare) / 0.002:.2%} of a 2ms one)")
+
+    # A list-page find as Motor sends it; the other database is the listener's metrics-only path.
+    command = {"find": "guides", "filter": {"type": "anime", "name": {"$gt": "Naruto"}}, "sort": {"name": 1, "_id": 1},
+               "limit": 10, "projection": {"name": 1}, "lsid": {"id": "x"}, "$db": bot.DB_NAME}
+    reply = {"cursor": {"firstBatch": [{}] * 10, "id": 0}, "ok": 1}
+    for database in ("admin", bot.DB_NAME):
+        started = SimpleNamespace(command=command, command_name="find", database_name=database, connection_id=("h", 1), request_id=1)
+        done = SimpleNamespace(command_name="find", connection_id=("h", 1), request_id=1, duration_micros=900, reply=reply)
+        t = time.perf_counter()
+        for _ in range(n):
+            bot.mongo_monitor.started(started)
+            bot.mongo_monitor.succeeded(done)
+        per = (time.perf_counter() - t) / n
+        label = "metrics only" if database == "admin" else "with profiler"
+        print(f"mongo listener {per * 1e6:5.2f}us per command, {label} ({per / 0.001:.2%} of a 1ms round trip)")
+
+    t = time.perf_counter()
+    text = bot.metrics.render()
+    print(f"/metrics scrape {(time.perf_counter() - t) * 1000:.2f}ms for {text.count(chr(10))} lines")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000))
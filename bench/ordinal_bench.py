@@ -0,0 +1,41 @@
+# "Reply with number" cost: skip(n-1) on the (type, _id) index vs. the
+# in-memory ordinal index + fetch by _id, against bench/memory_mongo.py. A
+# skip costs the server the index keys it walks; the stand-in counts them, and
+# the modeled pick time is one round trip plus key_cost per key examined. (Its
+# own wall time is Python scanning the whole collection, so it isn't shown.)
+#   python bench/ordinal_bench.py [latency] [key_cost] [sizes...]
+import os, sys, time, asyncio, random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+import bot
+from memory_mongo import MemoryDatabase
+
+def pct(xs, p): return sorted(xs)[min(len(xs) - 1, int(len(xs) * p))]
+
+async def run(n, latency, key_cost, picks=100):
+    db = MemoryDatabase()
+    db.attach(bot)
+    col = bot.col_guides
+    await col.insert_many([{"type": "anime", "name": f"Title {j}", "file": "x"} for j in range(n)])
+    idx = bot.OrdinalIndex()
+    t = time.perf_counter()
+    await idx.rebuild()
+    build = time.perf_counter() - t
+    skip, ordinal = [], []
+    for pos in (random.randint(1, n) for _ in range(picks)):
+        for keys, fetch in ((skip, col.find({"type": "anime"}).sort("_id", 1).skip(pos - 1).limit(1)),
+                            (ordinal, col.find({"_id": idx.at("anime", pos)}))):
+            before = db.examined["guides"]
+            await fetch.to_list(1)
+            keys.append(db.examined["guides"] - before)
+    ms = lambda keys, p: (latency + pct(keys, p) * key_cost) * 1000
+    print(f"{n:>9,} guides | rebuild {build:5.2f}s | skip {sum(skip) / picks:8,.0f} keys/pick p50 {ms(skip, .5):6.2f}ms"
+          f" p99 {ms(skip, .99):6.2f}ms | ordinal {sum(ordinal) / picks:3,.0f} keys/pick p50 {ms(ordinal, .5):5.2f}ms p99 {ms(ordinal, .99):5.2f}ms")
+
+async def main(latency, key_cost, sizes):
+    for n in sizes: await run(n, latency, key_cost)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(float(args[0]) if args else 0.0005, float(args[1]) if len(args) > 1 else 1e-6,
+                     [int(x) for x in args[2:]] or [1_000, 10_000, 100_000]))
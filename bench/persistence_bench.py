@@ -0,0 +1,57 @@
+# Session persistence: startup cost (lazy, so only in-flight conversations are
+# read), first-touch load latency per user, and the write-behind flush: every
+# user's data and conversation are updated `edits` times, as a few handler runs
+# would, and one flush coalesces them into one write per key, sent as
+# PERSIST_BATCH-sized bulk_writes. Against bench/memory_mongo.py with a fake
+# round trip; reports updates made vs. writes and Mongo round trips.
+#   python bench/persistence_bench.py [latency] [edits] [users...]
+import os, sys, time, asyncio, random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+import bot
+from memory_mongo import MemoryDatabase
+
+def pct(xs, p): return sorted(xs)[min(len(xs) - 1, int(len(xs) * p))] * 1000
+
+def session(uid, edit=0):
+    return {"view_type": "anime", "search_query": f"query {uid} {edit}", "active_vault_folder": "Folder",
+            "v_data": {"folder": "Folder", "sub_name": "Pack", "files": [{"id": f"file{uid}_{i}", "type": "video"} for i in range(5)]}}
+
+async def run(n, latency, edits, touches=500):
+    db = MemoryDatabase(latency=latency)
+    db.attach(bot)
+    await bot.col_sessions.insert_many([{"_id": f"u{u}", "data": session(u)} for u in range(n)])
+    await bot.col_conversations.insert_many([{"_id": f"main:{u}:{u}", "state": bot.U_GUIDE_SELECT} for u in range(0, n, 100)])
+
+    p = bot.MongoPersistence()
+    t = time.perf_counter()
+    await p.get_user_data()
+    convs = await p.get_conversations("main")
+    startup = time.perf_counter() - t
+
+    loads = []
+    for uid in random.sample(range(n), min(touches, n)):
+        t = time.perf_counter()
+        await p.refresh_user_data(uid, {})
+        loads.append(time.perf_counter() - t)
+
+    calls = sum(db.calls.values())
+    for edit in range(edits):
+        for uid in range(n):
+            await p.update_user_data(uid, session(uid, edit))
+            await p.update_conversation("main", (uid, uid), bot.U_GUIDE_SELECT if edit < edits - 1 else None)
+    t = time.perf_counter()
+    await p.flush()
+    flush = time.perf_counter() - t
+    print(f"{n:>9,} users | startup {startup * 1000:7.1f}ms ({len(convs):,} open conversations)"
+          f" | first load p50 {pct(loads, .5):5.2f}ms p99 {pct(loads, .99):5.2f}ms"
+          f" | {2 * n * edits:,} updates -> {p.writes:,} writes in {p.flushes} flush, {sum(db.calls.values()) - calls} round trips,"
+          f" {flush:5.2f}s = {n / flush:9,.0f} users/s")
+
+async def main(latency, edits, sizes):
+    for n in sizes: await run(n, latency, edits)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(float(args[0]) if args else 0.001, int(args[1]) if len(args) > 1 else 3,
+                     [int(x) for x in args[2:]] or [10_000, 100_000]))
@@ -0,0 +1,50 @@
+# Search latency of the in-memory trigram index vs. an unanchored
+# case-insensitive regex scan (what $regex did server-side, minus network).
+#   python bench/search_bench.py [sizes...]
+import os, sys, re, time, random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bson import ObjectId
+import bot
+
+SYLLABLES = "ka ki ku ke ko sa shi su se so ta chi tsu te to na ni nu ne no ha hi fu he ho ma mi mu me mo ya yu yo ra ri ru re ro wa n ga gi gu ge go za ji zu ze zo ba bi bu be bo pa pi pu pe po".split()
+
+def vocabulary(rnd, size=20_000):
+    return ["".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) for _ in range(size)]
+
+# Title words follow a Zipf-like distribution, like real catalogues.
+def names(n, rnd):
+    vocab = vocabulary(rnd)
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    words = rnd.choices(vocab, weights, k=n * 3)
+    return [" ".join(words[i * 3:i * 3 + rnd.randint(1, 3)]) + f" {i % 997}" for i in range(n)]
+
+def pct(xs, p): return sorted(xs)[min(len(xs) - 1, int(len(xs) * p))] * 1000
+
+def run(n, queries=200, scan_queries=20):
+    rnd = random.Random(n)
+    data = names(n, rnd)
+    idx = bot.SearchIndex()
+    t = time.perf_counter()
+    for name in data: idx.add("anime", ObjectId(), name)
+    build = time.perf_counter() - t
+    qs = []
+    for _ in range(queries):
+        name = rnd.choice(data)
+        a = rnd.randrange(0, max(1, len(name) - 5))
+        qs.append(name[a:a + rnd.randint(3, 8)])
+    lat = []
+    for q in qs:
+        t = time.perf_counter()
+        idx.search("anime", q, 50)
+        lat.append(time.perf_counter() - t)
+    scan = []
+    for q in qs[:scan_queries]:
+        rx = re.compile(re.escape(q), re.I)
+        t = time.perf_counter()
+        [x for x in data if rx.search(x)][:50]
+        scan.append(time.perf_counter() - t)
+    print(f"{n:>9,} docs | build {build:6.1f}s | index p50 {pct(lat, .5):7.2f}ms p99 {pct(lat, .99):7.2f}ms"
+          f" | regex scan p50 {pct(scan, .5):8.2f}ms p99 {pct(scan, .99):8.2f}ms")
+
+if __name__ == "__main__":
+    for n in [int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]: run(n)
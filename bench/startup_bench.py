@@ -0,0 +1,80 @@
+# Cold start: a fresh process serving webhook updates from bench/fake_telegram.py
+# on top of bench/memory_mongo.py with a fake Mongo round trip and index build
+# time. "blocking" builds indexes and warms caches before serving (the old
+# order), "background" serves first. Reports seconds from process start until
+# "/" answers, "/ready" answers 200 and the first /start gets its reply (the
+# time spent seeding the fake database is left out).
+#   python bench/startup_bench.py [mongo_latency] [index_build]
+import time
+T0 = time.monotonic()
+import os, sys, json, asyncio, subprocess
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+
+BOT_PORT = 8087
+
+async def child(mode, latency, index_build):
+    global T0
+    import aiohttp
+    import bot
+    from fake_telegram import FakeTelegram
+    from memory_mongo import MemoryDatabase
+    db = MemoryDatabase(latency=latency, index_build=index_build)
+    db.attach(bot)
+    seeding = time.monotonic()
+    for t in bot.GUIDE_TYPES:
+        await bot.col_guides.insert_many([{"type": t, "name": f"{t} {i}", "search_keys": []} for i in range(200)])
+    for i in range(40):
+        v = {"folder": f"Folder {i % 8}", "sub_name": f"Pack {i}", "key": f"K{i}", "file_count": 0}
+        await bot.col_vaults.insert_one(v)
+        await bot.catalog_add(v)
+    T0 += time.monotonic() - seeding
+    bot.startup.began = T0
+
+    fake = FakeTelegram()
+    await fake.start()
+    app = bot.build_app("1:startup", base_url=fake.base_url, webhook=True)
+    if mode == "blocking":
+        await bot.ensure_indexes()
+        await bot.warm_up()
+    stop = asyncio.Event()
+    server = asyncio.create_task(bot.serve(app, "http://127.0.0.1", BOT_PORT, stop))
+    out, base = {}, f"http://127.0.0.1:{BOT_PORT}"
+    start = {"update_id": 1, "message": {"message_id": 1, "date": int(time.time()), "text": "/start",
+             "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+             "chat": {"id": 7, "type": "private"}, "from": {"id": 7, "is_bot": False, "first_name": "U"}}}
+    async with aiohttp.ClientSession() as http:
+        async def get(path):
+            try:
+                async with http.get(base + path) as r: return r.status
+            except aiohttp.ClientError: return None
+        while await get("/") != 200: await asyncio.sleep(0.005)
+        out["live"] = time.monotonic() - T0
+        while True:
+            try:
+                async with http.post(base + bot.WEBHOOK_PATH, json=start) as r:
+                    if r.status == 200: break
+            except aiohttp.ClientError: pass
+            await asyncio.sleep(0.005)
+        while not any(n for m, n in fake.calls.items() if m.startswith("send")): await asyncio.sleep(0.005)
+        out["first_reply"] = time.monotonic() - T0
+        while await get("/ready") != 200: await asyncio.sleep(0.01)
+        out["ready"] = time.monotonic() - T0
+    stop.set()
+    await server
+    await fake.stop()
+    print(json.dumps(out))
+
+def main(latency, index_build):
+    for mode in ("blocking", "background"):
+        r = subprocess.run([sys.executable, __file__, "--child", mode, str(latency), str(index_build)], capture_output=True, text=True)
+        try: res = json.loads(r.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError): sys.exit(r.stderr)
+        print(f"{mode:>10} | live {res['live']:5.2f}s | first reply {res['first_reply']:5.2f}s | ready {res['ready']:5.2f}s")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]: asyncio.run(child(sys.argv[2], float(sys.argv[3]), float(sys.argv[4])))
+    else:
+        args = [float(x) for x in sys.argv[1:]]
+        main(args[0] if args else 0.005, args[1] if len(args) > 1 else 1.0)
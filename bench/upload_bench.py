@@ -0,0 +1,88 @@
+# Bulk upload ingest: an admin forwards N files (albums of 10) in one burst
+# while the conversation sits in A_V_FILES, then sends /done. "legacy" is the
+# previous v_collect (files kept in user_data, a reply every 5th file);
+# "staged" is the current one (vault_staging, $push/$each per album). Runs the
+# real app against bench/fake_telegram.py and bench/memory_mongo.py.
+#   python bench/upload_bench.py [files] [api_latency] [mongo_latency]
+import os, sys, time, asyncio
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.update(ADMIN_ID="42", TG_CHAT_RATE="1000", TG_CHAT_BURST="1000", TG_GLOBAL_RATE="100000")
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+import bot
+from telegram import Update
+from telegram.ext import ConversationHandler
+from fake_telegram import FakeTelegram
+from memory_mongo import MemoryDatabase
+
+ADMIN = 42
+current_collect = bot.v_collect
+
+async def legacy_collect(update, context):
+    msg_text = update.message.text or ""
+    if msg_text.lower() == "/done":
+        files = context.user_data["v_data"]["files"]
+        v = {k: x for k, x in context.user_data["v_data"].items() if k != "files"}
+        v.update(key=bot.new_vault_key(), file_count=len(files), search_keys=bot.search_keys(v["sub_name"], v["folder"]))
+        await bot.col_vaults.insert_one(v)
+        await bot.save_manifest(v["_id"], files)
+        await bot.catalog_add(v)
+        await update.message.reply_text(f"✅ Bulk Saved! {len(files)}"); return ConversationHandler.END
+    fid, ftype = bot.get_file_info(update.message)
+    if fid:
+        context.user_data["v_data"]["files"].append({"id": fid, "type": ftype})
+        count = len(context.user_data["v_data"]["files"])
+        if count % 5 == 0 or count == 1:
+            await update.message.reply_text(f"✅ {count} files queued. Send more or /done")
+    return bot.A_V_FILES
+
+def update(app, i, text=None):
+    chat, user = {"id": ADMIN, "type": "private"}, {"id": ADMIN, "is_bot": False, "first_name": "Admin"}
+    msg = {"message_id": i, "date": int(time.time()), "chat": chat, "from": user}
+    if text: msg.update(text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}])
+    else: msg.update(document={"file_id": f"doc_{i}", "file_unique_id": f"u{i}"}, media_group_id=f"g{i // 10}",
+                     forward_date=int(time.time()))
+    return Update.de_json({"update_id": i, "message": msg}, app.bot)
+
+async def run(mode, n, api_latency, mongo_latency):
+    db = MemoryDatabase(latency=mongo_latency)
+    db.attach(bot)
+    bot.v_collect = legacy_collect if mode == "legacy" else current_collect
+    fake = FakeTelegram(latency=api_latency)
+    await fake.start()
+    app = bot.build_app("1:upload", base_url=fake.base_url, webhook=True)
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+
+    v_data = {"folder": "Bench", "sub_name": "Upload", "poster": "poster", "desc": "desc"}
+    conv = next(h for h in app.handlers[0] if isinstance(h, ConversationHandler))
+    conv._conversations[(ADMIN, ADMIN)] = bot.A_V_FILES
+    await bot.col_conversations.replace_one({"_id": f"main:{ADMIN}:{ADMIN}"}, {"state": bot.A_V_FILES}, upsert=True)
+    if mode == "legacy": app.user_data[ADMIN]["v_data"] = {**v_data, "files": []}
+    else: await bot.stager.begin(ADMIN, v_data)
+
+    async def send(u): await app.update_processor.process_update(u, app.process_update(u))
+    m0, a0, d0 = sum(db.calls.values()), sum(fake.calls.values()), bot.update_processor.dropped_full
+    t = time.perf_counter()
+    await asyncio.gather(*(send(update(app, i)) for i in range(1, n + 1)))
+    ingest = time.perf_counter() - t
+    await send(update(app, n + 1, "/done"))
+    total = time.perf_counter() - t
+    mongo, api = sum(db.calls.values()) - m0, sum(fake.calls.values()) - a0
+    saved = (await bot.col_vaults.find_one({"sub_name": "Upload"}) or {}).get("file_count", 0)
+
+    await app.stop()
+    await bot.stop_background()
+    await app.shutdown()
+    await fake.stop()
+    print(f"{mode:>7} | {n:,} files | ingest {n / ingest:7,.0f} files/s | with /done {total:6.2f}s | saved {saved:,}"
+          f" | mongo calls {mongo:,} | api calls {api:,} | dropped {bot.update_processor.dropped_full - d0}")
+
+async def main(n, api_latency, mongo_latency):
+    for mode in ("legacy", "staged"): await run(mode, n, api_latency, mongo_latency)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if args else 1000, float(args[1]) if len(args) > 1 else 0.02,
+                     float(args[2]) if len(args) > 2 else 0.002))
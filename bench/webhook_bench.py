@@ -0,0 +1,64 @@
+# Update intake: webhook (POSTs into the bounded update queue) vs. long polling,
+# both against bench/fake_telegram.py. Every update is a /start-like text whose
+# handler answers with one sendMessage, so "processed" is end to end.
+#   python bench/webhook_bench.py [updates] [concurrency]
+import os, sys, time, asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aiohttp
+from telegram.ext import Application, MessageHandler, filters
+import bot
+from fake_telegram import FakeTelegram
+
+BOT_PORT = 8088
+
+def update(i):
+    return {"update_id": i, "message": {"message_id": i, "date": int(time.time()), "text": "hi",
+                                        "chat": {"id": 1000 + i % 500, "type": "private"},
+                                        "from": {"id": 1000 + i % 500, "is_bot": False, "first_name": "U"}}}
+
+async def reply(update, context): await context.bot.send_message(update.effective_chat.id, "ok")
+
+async def run(mode, n, concurrency):
+    fake = FakeTelegram()
+    await fake.start()
+    builder = Application.builder().token("1:bench").base_url(fake.base_url).update_queue(asyncio.Queue(bot.UPDATE_QUEUE_SIZE))
+    if mode == "webhook": builder.updater(None)
+    app = builder.build()
+    app.add_handler(MessageHandler(filters.TEXT, reply))
+    stop = asyncio.Event()
+    server = asyncio.create_task(bot.serve(app, "http://127.0.0.1" if mode == "webhook" else "", BOT_PORT, stop))
+    while fake.calls["setWebhook" if mode == "webhook" else "getUpdates"] == 0: await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    rejected = 0
+    if mode == "webhook":
+        sem = asyncio.Semaphore(concurrency)
+        async with aiohttp.ClientSession() as http:
+            async def post(i):
+                nonlocal rejected
+                async with sem:
+                    while True:
+                        async with http.post(f"http://127.0.0.1:{BOT_PORT}{bot.WEBHOOK_PATH}", json=update(i),
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET}) as r:
+                            if r.status != 503: return
+                            rejected += 1   # queue full: back off like Telegram would
+                        await asyncio.sleep(0.05)
+            await asyncio.gather(*(post(i) for i in range(1, n + 1)))
+    else:
+        for i in range(1, n + 1): fake.updates.put_nowait(update(i))
+    intake = time.perf_counter() - started
+    await fake.wait_for("sendMessage", n)
+    total = time.perf_counter() - started
+    stop.set()
+    await server
+    await fake.stop()
+    intake_rate = f"{n / intake:9,.0f}/s" if mode == "webhook" else "        -"
+    print(f"{mode:>8} | {n:,} updates | intake {intake_rate} | processed {fake.calls['sendMessage'] / total:7,.0f}/s"
+          f" | 503s {rejected}")
+
+async def main(n, concurrency):
+    for mode in ("polling", "webhook"): await run(mode, n, concurrency)
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]]
+    asyncio.run(main(args[0] if args else 5000, args[1] if len(args) > 1 else 40))
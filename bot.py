@@ -1,37 +1,474 @@
-import os, asyncio, secrets, logging, html, math, re
-from datetime import datetime
-from flask import Flask
-from threading import Thread
+import os, asyncio, secrets, logging, html, math, re, time, itertools, unicodedata, bisect, signal, functools, threading, json, io, csv, tempfile
+from array import array
+from collections import deque, defaultdict, OrderedDict
+from datetime import datetime, timedelta
+from aiohttp import web
 import certifi 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InputMediaPhoto
+import httpx
+from telegram import __version__ as PTB_VERSION
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputFile
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter, TimedOut, BadRequest
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
-    MessageHandler, filters, ContextTypes, ConversationHandler, Defaults
+    MessageHandler, filters, ContextTypes, ConversationHandler, Defaults, BaseRateLimiter,
+    BasePersistence, PersistenceInput, BaseUpdateProcessor, TypeHandler
 )
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReplaceOne, DeleteOne, ReturnDocument, IndexModel
+from pymongo.errors import OperationFailure, BulkWriteError
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 from bson import ObjectId
 
 # --- LOGGING ---
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per API call, token in the URL
 
 # --- CONFIG ---
 TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 MONGO_URL = os.getenv("MONGO_URL")
+DB_NAME = "vault_bot_db"
+MONGO_POOL_MAX = int(os.getenv("MONGO_POOL_MAX", "50"))   # per server; Motor keeps one pool per replica-set member
+MONGO_POOL_MIN = int(os.getenv("MONGO_POOL_MIN", "1"))
+MONGO_POOL_WAIT_MS = int(os.getenv("MONGO_POOL_WAIT_MS", "10000"))
+MONGO_CONNECT_MS = int(os.getenv("MONGO_CONNECT_MS", "10000"))
+MONGO_SOCKET_MS = int(os.getenv("MONGO_SOCKET_MS", "0"))   # 0 = no socket timeout
+MONGO_SELECT_MS = int(os.getenv("MONGO_SELECT_MS", "5000"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")   # e.g. "zstd,zlib"; zstd needs zstandard, snappy python-snappy
+MONGO_BROWSE_READ = os.getenv("MONGO_BROWSE_READ", "secondaryPreferred")   # read preference for browse reads
+MONGO_MAX_STALENESS = int(os.getenv("MONGO_MAX_STALENESS", "90"))   # seconds a browse read may lag; Mongo's floor is 90, 0 = unbounded
 PORT = int(os.getenv("PORT", "8080"))
+SETTINGS_TTL = int(os.getenv("SETTINGS_TTL", "300"))
+WATCH_POLL_INTERVAL = int(os.getenv("WATCH_POLL_INTERVAL", "30"))
+VAULT_DELIVERY_MODE = os.getenv("VAULT_DELIVERY_MODE", "album")  # album | single
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2000"))
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_USER_JOBS = int(os.getenv("DELIVERY_USER_JOBS", "3"))
+DELIVERY_LEASE = int(os.getenv("DELIVERY_LEASE", "60"))
+DELIVERY_CLAIM_INTERVAL = int(os.getenv("DELIVERY_CLAIM_INTERVAL", "15"))
+DELIVERY_PROGRESS_EVERY = float(os.getenv("DELIVERY_PROGRESS_EVERY", "3"))
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "1000"))
+STAGE_BATCH = int(os.getenv("STAGE_BATCH", "100"))
+STAGE_FLUSH = float(os.getenv("STAGE_FLUSH", "1"))
+STAGE_PROGRESS_EVERY = float(os.getenv("STAGE_PROGRESS_EVERY", "3"))
+WARM_FOLDERS = int(os.getenv("WARM_FOLDERS", "20"))
+MEDIA_HEALTH_SIZE = int(os.getenv("MEDIA_HEALTH_SIZE", "50000"))
+MEDIA_DEAD_AFTER = int(os.getenv("MEDIA_DEAD_AFTER", "3"))
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+TG_CONTROL_POOL = int(os.getenv("TG_CONTROL_POOL", "16"))
+TG_MEDIA_POOL = int(os.getenv("TG_MEDIA_POOL", "8"))
+TG_UPDATES_POOL = int(os.getenv("TG_UPDATES_POOL", "1"))
+TG_CONTROL_TIMEOUT = float(os.getenv("TG_CONTROL_TIMEOUT", "10"))
+TG_MEDIA_TIMEOUT = float(os.getenv("TG_MEDIA_TIMEOUT", "60"))
+TG_CONNECT_TIMEOUT = float(os.getenv("TG_CONNECT_TIMEOUT", "5"))
+TG_POOL_TIMEOUT = float(os.getenv("TG_POOL_TIMEOUT", "10"))
+TG_KEEPALIVE_EXPIRY = float(os.getenv("TG_KEEPALIVE_EXPIRY", "30"))
+TG_HTTP2 = os.getenv("TG_HTTP2", "0") == "1"  # needs httpx[http2]
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "5"))
+EXPIRY_BATCH = int(os.getenv("EXPIRY_BATCH", "500"))
+EXPIRY_CONCURRENCY = int(os.getenv("EXPIRY_CONCURRENCY", "8"))
+EXPIRY_LEASE = int(os.getenv("EXPIRY_LEASE", "120"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+COUNTS_TTL = int(os.getenv("COUNTS_TTL", "60"))
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", "1800"))
+SNAPSHOT_MEMORY_MB = float(os.getenv("SNAPSHOT_MEMORY_MB", "32"))
+VAULT_CHUNK = int(os.getenv("VAULT_CHUNK", "50"))
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "5"))
+PERSIST_BATCH = int(os.getenv("PERSIST_BATCH", "1000"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "30"))
+SESSION_SYNC = os.getenv("SESSION_SYNC", "0") == "1"   # 1 when several replicas share the webhook: one find_one per update
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL; unset = long polling
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "2000"))
+UPDATE_USER_QUEUE = int(os.getenv("UPDATE_USER_QUEUE", "10"))
+MONGO_SLOW_MS = float(os.getenv("MONGO_SLOW_MS", "100"))
+MONGO_EXPLAIN = os.getenv("MONGO_EXPLAIN", "1") == "1"
+
+# --- METRICS ---
+# Prometheus text format, served on /metrics. Histograms share one bucket
+# ladder (seconds). Mongo timings arrive on Motor's worker threads, hence the
+# lock. Totals other components already keep (expiry, delivery, dispatch) are
+# exported through callbacks instead of being counted twice.
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+def _labels(names, values):
+    if not names: return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+class Histogram:
+    def __init__(self, name, doc, *labels):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.series = {}   # label values -> per-bucket counts (+Inf last), then sum, count
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, *values):
+        with self.lock:
+            s = self.series.get(values)
+            if s is None: s = self.series[values] = [0] * (len(BUCKETS) + 3)
+            s[bisect.bisect_left(BUCKETS, seconds)] += 1
+            s[-2] += seconds
+            s[-1] += 1
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self.lock: series = {k: list(v) for k, v in self.series.items()}
+        for values, s in sorted(series.items()):
+            total = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), s):
+                total += n
+                out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + (bound,))} {total}")
+            out.append(f"{self.name}_sum{_labels(self.labels, values)} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labels, values)} {s[-1]}")
+        return out
+
+class Counter:
+    def __init__(self, name, doc, *labels):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.series = defaultdict(int)
+
+    def inc(self, *values, by=1): self.series[values] += by
+
+    def render(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter",
+                *(f"{self.name}{_labels(self.labels, k)} {v}" for k, v in sorted(self.series.items()))]
+
+# Reads a value off another component at scrape time: fn() -> {label values: number}.
+class Exported:
+    def __init__(self, name, doc, kind, fn, *labels):
+        self.name, self.doc, self.kind, self.fn, self.labels = name, doc, kind, fn, labels
+
+    def render(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}",
+                *(f"{self.name}{_labels(self.labels, k)} {v}" for k, v in self.fn().items())]
+
+class Metrics:
+    def __init__(self): self.items = []
+
+    def add(self, metric):
+        self.items.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self.items:
+            try: lines += m.render()
+            except Exception as e: logger.error(f"Metric {m.name} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+handler_seconds = metrics.add(Histogram("bot_handler_seconds", "Handler run time", "handler"))
+handler_errors = metrics.add(Counter("bot_handler_errors_total", "Handlers that raised", "handler"))
+mongo_seconds = metrics.add(Histogram("bot_mongo_seconds", "Mongo command round trip", "collection", "op"))
+mongo_pool_wait = metrics.add(Histogram("bot_mongo_pool_wait_seconds", "Wait to check a connection out of a Mongo pool", "server"))
+api_seconds = metrics.add(Histogram("bot_api_seconds", "Bot API call round trip", "method"))
+api_responses = metrics.add(Counter("bot_api_responses_total", "Bot API responses by HTTP status (429 = flood wait)", "method", "code"))
+delivery_outcomes = metrics.add(Counter("bot_deliveries_total", "Content deliveries; partial = success_all false", "kind", "outcome"))
+media_sends = metrics.add(Counter("bot_media_sends_total", "Single media sends: first_try, fallback, failed or skipped (dead file_id)", "kind", "outcome"))
+
+# user_router is labelled per branch: the longest known prefix of the callback data.
+ROUTES = ("u_updates", "u_ad", "u_vault_folders", "list", "search", "v_search_start", "vfold", "vitem", "main")
+
+def handler_label(name, update):
+    cq = getattr(update, "callback_query", None)
+    if name != "user_router" or not cq: return name
+    return f"user_router:{next((r for r in ROUTES if cq.data.startswith(r)), 'other')}"
+
+def timed(callback):
+    if getattr(callback, "timed", False): return callback
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        label = handler_label(callback.__name__, update)
+        try: return await callback(update, context)
+        except Exception:
+            handler_errors.inc(label)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, label)
+            startup.mark("first_response")
+    wrapper.timed = True
+    return wrapper
+
+# Times every command Motor sends; getMore carries the collection in a field.
+# Query commands on our database are also handed to query_profiler (see QUERY
+# PROFILER); started() only keeps a reference, the shaping happens in record().
+class MongoMonitor(monitoring.CommandListener):
+    def __init__(self): self.inflight = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore": target = event.command.get("collection")
+        if isinstance(target, str):
+            query = event.command_name in QUERY_FIELDS and getattr(event, "database_name", None) == DB_NAME
+            self.inflight[(event.connection_id, event.request_id)] = (target, event.command if query else None)
+
+    def succeeded(self, event):
+        target, command = self.inflight.pop((event.connection_id, event.request_id), (None, None))
+        if not target: return
+        mongo_seconds.observe(event.duration_micros / 1e6, target, event.command_name)
+        if command: query_profiler.record(target, event.command_name, command, event.duration_micros / 1e6, getattr(event, "reply", None))
+
+    def failed(self, event): self.succeeded(event)
+
+mongo_monitor = MongoMonitor()
+
+# Connection checkout waits per server. Motor runs each operation on an
+# executor thread, and a checkout starts and finishes on the same one.
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.started = {}
+        self.in_use = defaultdict(int)
+        self.waits = deque(maxlen=4096)
+        self.checkouts = self.timeouts = 0
+
+    @staticmethod
+    def server(address): return f"{address[0]}:{address[1]}"
+
+    def connection_check_out_started(self, event): self.started[(event.address, threading.get_ident())] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = self.started.pop((event.address, threading.get_ident()), None)
+        self.in_use[self.server(event.address)] += 1
+        self.checkouts += 1
+        if started is None: return
+        self.waits.append(time.perf_counter() - started)
+        mongo_pool_wait.observe(self.waits[-1], self.server(event.address))
+
+    def connection_check_out_failed(self, event):
+        self.started.pop((event.address, threading.get_ident()), None)
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT: self.timeouts += 1
+
+    def connection_checked_in(self, event): self.in_use[self.server(event.address)] -= 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): self.in_use.pop(self.server(event.address), None)
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+    def stats(self):
+        return {"in_use": ", ".join(f"{s} {n}/{MONGO_POOL_MAX}" for s, n in sorted(self.in_use.items())) or "-",
+                "checkouts": self.checkouts, "timeouts": self.timeouts,
+                "wait_p50_ms": f"{percentile(self.waits, .5) * 1000:.1f}", "wait_p99_ms": f"{percentile(self.waits, .99) * 1000:.1f}"}
+
+pool_monitor = PoolMonitor()
+metrics.add(Exported("bot_mongo_pool_in_use", "Mongo connections checked out, per server", "gauge",
+                     lambda: {(s,): n for s, n in list(pool_monitor.in_use.items())}, "server"))
 
 # --- DATABASE ---
 client = AsyncIOMotorClient(
     MONGO_URL, 
-    maxPoolSize=10, 
-    minPoolSize=1, 
-    serverSelectionTimeoutMS=5000,
-    tlsCAFile=certifi.where()
+    maxPoolSize=MONGO_POOL_MAX, 
+    minPoolSize=MONGO_POOL_MIN, 
+    waitQueueTimeoutMS=MONGO_POOL_WAIT_MS or None,
+    connectTimeoutMS=MONGO_CONNECT_MS,
+    socketTimeoutMS=MONGO_SOCKET_MS or None,
+    serverSelectionTimeoutMS=MONGO_SELECT_MS,
+    tlsCAFile=certifi.where(),
+    event_listeners=[mongo_monitor, pool_monitor],
+    **({"compressors": MONGO_COMPRESSORS} if MONGO_COMPRESSORS else {})
 )
-db = client["vault_bot_db"]
+db = client[DB_NAME]
+
+# Listing and search scans (the cold-start search fallback, the cold-start
+# numbered pick, /broken) tolerate MONGO_MAX_STALENESS of lag and go through
+# browse(col), which may serve them from a secondary. Everything else uses
+# the col_* handles as they are, the primary:
+# - lookups by _id: the ids come from the in-memory search and ordinal
+#   indexes, which are updated right after a primary write, so a lagging
+#   secondary would answer "not found" for a just-added item;
+# - key checks, deliveries, counters and index builds;
+# - screens kept in render_cache (list pages, folder listings). The cache
+#   has no TTL, so a lagging render would outlive the lag.
+READ_PREFERENCES = {"primary": Primary, "primaryPreferred": PrimaryPreferred, "secondary": Secondary,
+                    "secondaryPreferred": SecondaryPreferred, "nearest": Nearest}
+
+def read_preference(mode, staleness):
+    cls = READ_PREFERENCES[mode]
+    return cls() if cls is Primary else cls(max_staleness=staleness or -1)
+
+BROWSE_READ = read_preference(MONGO_BROWSE_READ, MONGO_MAX_STALENESS)
+
+def browse(col): return col.with_options(read_preference=BROWSE_READ)
 col_settings, col_guides, col_vaults = db["settings"], db["guides"], db["vaults"]
+col_expiry, col_counters, col_catalog, col_vault_files = db["expiry"], db["counters"], db["vault_catalog"], db["vault_files"]
+col_sessions, col_conversations = db["sessions"], db["conversations"]
+col_deliveries, col_staging = db["deliveries"], db["vault_staging"]
+
+# --- QUERY PROFILER ---
+# Aggregates every query by shape (collection, command, filter/sort keys with
+# values blanked). Each shape is explained once in the background (again when
+# it runs slower than MONGO_SLOW_MS, at most every EXPLAIN_EVERY seconds) to get
+# its plan and docs examined per doc returned. Shapes that scan a collection,
+# sort in memory or examine far more than they return get an index suggestion
+# built equality fields -> sort fields -> range fields. /queries shows the
+# report, /queries create builds the suggested indexes.
+EXPLAIN_EVERY = 300
+QUERY_FIELDS = {"find": ("filter", "sort"), "count": ("query", None), "distinct": ("query", None),
+                "findAndModify": ("query", "sort"), "update": ("updates", None), "delete": ("deletes", None), "aggregate": ("pipeline", None)}
+EXPLAIN_DROP = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+RANGE_OPS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$exists", "$regex", "$not"}
+
+# Values become "?", operators stay, so {"name": {"$regex": ...}} and {"name": "x"} are different shapes.
+def blank(value):
+    if isinstance(value, dict): return {k: blank(v) if k.startswith("$") else ("?" if not isinstance(v, (dict, list)) else blank(v))
+                                        for k, v in value.items()}
+    if isinstance(value, list): return [blank(v) for v in value[:1]]
+    return "?"
+
+# blank() as nested tuples: hashable, and cheap enough to key every command on.
+def signature(value):
+    if isinstance(value, dict): return tuple((k, signature(v)) for k, v in value.items())
+    if isinstance(value, list): return (list, *(signature(v) for v in value[:1]))
+    return None
+
+class QueryProfiler:
+    def __init__(self, slow_ms=MONGO_SLOW_MS, explain=MONGO_EXPLAIN):
+        self.slow, self.explain_enabled = slow_ms / 1000, explain
+        self.shapes = {}   # (collection, op, shape) -> stats dict
+        self.seen = {}     # (collection, op, filter signature, sort) -> key into shapes
+        self.lock = threading.Lock()
+        self.loop = None
+        self.indexes = {}  # collection -> [key tuples], refreshed by advise()
+
+    # -> (filter, sort) of a query command.
+    @staticmethod
+    def parts(op, command):
+        fields = QUERY_FIELDS[op]
+        flt, sort = command.get(fields[0]) or {}, command.get(fields[1]) if fields[1] else None
+        if op in ("update", "delete"): flt = (flt[0].get("q") if flt else None) or {}
+        if op == "aggregate":
+            stages = flt
+            flt = next((st["$match"] for st in stages[:1] if "$match" in st), {})
+            sort = next((st["$sort"] for st in stages[:2] if "$sort" in st), None)
+        if op == "distinct": sort = {command.get("key"): 1}
+        return flt, dict(sort) if sort else {}
+
+    # Shape label of a query; only built the first time a signature is seen.
+    @staticmethod
+    def shape(op, flt, sort):
+        label = ("key " if op == "distinct" else "sort ") + json.dumps(sort, default=str) if sort else ""
+        return f"{json.dumps(blank(flt), default=str)} {label}".strip()
+
+    def record(self, col, op, command, seconds, reply):
+        flt, sort = self.parts(op, command)
+        sig = (col, op, signature(flt), str(sort))
+        key = self.seen.get(sig)
+        if key is None:
+            key = (col, op, self.shape(op, flt, sort))
+            cmd = {k: v for k, v in command.items() if k not in EXPLAIN_DROP}
+        returned = 0
+        if isinstance(reply, dict):
+            if "cursor" in reply: returned = len(reply["cursor"].get("firstBatch", ()))
+            elif "values" in reply: returned = len(reply["values"])
+            else: returned = reply.get("n", 1 if reply.get("value") else 0)
+        with self.lock:
+            st = self.shapes.get(key)
+            if st is None: st = self.shapes[key] = {"count": 0, "seconds": 0.0, "max": 0.0, "returned": 0, "plan": None, "explained": 0.0,
+                                                     "filter": flt, "sort": sort, "cmd": cmd}
+            self.seen[sig] = key
+            st["count"] += 1
+            st["seconds"] += seconds
+            st["max"] = max(st["max"], seconds)
+            st["returned"] += returned
+            due = st["plan"] is None or (seconds >= self.slow and time.monotonic() - st["explained"] > EXPLAIN_EVERY)
+            if due: st["explained"] = time.monotonic()
+        if due and self.explain_enabled and self.loop:
+            self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.explain(key, seconds)))
+        elif seconds >= self.slow and not self.explain_enabled:
+            logger.warning(f"Slow query {seconds * 1000:.0f}ms {col}.{op} {key[2]}")
+
+    @staticmethod
+    def _stages(plan):
+        out = []
+        while plan:
+            out.append(plan.get("stage", "?"))
+            plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+        return out
+
+    async def explain(self, key, seconds):
+        st = self.shapes[key]
+        try:
+            res = await db.command({"explain": st["cmd"], "verbosity": "executionStats"})
+            qp = res.get("queryPlanner") or (res.get("stages") or [{}])[0].get("$cursor", {}).get("queryPlanner", {})
+            ex = res.get("executionStats") or (res.get("stages") or [{}])[0].get("$cursor", {}).get("executionStats", {})
+            stages = self._stages(qp.get("winningPlan", {}).get("queryPlan") or qp.get("winningPlan", {}))
+            st["plan"] = {"stages": stages, "examined": ex.get("totalDocsExamined", 0), "keys": ex.get("totalKeysExamined", 0),
+                          "returned": ex.get("nReturned", 0)}
+        except Exception as e:
+            st["plan"] = {"stages": ["explain failed"], "error": str(e)[:200], "examined": 0, "keys": 0, "returned": 0}
+        if seconds >= self.slow:
+            p = st["plan"]
+            logger.warning(f"Slow query {seconds * 1000:.0f}ms {key[0]}.{key[1]} {key[2]} | plan {'>'.join(p['stages'])}"
+                           f" | examined {p['examined']} docs / {p['keys']} keys for {p['returned']} returned")
+
+    @staticmethod
+    def flagged(plan):
+        if not plan or "error" in plan: return False
+        return "COLLSCAN" in plan["stages"] or "SORT" in plan["stages"] or \
+            (plan["examined"] > 100 and plan["examined"] > 10 * max(plan["returned"], 1))
+
+    @staticmethod
+    def suggest(flt, sort):
+        eq, rng = [], []
+        for field, cond in flt.items():
+            if field.startswith("$") or field == "_id" and not sort: continue
+            ops = set(cond) if isinstance(cond, dict) and any(k.startswith("$") for k in cond) else set()
+            (rng if ops & RANGE_OPS else eq).append(field)
+        keys = [(f, 1) for f in eq] + [(f, int(d)) for f, d in sort.items() if f not in eq]
+        keys += [(f, 1) for f in rng if f not in dict(keys)]
+        return keys if keys and keys != [("_id", 1)] else None
+
+    async def advise(self):
+        with self.lock: shapes = list(self.shapes.items())
+        out = []
+        for (col, op, shape), st in shapes:
+            if not self.flagged(st["plan"]): continue
+            keys = self.suggest(st["filter"], st["sort"])
+            if not keys: continue
+            if col not in self.indexes:
+                self.indexes[col] = [tuple(ix["key"].items()) async for ix in db[col].list_indexes()]
+            if any(ix[:len(keys)] == tuple(keys) for ix in self.indexes[col]): continue
+            if (col, keys) not in [(c, k) for c, k, _ in out]: out.append((col, keys, f"{op} {shape}"))
+        return out
+
+    async def create(self, suggestions):
+        made = []
+        for col, keys, _ in suggestions:
+            made.append(f"{col}: {await db[col].create_index(keys)}")
+            self.indexes.pop(col, None)
+        return made
+
+    def report(self, top=10):
+        with self.lock: shapes = sorted(self.shapes.items(), key=lambda kv: -kv[1]["seconds"])[:top]
+        lines = []
+        for (col, op, shape), st in shapes:
+            p = st["plan"] or {}
+            plan = ">".join(p.get("stages", ["?"]))
+            ratio = f"{p['examined'] / max(p['returned'], 1):.0f}" if "examined" in p else "?"
+            lines.append(f"{'⚠️ ' if self.flagged(p) else ''}{col}.{op} {shape}: {st['count']}× avg {st['seconds'] / st['count'] * 1000:.1f}ms"
+                         f" max {st['max'] * 1000:.0f}ms | {plan} | {ratio} examined/returned")
+        return lines
+
+    def stats(self):
+        with self.lock: plans = [st["plan"] for st in self.shapes.values()]
+        return {"shapes": len(plans), "explained": sum(1 for p in plans if p), "flagged": sum(1 for p in plans if self.flagged(p))}
+
+query_profiler = QueryProfiler()
 
 # --- STATES ---
 (W_TXT, W_PHO, AD_PHO_STATE, AD_TXT_STATE, AD_LNK_STATE, 
@@ -40,7 +477,7 @@ col_settings, col_guides, col_vaults = db["settings"], db["guides"], db["vaults"
  A_V_FOLD, A_V_SUB, A_V_POST, A_V_DESC, A_V_FILES, 
  V_KEY_INPUT, U_GUIDE_SELECT, U_V_SUB_SELECT, ADM_DEL_SELECT,
  UPD_MENU, UPD_DESC, UPD_ADD_LINK, UPD_DEL_LINK,
- SEARCH_STATE, ADM_SEARCH_STATE, V_SEARCH_STATE) = range(31)
+ SEARCH_STATE, ADM_SEARCH_STATE, V_SEARCH_STATE, IMPORT_FILE) = range(32)
 
 # --- HELPERS ---
 def get_file_info(message):
@@ -50,20 +487,1004 @@ def get_file_info(message):
     if message.document: return message.document.file_id, "document"
     return None, None
 
-async def del_msg(context: ContextTypes.DEFAULT_TYPE):
-    try: await context.bot.delete_message(chat_id=context.job.chat_id, message_id=context.job.data)
-    except: pass
+def percentile(xs, p): return sorted(xs)[min(len(xs) - 1, int(len(xs) * p))] if xs else 0.0
 
-async def get_settings():
-    w = await col_settings.find_one({"type": "welcome"}) or {"text": "Welcome!", "photo": None}
-    a = await col_settings.find_one({"type": "adult"}) or {"text": "Adult Zone", "photo": None, "channels": []}
-    u = await col_settings.find_one({"type": "updates"}) or {"desc": "Check our channels!", "links": []}
-    return w, a, u
+# --- CHANGE FEED ---
+# Follows a collection through a change stream so every replica sees admin edits;
+# standalone servers (no replica set) fall back to polling.
+async def watch_collection(col, on_change, on_poll, interval=WATCH_POLL_INTERVAL):
+    while True:
+        try:
+            async with col.watch(full_document="updateLookup") as stream:
+                async for change in stream: await on_change(change)
+        except (OperationFailure, NotImplementedError) as e:
+            logger.info(f"{col.name}: change stream unavailable ({e}), polling every {interval}s")
+            break
+        except asyncio.CancelledError: raise
+        except Exception as e:
+            logger.error(f"{col.name} watch error: {e}")
+            await asyncio.sleep(5)
+            try: await on_poll()
+            except Exception as e: logger.error(f"{col.name} resync error: {e}")
+    while True:
+        await asyncio.sleep(interval)
+        try: await on_poll()
+        except Exception as e: logger.error(f"{col.name} poll error: {e}")
+
+# --- OUTBOUND GOVERNOR ---
+# Every Bot API call except getUpdates passes through Application's rate limiter.
+# Callers tag bulk work with rate_limit_args=PRIO_BULK / PRIO_CLEANUP; untagged
+# calls are interactive and always served first. Only sends are paced per chat,
+# edits and deletes just share the global lane.
+PRIO_INTERACTIVE, PRIO_BULK, PRIO_CLEANUP = 0, 1, 2
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = float(burst), now
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return max(self.paused_until - now, 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate)
+
+    def idle(self, now): return self.wait_time(now) == 0 and self.tokens >= self.burst
+
+class OutboundGovernor(BaseRateLimiter):
+    # clock/sleep are injectable so the scheduler can be driven by a fake clock.
+    def __init__(self, overall_rate=TG_GLOBAL_RATE, chat_rate=TG_CHAT_RATE, chat_burst=TG_CHAT_BURST,
+                 max_retries=TG_MAX_RETRIES, clock=time.monotonic, sleep=asyncio.sleep):
+        self.overall_rate, self.chat_rate, self.chat_burst = overall_rate, chat_rate, chat_burst
+        self.max_retries = max_retries
+        self._clock, self._sleep = clock, sleep
+        self._global = TokenBucket(overall_rate, overall_rate, clock())
+        self._chats = {}
+        self._queues = (deque(), deque(), deque())
+        self._wake = asyncio.Event()
+        self._pump_task = None
+        self.requests = self.retry_after = 0
+        self.throttled = 0.0
+
+    async def initialize(self):
+        if not self._pump_task: self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self):
+        if self._pump_task:
+            self._pump_task.cancel()
+            self._pump_task = None
+        for queue in self._queues:
+            for _, fut, _ in queue: fut.cancel()
+            queue.clear()
+
+    def _chat(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None: bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    # Grants every waiter that may go now; returns seconds until the next one could.
+    def _dispatch(self, now):
+        delay, blocked = None, set()
+        for queue in self._queues:
+            for waiter in list(queue):
+                chat_id, fut, enqueued = waiter
+                if fut.done():
+                    queue.remove(waiter)
+                    continue
+                wait = self._global.wait_time(now)
+                if wait > 0: return wait
+                if chat_id in blocked: continue
+                if chat_id is not None:
+                    wait = self._chat(chat_id, now).wait_time(now)
+                    if wait > 0:
+                        blocked.add(chat_id)
+                        delay = wait if delay is None else min(delay, wait)
+                        continue
+                    self._chats[chat_id].tokens -= 1
+                self._global.tokens -= 1
+                queue.remove(waiter)
+                self.throttled += now - enqueued
+                fut.set_result(None)
+        if len(self._chats) > 10000:
+            self._chats = {k: b for k, b in self._chats.items() if k in blocked or not b.idle(now)}
+        return delay
+
+    async def _pump(self):
+        while True:
+            delay = self._dispatch(self._clock())
+            self._wake.clear()
+            if delay is None:
+                await self._wake.wait()
+                continue
+            sleeper = asyncio.ensure_future(self._sleep(delay))
+            waker = asyncio.ensure_future(self._wake.wait())
+            try: await asyncio.wait({sleeper, waker}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sleeper.cancel()
+                waker.cancel()
+
+    async def _acquire(self, chat_id, prio):
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[prio].append((chat_id, fut, self._clock()))
+        self._wake.set()
+        await fut
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        prio = rate_limit_args if rate_limit_args in (PRIO_BULK, PRIO_CLEANUP) else PRIO_INTERACTIVE
+        chat_id = data.get("chat_id") if endpoint.startswith(("send", "copy", "forward")) else None
+        for attempt in itertools.count():
+            await self._acquire(chat_id, prio)
+            self.requests += 1
+            try: return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                if attempt >= self.max_retries: raise
+                # Flood waits on a chat-scoped call only hold back that chat.
+                lane = self._chat(chat_id, self._clock()) if chat_id is not None else self._global
+                lane.paused_until = max(lane.paused_until, self._clock() + e.retry_after)
+                logger.warning(f"RetryAfter {e.retry_after}s on {endpoint} (chat {chat_id})")
+
+    def stats(self):
+        now = self._clock()
+        return {"requests": self.requests, "retry_after": self.retry_after,
+                "queued": "/".join(str(len(q)) for q in self._queues),
+                "throttled_seconds": f"{self.throttled:.1f}",
+                "paused_chats": sum(1 for b in self._chats.values() if b.paused_until > now),
+                "global_paused": self._global.paused_until > now}
+
+governor = OutboundGovernor()
+metrics.add(Exported("bot_api_queued", "Bot API calls waiting for the rate governor", "gauge",
+                     lambda: {(p,): len(q) for p, q in zip(("interactive", "bulk", "cleanup"), governor._queues)}, "priority"))
+
+# --- HTTP TRANSPORT ---
+# Bot API calls are split into lanes with their own connection pools, so slow
+# media uploads can't starve the quick edits/answers of the control lane, and
+# getUpdates keeps a pool of its own. Each lane admits at most pool-size calls
+# through a semaphore, which is where pool waits are measured.
+MEDIA_ENDPOINTS = {"sendPhoto", "sendVideo", "sendDocument", "sendAnimation", "sendAudio", "sendVoice",
+                   "sendVideoNote", "sendSticker", "sendMediaGroup", "editMessageMedia"}
+
+class TunedHTTPXRequest(HTTPXRequest):
+    def __init__(self, pool_size, read_timeout, write_timeout, keepalive_expiry=TG_KEEPALIVE_EXPIRY, http2=TG_HTTP2):
+        self.pool_size, self.keepalive_expiry = pool_size, keepalive_expiry
+        super().__init__(connection_pool_size=pool_size, read_timeout=read_timeout, write_timeout=write_timeout,
+                         connect_timeout=TG_CONNECT_TIMEOUT, pool_timeout=TG_POOL_TIMEOUT, http_version="2" if http2 else "1.1")
+
+    def _build_client(self):
+        self._client_kwargs["limits"] = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                                     keepalive_expiry=self.keepalive_expiry)
+        return super()._build_client()
+
+class Lane(BaseRequest):
+    def __init__(self, name, request):
+        self.name, self.request = name, request
+        self.slots = asyncio.Semaphore(request.pool_size)
+        self.calls = self.waited = self.timeouts = self.in_use = 0
+        self.wait_total = self.wait_max = 0.0
+        self.waits = deque(maxlen=2048)
+
+    @property
+    def read_timeout(self): return self.request.read_timeout
+
+    async def initialize(self): await self.request.initialize()
+    async def shutdown(self): await self.request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        started = time.monotonic()
+        try: await asyncio.wait_for(self.slots.acquire(), TG_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimedOut(f"Pool timeout: all {self.request.pool_size} {self.name} connections are busy")
+        wait = time.monotonic() - started
+        self.calls += 1
+        self.in_use += 1
+        if wait > 0.001: self.waited += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.waits.append(wait)
+        endpoint, code = url.rsplit("/", 1)[-1], "error"
+        try:
+            result = await self.request.do_request(url, method, request_data, **timeouts)
+            code = result[0]
+            return result
+        finally:
+            api_seconds.observe(time.monotonic() - started - wait, endpoint)
+            api_responses.inc(endpoint, code)
+            self.in_use -= 1
+            self.slots.release()
+
+    def stats(self):
+        return {"in_use": f"{self.in_use}/{self.request.pool_size}", "calls": self.calls, "waited": self.waited,
+                "pool_timeouts": self.timeouts, "wait_p99_ms": f"{percentile(self.waits, .99) * 1000:.1f}",
+                "wait_max_ms": f"{self.wait_max * 1000:.1f}"}
+
+class LaneRequest(BaseRequest):
+    def __init__(self, control, media):
+        self.control, self.media = control, media
+
+    @property
+    def read_timeout(self): return self.control.read_timeout
+
+    async def initialize(self):
+        await self.control.initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await self.control.shutdown()
+        await self.media.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        lane = self.media if url.rsplit("/", 1)[-1] in MEDIA_ENDPOINTS else self.control
+        return await lane.do_request(url, method, request_data, **timeouts)
+
+control_lane = Lane("control", TunedHTTPXRequest(TG_CONTROL_POOL, TG_CONTROL_TIMEOUT, TG_CONTROL_TIMEOUT))
+media_lane = Lane("media", TunedHTTPXRequest(TG_MEDIA_POOL, TG_MEDIA_TIMEOUT, TG_MEDIA_TIMEOUT))
+updates_lane = Lane("updates", TunedHTTPXRequest(TG_UPDATES_POOL, TG_CONTROL_TIMEOUT, TG_CONTROL_TIMEOUT))
+
+# --- SELF-DESTRUCT QUEUE ---
+# Pending deletions live in Mongo so restarts don't leak "disappearing" content.
+# One entry per send batch; a single sweeper drains due entries and anything
+# that fell due while the bot was down.
+class ExpiryQueue:
+    def __init__(self):
+        self.deleted = self.failed = self.pending = 0
+        self.lag = self.max_lag = 0.0
+
+    async def schedule(self, chat_id, message_ids, delay):
+        if message_ids:
+            await col_expiry.insert_one({"chat_id": chat_id, "ids": list(message_ids), "due": datetime.utcnow() + timedelta(seconds=delay)})
+
+    async def _drop(self, bot, sem, chat_id, ids):
+        async with sem:
+            if hasattr(bot, "delete_messages"):  # Bot API 7.0 bulk delete
+                for i in range(0, len(ids), 100):
+                    chunk = ids[i:i + 100]
+                    try:
+                        await bot.delete_messages(chat_id, chunk, rate_limit_args=PRIO_CLEANUP)
+                        self.deleted += len(chunk)
+                    except Exception: self.failed += len(chunk)
+            else:
+                for mid in ids:
+                    try:
+                        await bot.delete_message(chat_id, mid, rate_limit_args=PRIO_CLEANUP)
+                        self.deleted += 1
+                    except Exception: self.failed += 1
+
+    async def sweep(self, bot):
+        now = datetime.utcnow()
+        due = await col_expiry.find({"due": {"$lte": now}}, {"due": 1}).sort("due", 1).limit(EXPIRY_BATCH).to_list(EXPIRY_BATCH)
+        if not due: return 0
+        # Claim under a lease so replicas don't double-delete; a crashed claim comes due again.
+        ids, token = [d["_id"] for d in due], secrets.token_hex(6)
+        await col_expiry.update_many({"_id": {"$in": ids}, "due": {"$lte": now}},
+                                     {"$set": {"due": now + timedelta(seconds=EXPIRY_LEASE), "claim": token}})
+        chats = defaultdict(list)
+        async for entry in col_expiry.find({"_id": {"$in": ids}, "claim": token}):
+            chats[entry["chat_id"]].extend(entry["ids"])
+        sem = asyncio.Semaphore(EXPIRY_CONCURRENCY)
+        await asyncio.gather(*(self._drop(bot, sem, chat_id, mids) for chat_id, mids in chats.items()))
+        await col_expiry.delete_many({"_id": {"$in": ids}, "claim": token})
+        self.lag = (now - due[0]["due"]).total_seconds()
+        self.max_lag = max(self.max_lag, self.lag)
+        return len(due)
+
+    async def run(self, bot):
+        first = True
+        while True:
+            try:
+                swept = 0
+                while True:
+                    n = await self.sweep(bot)
+                    swept += n
+                    if n < EXPIRY_BATCH: break
+                if first and swept: logger.info(f"Recovered {swept} overdue self-destruct entries")
+                first = False
+                self.pending = await col_expiry.estimated_document_count()
+            except asyncio.CancelledError: raise
+            except Exception as e: logger.error(f"Expiry sweep error: {e}")
+            await asyncio.sleep(EXPIRY_SWEEP_INTERVAL)
+
+    def stats(self):
+        return {"pending": self.pending, "deleted": self.deleted, "failed": self.failed,
+                "lag_seconds": f"{self.lag:.1f}", "max_lag_seconds": f"{self.max_lag:.1f}"}
+
+expiry_queue = ExpiryQueue()
+metrics.add(Exported("bot_expiry_deleted_total", "Self-destruct messages deleted", "counter", lambda: {(): expiry_queue.deleted}))
+metrics.add(Exported("bot_expiry_failed_total", "Self-destruct deletions that failed", "counter", lambda: {(): expiry_queue.failed}))
+metrics.add(Exported("bot_expiry_pending", "Scheduled self-destruct batches not yet due or swept", "gauge", lambda: {(): expiry_queue.pending}))
+metrics.add(Exported("bot_expiry_lag_seconds", "How overdue the last swept batch was", "gauge", lambda: {(): expiry_queue.lag}))
+
+# --- RENDER CACHE ---
+# Finished text + keyboard of the browse screens, keyed (screen, scope, page):
+# ("list", type, page, cursor), ("vfold", folder), ("folders",), ("ad", page),
+# ("updates",). Entries stay until the content behind them changes: the admin
+# save/delete handlers invalidate their scope, the settings cache does the same
+# on refresh, and the change feeds cover edits made on other replicas. A page
+# rendered across an invalidation is not stored (epoch check).
+class RenderCache:
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.epoch = 0
+        self.hits = self.misses = self.invalidations = 0
+
+    def get(self, key):
+        page = self.entries.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return page
+
+    def put(self, key, epoch, *page):
+        if epoch == self.epoch:
+            self.entries[key] = page
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size: self.entries.popitem(last=False)
+        return page
+
+    # Cached page, or render() -> tuple stored under key.
+    async def page(self, key, render):
+        page = self.get(key)
+        if page is None:
+            epoch = self.epoch
+            page = self.put(key, epoch, *await render())
+        return page
+
+    def invalidate(self, screen, scope=None):
+        self.epoch += 1
+        stale = [k for k in self.entries if k[0] == screen and (scope is None or k[1] == scope)]
+        for k in stale: del self.entries[k]
+        self.invalidations += len(stale)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"pages": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": f"{self.hits / total:.1%}" if total else "-", "invalidated": self.invalidations}
+
+render_cache = RenderCache()
+metrics.add(Exported("bot_render_cache_total", "Rendered page cache lookups", "counter",
+                     lambda: {("hit",): render_cache.hits, ("miss",): render_cache.misses}, "result"))
+
+# --- SETTINGS CACHE ---
+SETTINGS_DEFAULTS = {
+    "welcome": {"text": "Welcome!", "photo": None},
+    "adult": {"text": "Adult Zone", "photo": None, "channels": []},
+    "updates": {"desc": "Check our channels!", "links": []},
+}
+
+SETTINGS_SCREENS = {"adult": "ad", "updates": "updates"}
+
+class SettingsCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = self.misses = 0
+
+    async def get(self, stype):
+        entry = self.entries.get(stype)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return await self.refresh(stype)
+
+    # Rendered screens only go when the document actually changed; a screen
+    # can only have been rendered from an entry that was already here.
+    def _store(self, stype, doc, now):
+        old = self.entries.get(stype)
+        self.entries[stype] = (now, doc)
+        if old is not None and old[1] != doc and stype in SETTINGS_SCREENS: render_cache.invalidate(SETTINGS_SCREENS[stype])
+
+    async def refresh(self, stype):
+        doc = await col_settings.find_one({"type": stype}) or dict(SETTINGS_DEFAULTS[stype])
+        self._store(stype, doc, time.monotonic())
+        return doc
+
+    async def reload_all(self):
+        docs = {d["type"]: d async for d in col_settings.find({"type": {"$in": list(SETTINGS_DEFAULTS)}})}
+        now = time.monotonic()
+        for stype, default in SETTINGS_DEFAULTS.items(): self._store(stype, docs.get(stype) or dict(default), now)
+
+    def invalidate(self, stype=None):
+        if stype: self.entries.pop(stype, None)
+        else: self.entries.clear()
+        for t, screen in SETTINGS_SCREENS.items():
+            if stype in (None, t): render_cache.invalidate(screen)
+
+    async def on_change(self, change):
+        # Deletes carry no fullDocument, so drop everything.
+        self.invalidate((change.get("fullDocument") or {}).get("type"))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": f"{self.hits / total:.1%}" if total else "-"}
+
+settings_cache = SettingsCache(SETTINGS_TTL)
+
+# Name -> callable returning a flat dict, rendered by /stats.
+STATS_SOURCES = {"Settings cache": settings_cache.stats, "Render cache": render_cache.stats, "Outbound API (queued interactive/bulk/cleanup)": governor.stats,
+                 "HTTP control lane": control_lane.stats, "HTTP media lane": media_lane.stats,
+                 "HTTP updates lane": updates_lane.stats, "Self-destruct queue": expiry_queue.stats, "Mongo pool": pool_monitor.stats}
+
+# --- COUNTERS ---
+# Per-type totals kept in Mongo with $inc on insert/delete, cached locally for
+# COUNTS_TTL. A missing counter is seeded once from count_documents.
+class Counters:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.values = {}
+
+    async def get(self, name, seed_query):
+        entry = self.values.get(name)
+        if entry and time.monotonic() - entry[0] < self.ttl: return entry[1]
+        doc = await col_counters.find_one({"_id": name})
+        if doc is None:
+            col, flt = seed_query
+            await col_counters.update_one({"_id": name}, {"$setOnInsert": {"n": await col.count_documents(flt)}}, upsert=True)
+            doc = await col_counters.find_one({"_id": name})
+        self.values[name] = (time.monotonic(), doc["n"])
+        return doc["n"]
+
+    # Unseeded counters are left alone: their first get() counts the collection.
+    async def incr(self, name, by=1):
+        doc = await col_counters.find_one_and_update({"_id": name}, {"$inc": {"n": by}}, return_document=ReturnDocument.AFTER)
+        if doc: self.values[name] = (time.monotonic(), doc["n"])
+
+counters = Counters(COUNTS_TTL)
+
+async def guide_count(g_type): return await counters.get(f"guides:{g_type}", (col_guides, {"type": g_type}))
+
+# --- SEARCH ---
+# Names are case-folded, accent-stripped and split into trigrams plus edge keys:
+# "^ab" for word prefixes, "^^ab" for whole-name prefixes (1-3 chars each). The
+# keys are stored on each document (indexed, used while the in-memory index is
+# cold) and mirrored by SearchIndex. Scopes: guide type ("anime"/"movies") or "vault".
+def normalize(text):
+    text = "".join(c for c in unicodedata.normalize("NFKD", str(text).casefold()) if not unicodedata.combining(c))
+    return " ".join(re.sub(r"\W+", " ", text).split())
+
+def norm_keys(norm):
+    keys = {norm[i:i + 3] for i in range(len(norm) - 2)}
+    for w in norm.split(): keys.update("^" + w[:i] for i in (1, 2, 3))
+    keys.update("^^" + norm[:i] for i in (1, 2, 3))
+    return keys
+
+def search_keys(*texts):
+    keys = set()
+    for t in texts: keys |= norm_keys(normalize(t))
+    return sorted(keys)
+
+def query_keys(q):
+    return {q[i:i + 3] for i in range(len(q) - 2)} if len(q) >= 3 else {"^" + q}
+
+# Exact < prefix < word prefix < substring; None if no match. Queries shorter
+# than 3 characters only match word prefixes.
+def match_rank(q, norms):
+    best = None
+    for n in norms:
+        if n == q: r = 0
+        elif n.startswith(q): r = 1
+        elif (" " + q) in n: r = 2
+        elif len(q) >= 3 and q in n: r = 3
+        else: continue
+        best = r if best is None else min(best, r)
+    return best
+
+# Results come out tier by tier (exact, name prefix, word prefix, substring),
+# each tier in insertion order, so the scan stops as soon as `limit` hits are found.
+class SearchIndex:
+    def __init__(self):
+        self.ready = False
+        self.docs = []    # slot -> (scope, _id, norms) or None once deleted
+        self.slots = {}   # _id -> slot
+        self.postings = {}
+        self.exact = {}   # (scope, norm) -> slots
+        self.dead = 0
+        self.last = {}    # newest _id seen per collection, for catch_up
+
+    def add(self, scope, oid, *texts):
+        if oid in self.slots: return
+        col = "vaults" if scope == "vault" else "guides"
+        if col not in self.last or oid > self.last[col]: self.last[col] = oid
+        norms = tuple(normalize(t) for t in texts if t)
+        slot = len(self.docs)
+        self.docs.append((scope, oid, norms))
+        self.slots[oid] = slot
+        for key in set().union(*(norm_keys(n) for n in norms)):
+            posting = self.postings.get((scope, key))
+            if posting is None: posting = self.postings[(scope, key)] = array("i")
+            posting.append(slot)
+        for n in set(norms): self.exact.setdefault((scope, n), array("i")).append(slot)
+
+    def remove(self, oid):
+        slot = self.slots.pop(oid, None)
+        if slot is None: return
+        self.docs[slot] = None
+        self.dead += 1
+        if self.dead > 1000 and self.dead * 4 > len(self.docs): self.compact()
+
+    def compact(self):
+        live = [d for d in self.docs if d]
+        self.docs, self.slots, self.postings, self.exact, self.dead = [], {}, {}, {}, 0
+        for scope, oid, norms in live: self.add(scope, oid, *norms)
+
+    def search(self, scope, text, limit=SEARCH_MAX_RESULTS):
+        q = normalize(text)
+        if not q: return []
+        get = self.postings.get
+        tiers = [(self.exact.get((scope, q)), lambda n: n == q),
+                 (get((scope, "^^" + q[:3])), lambda n: n.startswith(q)),
+                 (get((scope, "^" + q[:3])), lambda n: n.startswith(q) or (" " + q) in n)]
+        if len(q) >= 3: tiers.append((self._candidates(scope, q), lambda n: q in n))
+        docs, seen, out = self.docs, set(), []
+        for slots, match in tiers:
+            for slot in slots or ():
+                doc = docs[slot]
+                if doc is None or slot in seen or not any(match(n) for n in doc[2]): continue
+                seen.add(slot)
+                out.append(doc[1])
+                if len(out) >= limit: return out
+        return out
+
+    # Slots holding every trigram of q, in insertion order; large lists are
+    # intersected as sets so Python only touches likely hits.
+    def _candidates(self, scope, q):
+        lists = [self.postings.get((scope, k)) for k in query_keys(q)]
+        if not all(lists): return None
+        lists.sort(key=len)
+        if len(lists) == 1 or len(lists[0]) < 1000: return lists[0]
+        cand = set(lists[0])
+        for other in lists[1:4]: cand.intersection_update(other)
+        return sorted(cand)
+
+    async def rebuild(self):
+        fresh = SearchIndex()
+        async for d in col_guides.find({}, {"name": 1, "type": 1}).sort("_id", 1): fresh.add(d.get("type"), d["_id"], d.get("name", ""))
+        async for d in col_vaults.find({}, {"sub_name": 1, "folder": 1}).sort("_id", 1): fresh.add("vault", d["_id"], d.get("sub_name", ""), d.get("folder", ""))
+        self.docs, self.slots, self.postings, self.exact, self.dead, self.last = fresh.docs, fresh.slots, fresh.postings, fresh.exact, 0, fresh.last
+        self.ready = True
+
+    # Picks up documents inserted by other replicas when change streams are unavailable.
+    async def catch_up(self, vault=False):
+        if not self.ready: return
+        col = "vaults" if vault else "guides"
+        flt = {"_id": {"$gt": self.last[col]}} if col in self.last else {}
+        if vault:
+            async for d in col_vaults.find(flt, {"sub_name": 1, "folder": 1}).sort("_id", 1): self.add("vault", d["_id"], d.get("sub_name", ""), d.get("folder", ""))
+        else:
+            async for d in col_guides.find(flt, {"name": 1, "type": 1}).sort("_id", 1): self.add(d.get("type"), d["_id"], d.get("name", ""))
+
+    def apply(self, change, vault=False):
+        op, oid = change["operationType"], change.get("documentKey", {}).get("_id")
+        if op in ("delete", "update", "replace"): self.remove(oid)
+        doc = change.get("fullDocument")
+        if op in ("insert", "update", "replace") and doc:
+            if vault: self.add("vault", oid, doc.get("sub_name", ""), doc.get("folder", ""))
+            else: self.add(doc.get("type"), oid, doc.get("name", ""))
+
+    def stats(self):
+        return {"ready": self.ready, "documents": len(self.slots), "keys": len(self.postings),
+                "postings": sum(len(p) for p in self.postings.values())}
+
+search_index = SearchIndex()
+STATS_SOURCES["Search index"] = search_index.stats
+
+async def search_ids(scope, text, limit=SEARCH_MAX_RESULTS):
+    if search_index.ready: return search_index.search(scope, text, limit)
+    # Cold start: same keys, answered by Mongo's multikey index.
+    q = normalize(text)
+    if not q: return []
+    vault = scope == "vault"
+    flt = {"search_keys": {"$all": sorted(query_keys(q))}}
+    if not vault: flt["type"] = scope
+    fields = ("sub_name", "folder") if vault else ("name",)
+    hits = []
+    async for d in browse(col_vaults if vault else col_guides).find(flt, {f: 1 for f in fields}).sort("_id", 1).limit(SEARCH_MAX_RESULTS * 5):
+        r = match_rank(q, [normalize(d.get(f, "")) for f in fields])
+        if r is not None: hits.append((r, len(hits), d["_id"]))
+    hits.sort()
+    return [oid for _, _, oid in hits[:limit]]
+
+async def fetch_ordered(col, ids, projection=None):
+    docs = {d["_id"]: d async for d in col.find({"_id": {"$in": ids}}, projection)}
+    return [docs[i] for i in ids if i in docs]
+
+async def backfill_search_keys():
+    for col, fields in ((col_guides, ("name",)), (col_vaults, ("sub_name", "folder"))):
+        ops = []
+        async for d in col.find({"search_keys": {"$exists": False}}, {f: 1 for f in fields}):
+            ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"search_keys": search_keys(*(d.get(f, "") for f in fields))}}))
+            if len(ops) == 1000:
+                await col.bulk_write(ops, ordered=False)
+                ops = []
+        if ops: await col.bulk_write(ops, ordered=False)
+
+async def start_search_index():
+    await backfill_search_keys()
+    await search_index.rebuild()
+    logger.info(f"Search index ready: {len(search_index.slots)} documents")
+
+# --- ORDINAL INDEX ---
+# Sorted _ids per guide type, so "reply with number" is a list lookup plus one
+# fetch by _id instead of skip(n-1) over the type index.
+class OrdinalIndex:
+    def __init__(self):
+        self.ready = False
+        self.ids = {}
+
+    def add(self, g_type, oid):
+        lst = self.ids.setdefault(g_type, [])
+        i = bisect.bisect_left(lst, oid)
+        if i == len(lst) or lst[i] != oid: lst.insert(i, oid)
+
+    def remove(self, oid):
+        for lst in self.ids.values():
+            i = bisect.bisect_left(lst, oid)
+            if i < len(lst) and lst[i] == oid:
+                del lst[i]
+                return
+
+    def at(self, g_type, n):
+        lst = self.ids.get(g_type, [])
+        return lst[n - 1] if 1 <= n <= len(lst) else None
+
+    async def rebuild(self, g_type=None):
+        ids = {}
+        async for d in col_guides.find({"type": g_type} if g_type else {}, {"type": 1}).sort("_id", 1):
+            ids.setdefault(d.get("type"), []).append(d["_id"])
+        if g_type: self.ids[g_type] = ids.get(g_type, [])
+        else: self.ids = ids
+        self.ready = True
+
+    def apply(self, change):
+        op, oid = change["operationType"], change.get("documentKey", {}).get("_id")
+        if op == "delete": self.remove(oid)
+        elif op == "insert" and change.get("fullDocument"): self.add(change["fullDocument"].get("type"), oid)
+
+    # Polling fallback: append new _ids, and rebuild any type whose length
+    # disagrees with the shared counter (a delete made by another replica).
+    async def catch_up(self):
+        if not self.ready: return
+        last = max((lst[-1] for lst in self.ids.values() if lst), default=None)
+        async for d in col_guides.find({"_id": {"$gt": last}} if last else {}, {"type": 1}).sort("_id", 1): self.add(d.get("type"), d["_id"])
+        async for c in col_counters.find({"_id": {"$regex": "^guides:"}}):
+            g_type = c["_id"].split(":", 1)[1]
+            if len(self.ids.get(g_type, [])) != c["n"]: await self.rebuild(g_type)
+
+    def stats(self): return {"ready": self.ready, **{t: len(lst) for t, lst in self.ids.items()}}
+
+ordinal_index = OrdinalIndex()
+STATS_SOURCES["Ordinal index"] = ordinal_index.stats
+
+# --- VAULT CATALOG ---
+# One document per folder: {_id: folder, count, items: [{id, sub_name}]} in
+# _id order, so browsing never touches vault documents (or their files).
+async def catalog_add(v):
+    await col_catalog.update_one({"_id": v["folder"]}, {"$inc": {"count": 1}, "$push": {"items": {"id": v["_id"], "sub_name": v["sub_name"]}}}, upsert=True)
+
+async def catalog_remove_many(vaults):
+    by_folder = defaultdict(list)
+    for v in vaults: by_folder[v.get("folder")].append(v["_id"])
+    await col_catalog.bulk_write([UpdateOne({"_id": f}, {"$inc": {"count": -len(ids)}, "$pull": {"items": {"id": {"$in": ids}}}})
+                                  for f, ids in by_folder.items()], ordered=False)
+    await col_catalog.delete_many({"_id": {"$in": list(by_folder)}, "count": {"$lte": 0}})
+
+async def catalog_folders():
+    return [d["_id"] async for d in col_catalog.find({}, {"_id": 1}).sort("_id", 1)]
+
+async def catalog_items(folder, skip=0, limit=100):
+    doc = await col_catalog.find_one({"_id": folder}, {"items": {"$slice": [skip, limit]}, "count": 1})
+    return (doc["items"], doc["count"]) if doc else ([], 0)
+
+async def rebuild_catalog():
+    pipeline = [{"$project": {"folder": 1, "sub_name": 1}}, {"$sort": {"_id": 1}},
+                {"$group": {"_id": "$folder", "count": {"$sum": 1}, "items": {"$push": {"id": "$_id", "sub_name": "$sub_name"}}}}]
+    docs = [d async for d in col_vaults.aggregate(pipeline)]
+    if docs: await col_catalog.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs], ordered=False)
+    await col_catalog.delete_many({"_id": {"$nin": [d["_id"] for d in docs]}})
+    invalidate_vault_pages()
+    logger.info(f"Vault catalog rebuilt: {len(docs)} folders")
+
+async def ensure_catalog():
+    if not await col_catalog.estimated_document_count() and await col_vaults.estimated_document_count(): await rebuild_catalog()
+
+# --- VAULT MANIFESTS ---
+# A vault's files live in vault_files as ordered chunks {vault_id, seq, files}
+# of VAULT_CHUNK entries; the vault document only keeps file_count. Documents
+# from before the split still carry a "files" array until migrate_manifests
+# (run at startup) or their first delivery moves them over.
+async def save_manifest(vault_id, files):
+    chunks = [{"vault_id": vault_id, "seq": i // VAULT_CHUNK, "files": files[i:i + VAULT_CHUNK]}
+              for i in range(0, len(files), VAULT_CHUNK)]
+    if chunks: await col_vault_files.insert_many(chunks)
+
+# Chunks are upserted on (vault_id, seq) and leftovers past the end dropped, so
+# a migration cut short or run by two replicas at once converges on the same
+# manifest; the vault keeps its "files" array until that is done.
+async def migrate_manifest(vault_id):
+    legacy = await col_vaults.find_one({"_id": vault_id, "files": {"$exists": True}}, {"files": 1})
+    if not legacy: return None
+    files = legacy["files"]
+    seqs = range(0, len(files), VAULT_CHUNK)
+    try:
+        if files:
+            await col_vault_files.bulk_write([ReplaceOne({"vault_id": vault_id, "seq": i // VAULT_CHUNK},
+                                                        {"vault_id": vault_id, "seq": i // VAULT_CHUNK, "files": files[i:i + VAULT_CHUNK]}, upsert=True)
+                                             for i in seqs], ordered=False)
+        await col_vault_files.delete_many({"vault_id": vault_id, "seq": {"$gte": len(seqs)}})
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])): raise
+        return None   # another replica upserted the same chunk first; it finishes the job
+    await col_vaults.update_one({"_id": vault_id}, {"$unset": {"files": 1}, "$set": {"file_count": len(legacy["files"])}})
+    return len(legacy["files"])
+
+async def migrate_manifests():
+    moved = 0
+    async for v in col_vaults.find({"files": {"$exists": True}}, {"_id": 1}):
+        if await migrate_manifest(v["_id"]) is not None: moved += 1
+    if moved: logger.info(f"Migrated {moved} vault manifests to chunked storage")
+
+# --- RESULT SNAPSHOTS ---
+# The _ids behind the numbers a user was last shown (search results, list page
+# or vault folder), packed 12 bytes each. Numbered replies resolve against the
+# snapshot, so a pick never re-runs the query and can't shift underneath the user.
+class SnapshotStore:
+    def __init__(self, ttl, max_bytes):
+        self.ttl, self.max_bytes = ttl, max_bytes
+        self.entries = OrderedDict()   # user_id -> (stamp, kind, base, packed ids)
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def _size(entry): return len(entry[3]) + 200
+
+    def drop(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry: self.bytes -= self._size(entry)
+
+    # kind identifies the screen, e.g. ("guides", "anime") or ("vault", folder);
+    # base is the display number of ids[0] minus one.
+    def put(self, user_id, kind, ids, base=0):
+        self.drop(user_id)
+        entry = (time.monotonic(), kind, base, b"".join(oid.binary for oid in ids))
+        self.entries[user_id] = entry
+        self.bytes += self._size(entry)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            self.bytes -= self._size(self.entries.popitem(last=False)[1])
+            self.evictions += 1
+
+    # -> (count, _id for display number n). count is None without a live snapshot.
+    def pick(self, user_id, kind, n):
+        entry = self.entries.get(user_id)
+        if not entry or entry[1] != kind or time.monotonic() - entry[0] > self.ttl:
+            if entry and entry[1] == kind: self.drop(user_id)
+            self.misses += 1
+            return None, None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        _, _, base, packed = entry
+        i = n - 1 - base
+        if 0 <= i < len(packed) // 12: return len(packed) // 12, ObjectId(packed[i * 12:i * 12 + 12])
+        return len(packed) // 12, None
+
+    def stats(self):
+        return {"users": len(self.entries), "memory_kb": f"{self.bytes / 1024:.1f}",
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+snapshots = SnapshotStore(SNAPSHOT_TTL, int(SNAPSHOT_MEMORY_MB * 1024 * 1024))
+STATS_SOURCES["Result snapshots"] = snapshots.stats
+
+# --- SESSIONS ---
+# user_data/chat_data live in sessions as {_id: "u<id>"/"c<id>", data}, open
+# conversation states in conversations as {_id: "<name>:<key>", state}. Nothing
+# is loaded up front except in-flight conversations: a user's data is fetched on
+# their first update (and again after SESSION_TTL, so replicas converge). Writes
+# are coalesced per key and flushed with bulk_write every PERSIST_INTERVAL;
+# empty data and ended conversations are deleted rather than stored.
+class MongoPersistence(BasePersistence):
+    def __init__(self, interval=PERSIST_INTERVAL, batch=PERSIST_BATCH, ttl=SESSION_TTL):
+        super().__init__(store_data=PersistenceInput(bot_data=False, callback_data=False), update_interval=interval)
+        # Local edits reach dirty within one PTB update interval and Mongo within
+        # the next flush; a shorter ttl could reload over them.
+        self.interval, self.batch, self.ttl = interval, batch, max(ttl, 2 * interval)
+        self.loaded = {}    # session _id -> monotonic time of last load
+        self.dirty = {}     # (collection name, _id) -> write op
+        self._flush_task = None
+        self.loads = self.writes = self.flushes = self.resyncs = 0
+        self.flush_seconds = 0.0
+
+    @staticmethod
+    def _conv_id(name, key): return f"{name}:" + ":".join(str(k) for k in key)
+
+    def _mark(self, col, _id, doc):
+        if col is col_sessions: self.loaded[_id] = time.monotonic()
+        self.dirty[(col.name, _id)] = ReplaceOne({"_id": _id}, doc, upsert=True) if doc else DeleteOne({"_id": _id})
+        if not self._flush_task: self._flush_task = asyncio.create_task(self._run())
+
+    async def _refresh(self, _id, data):
+        stamp = self.loaded.get(_id)
+        if stamp is not None and (time.monotonic() - stamp < self.ttl or ("sessions", _id) in self.dirty): return
+        doc = await col_sessions.find_one({"_id": _id}, {"data": 1})
+        self.loaded[_id] = time.monotonic()
+        self.loads += 1
+        if doc is None and stamp is None: return
+        data.clear()
+        data.update((doc or {}).get("data", {}))
+
+    async def get_user_data(self): return {}
+    async def get_chat_data(self): return {}
+    async def get_bot_data(self): return {}
+    async def get_callback_data(self): return None
+
+    async def get_conversations(self, name):
+        return {tuple(int(k) for k in d["_id"].split(":")[1:]): d["state"]
+                async for d in col_conversations.find({"_id": {"$regex": f"^{re.escape(name)}:"}})}
+
+    # Stored state of one conversation; pending is True while a write for it is still queued here.
+    async def load_conversation(self, name, key):
+        _id = self._conv_id(name, key)
+        if ("conversations", _id) in self.dirty: return True, None
+        doc = await col_conversations.find_one({"_id": _id}, {"state": 1})
+        self.loads += 1
+        return False, (doc or {}).get("state")
+
+    async def refresh_user_data(self, user_id, user_data): await self._refresh(f"u{user_id}", user_data)
+    async def refresh_chat_data(self, chat_id, chat_data): await self._refresh(f"c{chat_id}", chat_data)
+    async def refresh_bot_data(self, bot_data): pass
+
+    async def update_user_data(self, user_id, data): self._mark(col_sessions, f"u{user_id}", data and {"data": data})
+    async def update_chat_data(self, chat_id, data): self._mark(col_sessions, f"c{chat_id}", data and {"data": data})
+    async def drop_user_data(self, user_id): self._mark(col_sessions, f"u{user_id}", None)
+    async def drop_chat_data(self, chat_id): self._mark(col_sessions, f"c{chat_id}", None)
+    async def update_bot_data(self, data): pass
+    async def update_callback_data(self, data): pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(col_conversations, self._conv_id(name, key), None if new_state is None else {"state": new_state})
+
+    async def _write(self):
+        ops, self.dirty = self.dirty, {}
+        if not ops: return
+        started = time.monotonic()
+        by_col = defaultdict(list)
+        for (col, _), op in ops.items(): by_col[col].append(op)
+        try:
+            for col, col_ops in by_col.items():
+                for i in range(0, len(col_ops), self.batch):
+                    await db[col].bulk_write(col_ops[i:i + self.batch], ordered=False)
+        except Exception:
+            # Keep anything not superseded meanwhile for the next flush.
+            for k, op in ops.items(): self.dirty.setdefault(k, op)
+            raise
+        self.writes += len(ops)
+        self.flushes += 1
+        self.flush_seconds += time.monotonic() - started
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try: await self._write()
+            except asyncio.CancelledError: raise
+            except Exception as e: logger.error(f"Session flush failed: {e}")
+
+    async def flush(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write()
+
+    def stats(self):
+        return {"loaded": len(self.loaded), "pending_writes": len(self.dirty), "loads": self.loads,
+                "writes": self.writes, "flushes": self.flushes, "resyncs": self.resyncs,
+                "avg_flush_ms": f"{self.flush_seconds / self.flushes * 1000:.1f}" if self.flushes else "-"}
+
+persistence = MongoPersistence()
+
+# PTB reads conversation state once, at startup, so with several replicas
+# behind the webhook a conversation moved on elsewhere would never be seen
+# here. With SESSION_SYNC=1, sync_conversation runs ahead of every update
+# (group -1) and reloads the state for its key, unless this replica moved that
+# key within the last two flush intervals (then the local state is the newer
+# one). If the stored state differs, the user's data is reloaded along with
+# it. That costs a find_one per update, so leave it off for a single replica.
+# A change reaches Mongo up to ~2 x PERSIST_INTERVAL after it is made; a user
+# bouncing between replicas faster than that may still be answered from the
+# old state, so keep PERSIST_INTERVAL short or route users stickily.
+#
+# ConversationHandler has no public API for any of this. Every use of its
+# internals (_get_key, _update_state, the _conversations TrackingDict and
+# PendingState) is in SharedConversationHandler, written against
+# python-telegram-bot 20.7; it refuses to start on any other version.
+class SharedConversationHandler(ConversationHandler):
+    PTB_VERSION = "20.7"
+
+    def __init__(self, *args, **kwargs):
+        if PTB_VERSION != self.PTB_VERSION:
+            raise RuntimeError(f"SESSION_SYNC relies on python-telegram-bot {self.PTB_VERSION} internals, found {PTB_VERSION}; "
+                               "re-check SharedConversationHandler or set SESSION_SYNC=0")
+        from telegram.ext._conversationhandler import PendingState
+        super().__init__(*args, **kwargs)
+        self.pending_type = PendingState
+        self.changed = {}    # key -> when this replica last moved it
+
+    def _update_state(self, new_state, key, handler=None):
+        super()._update_state(new_state, key, handler)
+        self.changed[key] = time.monotonic()
+
+    def key(self, update): return self._get_key(update)
+
+    # Local state of a key, or the pending_type sentinel while its handler is still running.
+    def state(self, key):
+        current = self._conversations.get(key)
+        return self.pending_type if isinstance(current, self.pending_type) else current
+
+    # Untracked on purpose: this is Mongo's state, nothing to write back.
+    def load(self, key, state):
+        if state is None: self._conversations.data.pop(key, None)
+        else: self._conversations.update_no_track({key: state})
+
+async def sync_conversation(conv, update, context):
+    if not (update.effective_chat and update.effective_user): return
+    key = conv.key(update)
+    changed = conv.changed.get(key)
+    if changed is not None:
+        if time.monotonic() - changed < 2 * persistence.interval + 1: return
+        del conv.changed[key]
+    current = conv.state(key)
+    if current is conv.pending_type: return
+    pending, stored = await persistence.load_conversation(conv.name, key)
+    if pending or stored == current: return
+    conv.load(key, stored)
+    persistence.resyncs += 1
+    persistence.loaded.pop(f"u{update.effective_user.id}", None)
+    await persistence.refresh_user_data(update.effective_user.id, context.user_data)
+STATS_SOURCES["Sessions"] = persistence.stats
+STATS_SOURCES["Query profiler"] = query_profiler.stats
+
+# Only changes that show up on a rendered page drop cached pages (media_health
+# write-backs, for one, don't).
+def renders(change, fields):
+    if change.get("operationType") != "update": return True
+    return bool(fields & set(change.get("updateDescription", {}).get("updatedFields", {})))
+
+def invalidate_vault_pages(folder=None):
+    render_cache.invalidate("vfold", folder)
+    render_cache.invalidate("folders")
+
+# Polling fallback: the bot never edits names in place, so a changed document
+# count is what another replica's add or delete looks like.
+poll_counts = {}
+
+async def count_changed(col):
+    n = await col.estimated_document_count()
+    changed = poll_counts.get(col.name, n) != n
+    poll_counts[col.name] = n
+    return changed
+
+async def on_guides_change(change):
+    search_index.apply(change)
+    ordinal_index.apply(change)
+    if renders(change, {"name", "type"}): render_cache.invalidate("list", (change.get("fullDocument") or {}).get("type"))
+
+async def poll_guides():
+    await search_index.catch_up()
+    await ordinal_index.catch_up()
+    if await count_changed(col_guides): render_cache.invalidate("list")
+
+async def on_vaults_change(change):
+    search_index.apply(change, vault=True)
+    if renders(change, {"sub_name", "folder"}): invalidate_vault_pages((change.get("fullDocument") or {}).get("folder"))
+
+async def poll_vaults():
+    await search_index.catch_up(vault=True)
+    if await count_changed(col_vaults): invalidate_vault_pages()
 
 # --- USER START ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear() 
-    w, _, _ = await get_settings()
+    w = await settings_cache.get("welcome")
     
     kb = [
         [InlineKeyboardButton("Adult Stream 🔥", callback_data="u_ad_0")], 
@@ -78,7 +1499,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             msg = await update.message.reply_photo(w["photo"], caption=w["text"], reply_markup=markup)
         else:
             msg = await update.message.reply_text(w["text"], reply_markup=markup)
-        context.job_queue.run_once(del_msg, 60, data=msg.message_id, chat_id=update.effective_chat.id)
+        await expiry_queue.schedule(update.effective_chat.id, [msg.message_id], 60)
     else:
         try:
             if w.get("photo"):
@@ -106,6 +1527,66 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 # --- USER ROUTER ---
+# One list_ page -> (text, keyboard, guide ids shown).
+async def render_list(g_type, page, cursor, search_query=None, LIMIT=50):
+    skip = page * LIMIT
+    if search_query:
+        ids = await search_ids(g_type, search_query)
+        total_count = len(ids)
+        items = await fetch_ordered(col_guides, ids[skip:skip + LIMIT], {"name": 1})
+        header = f"🔍 <b>SEARCH: {html.escape(search_query)}</b>\n\n"
+    else:
+        # Keyset paging: the cursor is "a<_id>" (after) or "b<_id>" (before).
+        # A page past the first without one comes from a keyboard sent before
+        # cursors existed; skip there once, its buttons carry cursors again.
+        db_query = {"type": g_type}
+        if cursor: db_query["_id"] = {"$gt" if cursor[0] == "a" else "$lt": ObjectId(cursor[1:])}
+        found = col_guides.find(db_query, {"name": 1}).sort("_id", -1 if cursor[:1] == "b" else 1)
+        if page and not cursor: found = found.skip(skip)
+        items = await found.limit(LIMIT).to_list(LIMIT)
+        if cursor[:1] == "b": items.reverse()
+        total_count = await guide_count(g_type)
+        header = f"📖 <b>{g_type.upper()} LIST</b> (Page {page+1}/{max(1, math.ceil(total_count / LIMIT))})\n\n"
+
+    if not items:
+        txt = header + "❌ No content found."
+    else:
+        txt = header + "Reply with <b>Number</b> to watch:\n(Type text to search)\n\n"
+        for i, item in enumerate(items):
+            if search_query:
+                display_num = i + 1 
+            else:
+                display_num = skip + i + 1
+            txt += f"<b>{display_num}.</b> {html.escape(str(item.get('name', 'Unknown')))}\n"
+
+    nav_kb = []
+    prev_cb, next_cb = f"list_{g_type}_{page-1}", f"list_{g_type}_{page+1}"
+    if not search_query and items:
+        if page > 1: prev_cb += f"_b{items[0]['_id']}"
+        next_cb += f"_a{items[-1]['_id']}"
+    if page > 0: nav_kb.append(InlineKeyboardButton("⬅️ Prev", callback_data=prev_cb))
+    if skip + LIMIT < total_count and (search_query or items): nav_kb.append(InlineKeyboardButton("Next ➡️", callback_data=next_cb))
+
+    kb = []
+    if nav_kb: kb.append(nav_kb)
+    kb.append([InlineKeyboardButton("🔍 Search", callback_data=f"search_{g_type}")])
+    kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
+    return txt, InlineKeyboardMarkup(kb), [x["_id"] for x in items]
+
+async def render_folders():
+    folders = await catalog_folders()
+    btns = [InlineKeyboardButton(f, callback_data=f"vfold_{f}") for f in folders]
+    kb = [btns[i:i + 2] for i in range(0, len(btns), 2)]
+    kb.append([InlineKeyboardButton("🔍 Search Vault", callback_data="v_search_start")])
+    kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
+    return InlineKeyboardMarkup(kb),
+
+async def render_folder(fname):
+    items, _ = await catalog_items(fname)
+    txt = f"📁 <b>{fname}</b>\n\nReply with <b>Number</b> to unlock:\n"
+    for i, x in enumerate(items): txt += f"{i+1}. {x['sub_name']}\n"
+    return txt, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="u_vault_folders")]]), [x["id"] for x in items]
+
 async def user_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -113,38 +1594,46 @@ async def user_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # --- UPDATES ---
     if query.data == "u_updates":
-        _, _, u = await get_settings()
-        txt = f"📢 <b>UPDATES</b>\n\n{html.escape(str(u.get('desc', 'Check our channels!')))}\n\n"
-        if u.get('links'):
-            txt += "👇 <b>Join Here:</b>\n"
-            for link in u['links']:
-                txt += f"• {html.escape(str(link.get('name', 'Channel')))} - <a href='{link.get('url', '')}'><b>Click Me</b></a>\n"
-        else:
-            txt += "No updates yet."
-        kb = [[InlineKeyboardButton("🔙 Back", callback_data="main")]]
+        page = render_cache.get(("updates",))
+        if page is None:
+            epoch = render_cache.epoch
+            u = await settings_cache.get("updates")
+            txt = f"📢 <b>UPDATES</b>\n\n{html.escape(str(u.get('desc', 'Check our channels!')))}\n\n"
+            if u.get('links'):
+                txt += "👇 <b>Join Here:</b>\n"
+                for link in u['links']:
+                    txt += f"• {html.escape(str(link.get('name', 'Channel')))} - <a href='{link.get('url', '')}'><b>Click Me</b></a>\n"
+            else:
+                txt += "No updates yet."
+            page = render_cache.put(("updates",), epoch, txt, InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="main")]]))
+        txt, markup = page
         if query.message.photo:
             await query.message.delete()
-            await query.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(kb), disable_web_page_preview=True)
+            await query.message.reply_text(txt, reply_markup=markup, disable_web_page_preview=True)
         else:
-            await query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb), disable_web_page_preview=True)
+            await query.edit_message_text(txt, reply_markup=markup, disable_web_page_preview=True)
         return ConversationHandler.END
 
     # --- ADULT STREAM ---
     if query.data.startswith("u_ad"):
         page = int(query.data.split("_")[-1]) if "_" in query.data else 0
-        _, ad, _ = await get_settings()
-        channels = ad.get("channels", [])
-        ITEMS_PER_PAGE = 8
-        start_idx = page * ITEMS_PER_PAGE
-        end_idx = start_idx + ITEMS_PER_PAGE
-        current_batch = channels[start_idx:end_idx]
-        kb = [[InlineKeyboardButton(c["name"], url=c["link"])] for c in current_batch]
-        nav = []
-        if page > 0: nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"u_ad_{page-1}"))
-        if end_idx < len(channels): nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"u_ad_{page+1}"))
-        if nav: kb.append(nav)
-        kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
-        markup = InlineKeyboardMarkup(kb)
+        cached = render_cache.get(("ad", page))
+        if cached is None:
+            epoch = render_cache.epoch
+            ad = await settings_cache.get("adult")
+            channels = ad.get("channels", [])
+            ITEMS_PER_PAGE = 8
+            start_idx = page * ITEMS_PER_PAGE
+            end_idx = start_idx + ITEMS_PER_PAGE
+            current_batch = channels[start_idx:end_idx]
+            kb = [[InlineKeyboardButton(c["name"], url=c["link"])] for c in current_batch]
+            nav = []
+            if page > 0: nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"u_ad_{page-1}"))
+            if end_idx < len(channels): nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"u_ad_{page+1}"))
+            if nav: kb.append(nav)
+            kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
+            cached = render_cache.put(("ad", page), epoch, ad, InlineKeyboardMarkup(kb))
+        ad, markup = cached
         try:
             if ad.get("photo"):
                 if query.message.photo:
@@ -174,49 +1663,23 @@ async def user_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         search_query = context.user_data.get("search_query")
         
-        if search_query:
-            regex_pattern = re.escape(search_query)
-            db_query = {"type": g_type, "name": {"$regex": regex_pattern, "$options": "i"}}
-            header = f"🔍 <b>SEARCH: {html.escape(search_query)}</b>\n\n"
-        else:
-            db_query = {"type": g_type}
-            header = f"📖 <b>{g_type.upper()} LIST</b> (Page {page+1})\n\n"
-
-        total_count = await col_guides.count_documents(db_query)
-        items = await col_guides.find(db_query).sort("_id", 1).skip(skip).limit(LIMIT).to_list(LIMIT)
-
-        if not items:
-            txt = header + "❌ No content found."
-        else:
-            txt = header + "Reply with <b>Number</b> to watch:\n(Type text to search)\n\n"
-            for i, item in enumerate(items):
-                if search_query:
-                    display_num = i + 1 
-                else:
-                    display_num = skip + i + 1
-                txt += f"<b>{display_num}.</b> {html.escape(str(item.get('name', 'Unknown')))}\n"
+        cursor = parts[3] if len(parts) > 3 else ""
+        if search_query: txt, markup, ids = await render_list(g_type, page, cursor, search_query)
+        else: txt, markup, ids = await render_cache.page(("list", g_type, page, cursor), lambda: render_list(g_type, page, cursor))
 
-        nav_kb = []
-        if page > 0: nav_kb.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"list_{g_type}_{page-1}"))
-        if skip + LIMIT < total_count: nav_kb.append(InlineKeyboardButton("Next ➡️", callback_data=f"list_{g_type}_{page+1}"))
-        
-        kb = []
-        if nav_kb: kb.append(nav_kb)
-        kb.append([InlineKeyboardButton("🔍 Search", callback_data=f"search_{g_type}")])
-        kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
-        
         context.user_data["view_type"] = g_type
+        snapshots.put(update.effective_user.id, ("guides", g_type), ids, 0 if search_query else skip)
         if not query.data.startswith("list_") and "search_query" in context.user_data:
              del context.user_data["search_query"]
 
         try:
             if query.message.photo:
                 await query.message.delete()
-                await query.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(kb))
+                await query.message.reply_text(txt, reply_markup=markup)
             else:
-                await query.edit_message_text(txt, reply_markup=InlineKeyboardMarkup(kb))
+                await query.edit_message_text(txt, reply_markup=markup)
         except:
-             await query.message.reply_text(txt, reply_markup=InlineKeyboardMarkup(kb))
+             await query.message.reply_text(txt, reply_markup=markup)
         return U_GUIDE_SELECT
 
     # --- SEARCH TRIGGER ---
@@ -229,13 +1692,9 @@ async def user_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # --- VAULT FOLDERS ---
     elif query.data == "u_vault_folders":
-        folders = await col_vaults.distinct("folder")
-        btns = [InlineKeyboardButton(f, callback_data=f"vfold_{f}") for f in folders]
-        kb = [btns[i:i + 2] for i in range(0, len(btns), 2)]
-        kb.append([InlineKeyboardButton("🔍 Search Vault", callback_data="v_search_start")])
-        kb.append([InlineKeyboardButton("🔙 Back", callback_data="main")])
+        markup, = await render_cache.page(("folders",), render_folders)
         await query.message.delete()
-        await query.message.reply_text("📂 Select a Folder:", reply_markup=InlineKeyboardMarkup(kb))
+        await query.message.reply_text("📂 Select a Folder:", reply_markup=markup)
         return ConversationHandler.END
 
     # --- VAULT SEARCH TRIGGER ---
@@ -246,12 +1705,11 @@ async def user_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # --- VAULT CONTENTS ---
     elif query.data.startswith("vfold_"):
         fname = query.data.replace("vfold_", "")
-        items = await col_vaults.find({"folder": fname}).sort("_id", 1).to_list(100)
-        txt = f"📁 <b>{fname}</b>\n\nReply with <b>Number</b> to unlock:\n"
-        for i, x in enumerate(items): txt += f"{i+1}. {x['sub_name']}\n"
+        txt, markup, ids = await render_cache.page(("vfold", fname), lambda: render_folder(fname))
         context.user_data["active_vault_folder"] = fname
+        snapshots.put(update.effective_user.id, ("vault", fname), ids)
         await query.message.delete()
-        await query.message.reply_text(txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="u_vault_folders")]]))
+        await query.message.reply_text(txt, reply_markup=markup)
         return U_V_SUB_SELECT
 
 # --- SEARCH HANDLERS ---
@@ -262,10 +1720,8 @@ async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["view_type"] = g_type 
     
     LIMIT = 50
-    regex_pattern = re.escape(query_text)
-    db_query = {"type": g_type, "name": {"$regex": regex_pattern, "$options": "i"}}
-    
-    items = await col_guides.find(db_query).sort("_id", 1).limit(LIMIT).to_list(LIMIT)
+    items = await fetch_ordered(col_guides, await search_ids(g_type, query_text, LIMIT), {"name": 1})
+    snapshots.put(update.effective_user.id, ("guides", g_type), [x["_id"] for x in items])
     
     txt = f"🔍 <b>RESULTS FOR: '{html.escape(query_text)}'</b>\n\n"
     if not items:
@@ -282,15 +1738,7 @@ async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def perform_vault_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query_text = update.message.text
-    regex_pattern = re.escape(query_text)
-    db_query = {
-        "$or": [
-            {"sub_name": {"$regex": regex_pattern, "$options": "i"}},
-            {"folder": {"$regex": regex_pattern, "$options": "i"}}
-        ]
-    }
-    
-    items = await col_vaults.find(db_query).sort("_id", 1).limit(20).to_list(20)
+    items = await fetch_ordered(col_vaults, await search_ids("vault", query_text, 20), {"folder": 1, "sub_name": 1})
     
     if not items:
         await update.message.reply_text("❌ No vault files found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="u_vault_folders")]]))
@@ -316,6 +1764,39 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🛠 <b>ADMIN PANEL</b>", reply_markup=InlineKeyboardMarkup(kb))
     return ConversationHandler.END
 
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    txt = "📊 <b>STATS</b>\n"
+    for name, source in STATS_SOURCES.items():
+        txt += f"\n<b>{name}</b>\n" + "".join(f"• {k}: {html.escape(str(v))}\n" for k, v in source().items())
+    await update.message.reply_text(txt)
+
+# /queries: top query shapes by total time; /queries create builds the suggested indexes.
+async def admin_queries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    suggestions = await query_profiler.advise()
+    txt = "🔎 <b>QUERIES</b> (by total time, ⚠️ = scan or in-memory sort)\n\n"
+    txt += "\n".join(f"• {html.escape(line)}" for line in query_profiler.report()) or "No queries recorded yet."
+    if context.args and context.args[0] == "create" and suggestions:
+        made = await query_profiler.create(suggestions)
+        txt += "\n\n<b>Created</b>\n" + "".join(f"• {html.escape(m)}\n" for m in made)
+    elif suggestions:
+        txt += "\n\n<b>Suggested indexes</b> (/queries create)\n"
+        txt += "".join(f"• {col} {html.escape(str(dict(keys)))} ← {html.escape(why)}\n" for col, keys, why in suggestions)
+    await update.message.reply_text(txt[:4000])
+
+# /broken: guides and vault packs with file_ids marked dead by media_health.
+async def admin_broken(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    guides = await browse(col_guides).find({"file_dead": True}, {"name": 1, "type": 1}).to_list(50)
+    vault_ids = await browse(col_vault_files).distinct("vault_id", {"files.dead": True})
+    vaults = await browse(col_vaults).find({"_id": {"$in": vault_ids[:50]}}, {"folder": 1, "sub_name": 1}).to_list(50)
+    txt = f"🩹 <b>BROKEN MEDIA</b>\n\n<b>Guides ({len(guides)})</b>\n"
+    txt += "".join(f"• {g.get('type')}: {html.escape(str(g.get('name')))}\n" for g in guides) or "None\n"
+    txt += f"\n<b>Vault packs ({len(vault_ids)})</b>\n"
+    txt += "".join(f"• {html.escape(str(v.get('folder')))} / {html.escape(str(v.get('sub_name')))}\n" for v in vaults) or "None\n"
+    await update.message.reply_text(txt[:4000])
+
 async def admin_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -343,6 +1824,7 @@ async def save_w_txt(update, context):
 async def save_w_pho(update, context):
     fid = get_fid(update.message)
     await col_settings.update_one({"type": "welcome"}, {"$set": {"text": context.user_data["wt"], "photo": fid}}, upsert=True)
+    await settings_cache.refresh("welcome")
     await update.message.reply_text("✅ Welcome Set!"); return ConversationHandler.END
 
 # --- ANIME/MOVIE LOGIC ---
@@ -375,7 +1857,13 @@ async def save_g_chan(update, context):
 
 async def save_g_final(update, context):
     context.user_data["gtmp"]["link"] = update.message.text
-    await col_guides.insert_one(context.user_data["gtmp"])
+    g = context.user_data["gtmp"]
+    g["search_keys"] = search_keys(g["name"])
+    await col_guides.insert_one(g)
+    await counters.incr(f"guides:{g['type']}")
+    search_index.add(g["type"], g["_id"], g["name"])
+    ordinal_index.add(g["type"], g["_id"])
+    render_cache.invalidate("list", g["type"])
     await update.message.reply_text("✅ Content Added!"); return ConversationHandler.END
 
 # --- UPDATES LOGIC ---
@@ -389,7 +1877,7 @@ async def upd_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("➕ Send: Name | Link")
         return UPD_ADD_LINK
     if query.data == "upd_rem":
-        _, _, u = await get_settings()
+        u = await settings_cache.get("updates")
         if not u.get('links'): 
             await query.edit_message_text("No links to remove.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_upd")]]))
             return UPD_MENU
@@ -412,6 +1900,7 @@ async def upd_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def save_upd_desc(update, context):
     await col_settings.update_one({"type": "updates"}, {"$set": {"desc": update.message.text}}, upsert=True)
+    await settings_cache.refresh("updates")
     await update.message.reply_text("✅ Description Updated!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_upd")]]))
     return UPD_MENU
 
@@ -419,6 +1908,7 @@ async def save_upd_link(update, context):
     try:
         parts = update.message.text.split("|")
         await col_settings.update_one({"type": "updates"}, {"$push": {"links": {"name": parts[0].strip(), "url": parts[1].strip()}}}, upsert=True)
+        await settings_cache.refresh("updates")
         await update.message.reply_text("✅ Link Added! Send another or click Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_upd")]]))
         return UPD_ADD_LINK
     except:
@@ -429,12 +1919,117 @@ async def del_upd_link(update, context):
     idx = int(update.callback_query.data.split("_")[-1])
     await col_settings.update_one({"type": "updates"}, {"$unset": {f"links.{idx}": 1}})
     await col_settings.update_one({"type": "updates"}, {"$pull": {"links": None}})
+    await settings_cache.refresh("updates")
     await update.callback_query.edit_message_text("✅ Removed!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_upd")]]))
     return UPD_MENU
 
+# --- UPLOAD STAGING ---
+# Bulk upload mode collects into one vault_staging document per admin rather
+# than user_data, so a restart mid-upload keeps what was already flushed. Files
+# are buffered per admin and written with a single $push/$each when an album
+# (media_group_id) is complete, every STAGE_BATCH files, or every STAGE_FLUSH
+# seconds; progress is one status message edited in place. A finished album is
+# cut off the buffer before the next file goes in and written by a task; one
+# user's writes queue on their lock in the order they were cut.
+class UploadStager:
+    def __init__(self, batch=STAGE_BATCH):
+        self.batch = batch
+        self.buffers = {}     # user -> {"files", "group", "chat", "msg", "count", "edited", "since"}
+        self.locks = defaultdict(asyncio.Lock)
+        self.writes = {}      # user -> their latest write task
+        self.tasks = set()
+        self.bot = None
+        self.files = self.flushes = self.errors = 0
+
+    async def begin(self, user, v_data):
+        self.buffers.pop(user, None)
+        await self.flush(user)   # a previous upload's writes must not land in this one
+        await col_staging.replace_one({"_id": user}, {**v_data, "files": [], "count": 0, "created": datetime.utcnow()}, upsert=True)
+
+    async def add(self, bot, user, chat_id, fid, ftype, group=None):
+        buf = self.buffers.get(user)
+        if buf is None:
+            buf = self.buffers[user] = {"files": [], "group": None, "chat": chat_id, "msg": None, "count": 0, "edited": 0.0, "since": 0.0}
+            try: buf["msg"] = (await bot.send_message(chat_id, "📥 Receiving files… Send more or /done")).message_id
+            except Exception: pass
+        self.bot = self.bot or bot
+        if buf["files"] and group != buf["group"]: self.cut(user, buf)
+        if not buf["files"]: buf["since"] = time.monotonic()
+        buf["files"].append({"id": fid, "type": ftype})
+        buf["group"] = group
+        self.files += 1
+        if len(buf["files"]) >= self.batch: await self.flush(user)
+
+    # Takes the buffered files out and starts their write.
+    def cut(self, user, buf):
+        files, buf["files"] = buf["files"], []
+        task = self.writes[user] = asyncio.create_task(self.write(user, files))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # Writes out what is buffered and waits until every earlier write is in.
+    async def flush(self, user):
+        buf = self.buffers.get(user)
+        if buf and buf["files"]: self.cut(user, buf)
+        task = self.writes.get(user)
+        if task: await asyncio.shield(task)
+        if self.writes.get(user) is task: self.writes.pop(user, None)
+
+    async def write(self, user, files):
+        async with self.locks[user]:
+            buf = self.buffers.get(user)
+            try:
+                doc = await col_staging.find_one_and_update({"_id": user}, {"$push": {"files": {"$each": files}}, "$inc": {"count": len(files)}},
+                                                            projection={"count": 1}, return_document=ReturnDocument.AFTER)
+            except Exception as e:
+                self.errors += 1
+                if buf: buf["files"] = files + buf["files"]
+                logger.error(f"Staging flush for {user} failed: {e}")
+                return
+            self.flushes += 1
+            if doc is None or not buf: return   # upload was finalized or restarted meanwhile
+            buf["count"] = doc["count"]
+        await self.progress(buf)
+
+    async def progress(self, buf):
+        now = time.monotonic()
+        if not buf["msg"] or not self.bot or now - buf["edited"] < STAGE_PROGRESS_EVERY: return
+        buf["edited"] = now
+        try: await self.bot.edit_message_text(f"📥 {buf['count']} files saved. Send more or /done", buf["chat"], buf["msg"])
+        except Exception: pass
+
+    # Flushes what's left and hands back the staged record, or None if nothing was staged.
+    async def finish(self, user):
+        await self.flush(user)
+        buf = self.buffers.pop(user, None)
+        if buf and buf["msg"] and self.bot:
+            try: await self.bot.delete_message(buf["chat"], buf["msg"])
+            except Exception: pass
+        return await col_staging.find_one({"_id": user})
+
+    async def flush_all(self):
+        for user in list(self.buffers): await self.flush(user)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def run(self, bot):
+        self.bot = bot
+        while True:
+            await asyncio.sleep(STAGE_FLUSH)
+            now = time.monotonic()
+            for user, buf in list(self.buffers.items()):
+                if buf["files"] and now - buf["since"] >= STAGE_FLUSH: await self.flush(user)
+
+    def stats(self):
+        return {"uploading": len(self.buffers), "buffered": sum(len(b["files"]) for b in self.buffers.values()),
+                "files": self.files, "flushes": self.flushes, "errors": self.errors}
+
+stager = UploadStager()
+STATS_SOURCES["Upload staging"] = stager.stats
+
 # --- VAULT SAVING ---
 async def v_sub(update, context):
-    context.user_data["v_data"] = {"folder": update.message.text, "files": []}
+    context.user_data["v_data"] = {"folder": update.message.text}
     await update.message.reply_text("📝 Sub-Name (e.g. Episode 1):"); return A_V_SUB
 
 async def v_post(update, context):
@@ -449,25 +2044,32 @@ async def v_desc(update, context):
 
 async def v_files_start(update, context):
     context.user_data["v_data"]["desc"] = update.message.text
+    await stager.begin(update.effective_user.id, context.user_data.pop("v_data"))
     await update.message.reply_text("📎 <b>BULK UPLOAD MODE</b>\n\nSend videos, photos, or files one by one.\nWhen finished, type <code>/done</code> to save all under one key."); return A_V_FILES
 
 async def v_collect(update, context):
     msg_text = update.message.text or ""
+    user = update.effective_user.id
     if msg_text.lower() == "/done":
-        if "v_data" not in context.user_data:
+        staged = await stager.finish(user)
+        if staged is None:
             await update.message.reply_text("❌ Session expired. Start over."); return ConversationHandler.END
-        if not context.user_data["v_data"]["files"]:
+        if not staged["files"]:
             await update.message.reply_text("❌ No files added! Send files first."); return A_V_FILES
-        key = "".join(secrets.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789!@#$%^&*") for _ in range(12))
-        context.user_data["v_data"]["key"] = key
-        await col_vaults.insert_one(context.user_data["v_data"])
-        await update.message.reply_text(f"✅ <b>Bulk Saved!</b>\n\n📂 Folder: {context.user_data['v_data']['folder']}\n📄 Files: {len(context.user_data['v_data']['files'])}\n🔑 Key: <code>{key}</code>"); return ConversationHandler.END
+        key = new_vault_key()
+        files = staged["files"]
+        v = {k: x for k, x in staged.items() if k not in ("_id", "files", "count", "created")}
+        v.update(key=key, file_count=len(files), search_keys=search_keys(v["sub_name"], v["folder"]))
+        await col_vaults.insert_one(v)
+        await save_manifest(v["_id"], files)
+        await col_staging.delete_one({"_id": user})
+        await catalog_add(v)
+        search_index.add("vault", v["_id"], v["sub_name"], v["folder"])
+        invalidate_vault_pages(v["folder"])
+        await update.message.reply_text(f"✅ <b>Bulk Saved!</b>\n\n📂 Folder: {v['folder']}\n📄 Files: {len(files)}\n🔑 Key: <code>{key}</code>"); return ConversationHandler.END
     fid, ftype = get_file_info(update.message)
     if fid: 
-        context.user_data["v_data"]["files"].append({"id": fid, "type": ftype})
-        count = len(context.user_data['v_data']['files'])
-        if count % 5 == 0 or count == 1:
-            await update.message.reply_text(f"✅ {count} files queued. Send more or /done")
+        await stager.add(context.bot, user, update.effective_chat.id, fid, ftype, update.message.media_group_id)
     else: 
         await update.message.reply_text("❌ Not a file. Send file or /done")
     return A_V_FILES
@@ -485,6 +2087,7 @@ async def ad_lnk_fn(update, context):
     try:
         parts = update.message.text.split("|")
         await col_settings.update_one({"type": "adult"}, {"$set": {"photo": context.user_data["ad_tmp"]["photo"], "text": context.user_data["ad_tmp"]["text"]}, "$push": {"channels": {"name": parts[0].strip(), "link": parts[1].strip()}}}, upsert=True)
+        await settings_cache.refresh("adult")
         await update.message.reply_text("✅ <b>Saved! Preview:</b>")
         if context.user_data["ad_tmp"]["photo"]:
             await update.message.reply_photo(context.user_data["ad_tmp"]["photo"], caption=context.user_data["ad_tmp"]["text"])
@@ -494,6 +2097,532 @@ async def ad_lnk_fn(update, context):
         return AD_LNK_STATE
     except: await update.message.reply_text("Err: Name | Link"); return AD_LNK_STATE
 
+def new_vault_key(): return "".join(secrets.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789!@#$%^&*") for _ in range(12))
+
+# --- IMPORT / EXPORT ---
+# /import guides|vaults, then a .jsonl or .csv document: records are parsed and
+# validated one at a time and written IMPORT_BATCH at a time with unordered
+# insert_many, so a bad or duplicate record costs only itself. Counters,
+# catalog, search/ordinal indexes and rendered pages are updated once per batch.
+# /export guides|vaults [csv] streams the collection back in the same format.
+# CSV vault files are "file_id:type" separated by spaces. Bots can only
+# download documents up to 20 MB; CSV is about 2/3 the size of JSONL.
+GUIDE_FIELDS = ("type", "name", "file", "media_type", "desc", "chan_name", "chan_link", "link")
+VAULT_FIELDS = ("folder", "sub_name", "poster", "desc", "key", "files")
+
+def read_records(data, filename):
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    if filename.lower().endswith(".csv"):
+        for n, row in enumerate(csv.DictReader(text), 2): yield n, row
+        return
+    for n, line in enumerate(text, 1):
+        if not line.strip(): continue
+        try: yield n, json.loads(line)
+        except ValueError as e: yield n, e
+
+def clean_guide(r):
+    g = {k: str(r.get(k) or "").strip() for k in GUIDE_FIELDS}
+    if g["type"] not in GUIDE_TYPES: raise ValueError(f"type must be one of {', '.join(GUIDE_TYPES)}")
+    if not g["name"] or not g["file"]: raise ValueError("name and file are required")
+    g["media_type"] = g["media_type"] or "photo"
+    if g["media_type"] not in MEDIA_TYPES: raise ValueError(f"unknown media_type {g['media_type']}")
+    g["search_keys"] = search_keys(g["name"])
+    return g
+
+def clean_vault(r):
+    files = r.get("files") or []
+    if isinstance(files, str):
+        files = [{"id": f.partition(":")[0], "type": f.partition(":")[2] or "document"} for f in files.split()]
+    files = [{"id": str(f["id"]), "type": f.get("type") or "document"} if isinstance(f, dict) else {"id": str(f), "type": "document"} for f in files]
+    v = {k: str(r.get(k) or "").strip() for k in ("folder", "sub_name", "poster", "desc", "key")}
+    if not v["folder"] or not v["sub_name"]: raise ValueError("folder and sub_name are required")
+    if not files: raise ValueError("files are required")
+    if any(f["type"] not in MEDIA_TYPES for f in files): raise ValueError("unknown file type")
+    v["key"] = v["key"] or new_vault_key()
+    v["file_count"] = len(files)
+    v["search_keys"] = search_keys(v["sub_name"], v["folder"])
+    return v, files
+
+class ImportReport:
+    def __init__(self):
+        self.read = self.added = self.rejected = 0
+        self.errors = []   # first few (line, reason)
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.errors) < 10: self.errors.append((line, str(reason)[:100]))
+
+    def summary(self):
+        txt = f"read {self.read:,} | added {self.added:,} | rejected {self.rejected:,}"
+        return txt + "".join(f"\n• line {n}: {html.escape(e)}" for n, e in self.errors)
+
+# -> the docs insert_many actually stored; the rest are reported against their line.
+async def insert_batch(col, docs, lines, report):
+    try: await col.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+        for i, msg in failed.items(): report.reject(lines[i], "duplicate" if "E11000" in msg else msg)
+        docs = [d for i, d in enumerate(docs) if i not in failed]
+    report.added += len(docs)
+    return docs
+
+async def import_guides(batch, lines, report):
+    docs = await insert_batch(col_guides, batch, lines, report)
+    added = defaultdict(int)
+    for d in docs:
+        added[d["type"]] += 1
+        search_index.add(d["type"], d["_id"], d["name"])
+        ordinal_index.add(d["type"], d["_id"])
+    for g_type, n in added.items():
+        await counters.incr(f"guides:{g_type}", n)
+        render_cache.invalidate("list", g_type)
+
+async def import_vaults(batch, lines, report):
+    files = {id(v): f for v, f in batch}
+    docs = await insert_batch(col_vaults, [v for v, _ in batch], lines, report)
+    chunks = [{"vault_id": v["_id"], "seq": i // VAULT_CHUNK, "files": files[id(v)][i:i + VAULT_CHUNK]}
+              for v in docs for i in range(0, len(files[id(v)]), VAULT_CHUNK)]
+    if chunks: await col_vault_files.insert_many(chunks, ordered=False)
+    by_folder = defaultdict(list)
+    for v in docs:
+        by_folder[v["folder"]].append({"id": v["_id"], "sub_name": v["sub_name"]})
+        search_index.add("vault", v["_id"], v["sub_name"], v["folder"])
+    if by_folder:
+        await col_catalog.bulk_write([UpdateOne({"_id": f}, {"$inc": {"count": len(items)}, "$push": {"items": {"$each": items}}}, upsert=True)
+                                      for f, items in by_folder.items()], ordered=False)
+        invalidate_vault_pages()
+
+# progress(report) is awaited after every batch.
+async def import_records(kind, records, progress=None, batch_size=IMPORT_BATCH):
+    clean, write = (clean_guide, import_guides) if kind == "guides" else (clean_vault, import_vaults)
+    report, batch, lines = ImportReport(), [], []
+    for line, record in records:
+        report.read += 1
+        try:
+            if isinstance(record, Exception) or not isinstance(record, dict): raise ValueError(f"not a record: {record}")
+            batch.append(clean(record))
+            lines.append(line)
+        except (ValueError, KeyError, TypeError) as e: report.reject(line, e)
+        if len(batch) >= batch_size:
+            await write(batch, lines, report)
+            batch, lines = [], []
+            if progress: await progress(report)
+    if batch: await write(batch, lines, report)
+    return report
+
+# Writes JSONL or CSV lines to out (text file) straight off a projected cursor.
+async def export_records(kind, out, fmt="jsonl"):
+    n = 0
+    if kind == "guides":
+        writer = csv.DictWriter(out, GUIDE_FIELDS, extrasaction="ignore") if fmt == "csv" else None
+        if writer: writer.writeheader()
+        async for g in col_guides.find({}, {k: 1 for k in GUIDE_FIELDS} | {"_id": 0}).sort("_id", 1).batch_size(1000):
+            if writer: writer.writerow(g)
+            else: out.write(json.dumps(g, ensure_ascii=False) + "\n")
+            n += 1
+        return n
+    # Vaults sorted by _id merged with their manifest chunks sorted by (vault_id, seq).
+    writer = csv.DictWriter(out, VAULT_FIELDS, extrasaction="ignore") if fmt == "csv" else None
+    if writer: writer.writeheader()
+    chunks = col_vault_files.find({}, {"_id": 0}).sort([("vault_id", 1), ("seq", 1)]).batch_size(200).__aiter__()
+    chunk = await anext(chunks, None)
+    async for v in col_vaults.find({}, {k: 1 for k in VAULT_FIELDS if k != "files"}).sort("_id", 1).batch_size(1000):
+        files = []
+        while chunk and chunk["vault_id"] <= v["_id"]:
+            if chunk["vault_id"] == v["_id"]: files.extend(chunk["files"])
+            chunk = await anext(chunks, None)
+        v.pop("_id")
+        v["files"] = " ".join(f"{f['id']}:{f.get('type', 'document')}" for f in files) if writer else files
+        if writer: writer.writerow(v)
+        else: out.write(json.dumps(v, ensure_ascii=False, default=str) + "\n")
+        n += 1
+    return n
+
+async def admin_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    kind = (context.args or ["guides"])[0]
+    if kind not in ("guides", "vaults"):
+        await update.message.reply_text("Usage: /import guides|vaults"); return ConversationHandler.END
+    context.user_data["import_kind"] = kind
+    fields = ", ".join(GUIDE_FIELDS if kind == "guides" else VAULT_FIELDS)
+    await update.message.reply_text(f"📥 Send a .jsonl or .csv document of {kind}.\nFields: <code>{fields}</code>\n/cancel to stop.")
+    return IMPORT_FILE
+
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return ConversationHandler.END
+    doc, kind = update.message.document, context.user_data.get("import_kind", "guides")
+    try: data = bytes(await (await doc.get_file()).download_as_bytearray())
+    except BadRequest as e:
+        await update.message.reply_text(f"❌ Can't download that file ({html.escape(str(e))}). Split it below 20 MB.")
+        return IMPORT_FILE
+    status = await update.message.reply_text(f"📥 Importing {kind}…")
+    last = [time.monotonic()]
+
+    async def progress(report):
+        if time.monotonic() - last[0] < 3: return
+        last[0] = time.monotonic()
+        try: await status.edit_text(f"📥 Importing {kind}… {report.read:,} read, {report.added:,} added, {report.rejected:,} rejected")
+        except Exception: pass
+
+    started = time.monotonic()
+    report = await import_records(kind, read_records(data, doc.file_name or ""), progress)
+    logger.info(f"Import of {kind} from {doc.file_name}: {report.summary()} in {time.monotonic() - started:.1f}s")
+    await status.edit_text(f"✅ <b>Import done</b> ({time.monotonic() - started:.1f}s)\n{report.summary()}"[:4000])
+    return ConversationHandler.END
+
+async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    args = context.args or []
+    kind = "vaults" if "vaults" in args else "guides"
+    fmt = "csv" if "csv" in args else "jsonl"
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as out:
+        n = await export_records(kind, out, fmt)
+        out.seek(0)
+        await update.message.reply_document(InputFile(out.buffer, filename=f"{kind}.{fmt}"), caption=f"📤 {n:,} {kind}")
+
+# --- MEDIA HEALTH ---
+# Learns which send method works for each file_id. A type mismatch names the
+# real type ("can't use file of type Video as Photo"), so the retry goes straight
+# to it; otherwise it falls back to sending a document as before. The working
+# type is written back to the guide / manifest entry so later sends need one
+# call. An id that fails every method with "wrong file identifier"
+# MEDIA_DEAD_AFTER times in a row is marked dead there and no longer sent;
+# /broken lists those items.
+MEDIA_TYPES = ("photo", "video", "animation", "document")
+TYPE_MISMATCH = re.compile(r"file of type (\w+)", re.I)
+
+class MediaHealth:
+    def __init__(self, size=MEDIA_HEALTH_SIZE, dead_after=MEDIA_DEAD_AFTER):
+        self.size, self.dead_after = size, dead_after
+        self.entries = OrderedDict()   # file_id -> [working type or None, consecutive failures, dead]
+        self.learned = self.marked = 0
+
+    def _entry(self, fid):
+        entry = self.entries.get(fid)
+        if entry is None:
+            entry = self.entries[fid] = [None, 0, False]
+            if len(self.entries) > self.size: self.entries.popitem(last=False)
+        else: self.entries.move_to_end(fid)
+        return entry
+
+    def kind(self, fid, recorded):
+        entry = self.entries.get(fid)
+        if entry and entry[0]: return entry[0]
+        return recorded if recorded in MEDIA_TYPES else "document"
+
+    def is_dead(self, fid, recorded=False):
+        entry = self.entries.get(fid)
+        return recorded or bool(entry and entry[2])
+
+    # call(type) performs the send; owner is ("guide", _id) or ("vault", vault_id) for write-back.
+    # -> (message or None, api calls)
+    async def send(self, fid, recorded, call, owner, dead=False):
+        kind = owner[0]
+        if self.is_dead(fid, dead):
+            media_sends.inc(kind, "skipped")
+            return None, 0
+        tried, ftype, bad_id = [], self.kind(fid, recorded), False
+        while ftype and ftype not in tried:
+            tried.append(ftype)
+            try: msg = await call(ftype)
+            except BadRequest as e:
+                hint = TYPE_MISMATCH.search(str(e))
+                bad_id = bad_id or "file identifier" in str(e).lower()
+                ftype = hint.group(1).lower() if hint and hint.group(1).lower() in MEDIA_TYPES else "document"
+                continue
+            except Exception as e:
+                logger.warning(f"Send {fid[:16]}… as {ftype} failed: {e}")
+                break
+            media_sends.inc(kind, "first_try" if len(tried) == 1 else "fallback")
+            entry = self._entry(fid)
+            entry[1] = 0
+            if ftype != entry[0] and ftype != recorded:
+                self.learned += 1
+                await self._write_back(owner, fid, type=ftype)
+            entry[0] = ftype
+            return msg, len(tried)
+        media_sends.inc(kind, "failed")
+        if bad_id:
+            entry = self._entry(fid)
+            entry[1] += 1
+            if entry[1] >= self.dead_after and not entry[2]:
+                entry[2] = True
+                self.marked += 1
+                logger.warning(f"{owner[0]} {owner[1]}: file_id marked dead after {entry[1]} failed sends")
+                await self._write_back(owner, fid, dead=True)
+        return None, len(tried)
+
+    async def _write_back(self, owner, fid, type=None, dead=False):
+        kind, oid = owner
+        try:
+            if kind == "guide":
+                await col_guides.update_one({"_id": oid, "file": fid}, {"$set": {"file_dead": True} if dead else {"media_type": type}})
+            elif oid is not None:
+                await col_vault_files.update_many({"vault_id": oid, "files.id": fid},
+                                                  {"$set": {"files.$[f].dead": True} if dead else {"files.$[f].type": type}},
+                                                  array_filters=[{"f.id": fid}])
+        except Exception as e: logger.warning(f"Media health write-back for {kind} {oid} failed: {e}")
+
+    def stats(self):
+        sent = {o: sum(n for (k, out), n in media_sends.series.items() if out == o) for o in ("first_try", "fallback", "failed", "skipped")}
+        total = sent["first_try"] + sent["fallback"] + sent["failed"]
+        return {"tracked": len(self.entries), "learned_types": self.learned, "marked_dead": self.marked, **sent,
+                "fallback_rate": f"{sent['fallback'] / total:.1%}" if total else "-"}
+
+media_health = MediaHealth()
+STATS_SOURCES["Media health"] = media_health.stats
+
+# --- VAULT DELIVERY ---
+ALBUM_SIZE = 10
+ALBUM_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+def file_entry(f):
+    if isinstance(f, dict): return f['id'], f.get('type', 'document')
+    return f, 'unknown'
+
+def album_batches(files):
+    # Photos and videos may share an album, documents only group with documents;
+    # animations and legacy untyped ids always go out alone.
+    batch, kind = [], None
+    for f in files:
+        fid, ftype = file_entry(f)
+        fkind = "visual" if ftype in ("photo", "video") else "document" if ftype == "document" else None
+        if batch and (fkind is None or fkind != kind or len(batch) == ALBUM_SIZE):
+            yield batch
+            batch = []
+        batch.append((fid, ftype))
+        kind = fkind
+    if batch: yield batch
+
+async def send_single_file(bot, chat_id, fid, ftype, vault_id=None, dead=False):
+    send = lambda t: getattr(bot, f"send_{t}")(chat_id, fid, rate_limit_args=PRIO_BULK)
+    return await media_health.send(fid, ftype, send, ("vault", vault_id), dead)
+
+# Returns ([message ids per album or single send], api calls, success_all).
+async def send_vault_files(bot, chat_id, files, mode=VAULT_DELIVERY_MODE, vault_id=None):
+    sent, calls, success_all = [], 0, True
+    live = [f for f in files if not media_health.is_dead(file_entry(f)[0], isinstance(f, dict) and f.get("dead", False))]
+    if len(live) < len(files):
+        media_sends.inc("vault", "skipped", by=len(files) - len(live))
+        files, success_all = live, False
+    # Albums use the learned type too, so a misfiled id doesn't sink its whole album again.
+    files = [{"id": fid, "type": media_health.kind(fid, ftype) if ftype != "unknown" else ftype} for fid, ftype in map(file_entry, files)]
+    batches = album_batches(files) if mode == "album" else ([file_entry(f)] for f in files)
+    for batch in batches:
+        if len(batch) > 1:
+            calls += 1
+            try:
+                msgs = await bot.send_media_group(chat_id, [ALBUM_MEDIA[t](fid) for fid, t in batch], rate_limit_args=PRIO_BULK)
+                sent.append([m.message_id for m in msgs])
+                continue
+            except Exception as e:
+                logger.warning(f"Album of {len(batch)} failed ({e}), sending one by one")
+        ids = []
+        for fid, ftype in batch:
+            msg, n = await send_single_file(bot, chat_id, fid, ftype, vault_id)
+            calls += n
+            if msg: ids.append(msg.message_id)
+            else: success_all = False
+        if ids: sent.append(ids)
+    return sent, calls, success_all
+
+class DeliveryStats:
+    def __init__(self):
+        self.packs = self.files = self.calls = 0
+        self.seconds = 0.0
+
+    def record(self, files, calls, seconds):
+        self.packs += 1
+        self.files += files
+        self.calls += calls
+        self.seconds += seconds
+
+    def stats(self):
+        return {"mode": VAULT_DELIVERY_MODE, "packs": self.packs, "files": self.files, "api_calls": self.calls,
+                "calls_per_file": f"{self.calls / self.files:.2f}" if self.files else "-",
+                "avg_pack_seconds": f"{self.seconds / self.packs:.2f}" if self.packs else "-"}
+
+delivery_stats = DeliveryStats()
+STATS_SOURCES["Vault delivery"] = delivery_stats.stats
+
+# --- DELIVERY QUEUE ---
+# Unlocked packs are delivered by DELIVERY_WORKERS background workers from jobs
+# kept in Mongo. A step is one album (or one file in single mode); workers take
+# users round-robin, one step at a time, so a long pack only delays others by
+# its own share. After every step the job records its position in the manifest
+# (seq, pos), so a restart resumes after the last sent album instead of
+# starting over. Jobs are held under a lease renewed every claim pass; jobs
+# whose lease ran out (their replica died) are claimed by whoever passes next.
+# One progress message per job is edited in place.
+INSTANCE = f"{os.getpid()}-{secrets.token_hex(3)}"
+delivery_first_file = metrics.add(Histogram("bot_delivery_first_file_seconds", "Key accepted to first file sent"))
+
+class DeliveryQueue:
+    def __init__(self, workers=DELIVERY_WORKERS):
+        self.workers = workers
+        self.jobs = {}            # user -> deque of job dicts
+        self.active = set()       # job _ids held here
+        self.ring = asyncio.Queue()   # users with work, each at most once, none mid-step
+        self.busy = 0
+        self.running = False
+        self.done = self.resumed = self.lost = 0
+        self.first_files = deque(maxlen=1024)
+
+    def pending(self, user): return len(self.jobs.get(user, ()))
+
+    @property
+    def backlog_files(self): return sum(j["total"] - j["sent"] for q in self.jobs.values() for j in q)
+
+    def _add(self, job):
+        if job["_id"] in self.active: return
+        self.active.add(job["_id"])
+        if job["user"] not in self.jobs:
+            self.jobs[job["user"]] = deque()
+            self.ring.put_nowait(job["user"])
+        self.jobs[job["user"]].append(job)
+
+    async def submit(self, user, chat_id, vault_id, total, msg_id):
+        now = datetime.utcnow()
+        job = {"user": user, "chat": chat_id, "vault": vault_id, "total": total, "msg": msg_id, "seq": 0, "pos": 0, "sent": 0,
+               "calls": 0, "ok": True, "status": "queued", "owner": INSTANCE, "lease_until": now + timedelta(seconds=DELIVERY_LEASE),
+               "created": now, "first_file": None}
+        await col_deliveries.insert_one(job)
+        self._add(job)
+        return job
+
+    async def claim(self):
+        now = datetime.utcnow()
+        # Keep our own jobs (including those waiting their turn) leased.
+        await col_deliveries.update_many({"owner": INSTANCE, "status": {"$in": ["queued", "running"]}},
+                                         {"$set": {"lease_until": now + timedelta(seconds=DELIVERY_LEASE)}})
+        stale = await col_deliveries.find({"status": {"$in": ["queued", "running"]}, "lease_until": {"$lt": now}}, {"_id": 1}).to_list(1000)
+        for d in stale:
+            job = await col_deliveries.find_one_and_update(
+                {"_id": d["_id"], "lease_until": {"$lt": now}},
+                {"$set": {"owner": INSTANCE, "lease_until": now + timedelta(seconds=DELIVERY_LEASE)}}, return_document=ReturnDocument.AFTER)
+            if job:
+                self.resumed += 1
+                logger.info(f"Resuming delivery {job['_id']} of vault {job['vault']} at {job['sent']}/{job['total']}")
+                self._add(job)
+
+    async def run(self, bot):
+        self.running = True
+        # Drop stop() sentinels left by workers that exited while busy.
+        waiting = [self.ring.get_nowait() for _ in range(self.ring.qsize())]
+        for user in waiting:
+            if user is not None: self.ring.put_nowait(user)
+        self.tasks = workers = [asyncio.create_task(self.worker(bot)) for _ in range(self.workers)]
+        try:
+            while True:
+                try:
+                    if self.running: await self.claim()
+                except asyncio.CancelledError: raise
+                except Exception as e: logger.error(f"Delivery claim error: {e}")
+                await asyncio.sleep(DELIVERY_CLAIM_INTERVAL)
+        finally:
+            # The flag backs up cancel(), which a wait_for deep in a send can swallow on 3.11.
+            self.running = False
+            for w in workers: w.cancel()
+
+    # Graceful stop: idle workers exit, busy ones finish the album in flight, and
+    # our leases are released so another replica resumes the rest right away.
+    # Holding no jobs means nothing to release, and no Mongo round trip.
+    async def stop(self, timeout=30):
+        self.running = False
+        tasks = getattr(self, "tasks", [])
+        for _ in tasks: self.ring.put_nowait(None)
+        if tasks: await asyncio.wait(tasks, timeout=timeout)
+        if not self.active: return
+        await col_deliveries.update_many({"_id": {"$in": list(self.active)}, "owner": INSTANCE, "status": {"$in": ["queued", "running"]}},
+                                         {"$set": {"lease_until": datetime.utcnow()}})
+
+    async def worker(self, bot):
+        while self.running:
+            user = await self.ring.get()
+            if user is None or not self.running: return
+            queue = self.jobs[user]
+            self.busy += 1
+            try:
+                if not await self.step(bot, queue[0]): self.active.discard(queue.popleft()["_id"])
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                # Sends don't raise (see send_vault_files), so this is Mongo: retry the same step.
+                logger.error(f"Delivery {queue[0].get('_id')} step error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self.busy -= 1
+                if queue: self.ring.put_nowait(user)
+                else: del self.jobs[user]
+
+    # Sends the job's next album; False once the job is finished (or lost to another replica).
+    async def step(self, bot, job):
+        chunk = job.get("_chunk")
+        if chunk is None or chunk["seq"] != job["seq"]:
+            chunk = job["_chunk"] = await col_vault_files.find_one({"vault_id": job["vault"], "seq": job["seq"]})
+        files = chunk["files"][job["pos"]:] if chunk else []
+        if chunk and not files:
+            job["seq"], job["pos"] = job["seq"] + 1, 0
+            return True
+        if not files: return await self.finish(bot, job)
+
+        if job["status"] == "queued":
+            job["status"], job["started"] = "running", datetime.utcnow()
+        n = len(next(album_batches(files))) if VAULT_DELIVERY_MODE == "album" else 1
+        sent, calls, ok = await send_vault_files(bot, job["chat"], files[:n], vault_id=job["vault"])
+        await expiry_queue.schedule(job["chat"], [mid for ids in sent for mid in ids], 600)
+        if sent and job["first_file"] is None:
+            job["first_file"] = (datetime.utcnow() - job["created"]).total_seconds()
+            self.first_files.append(job["first_file"])
+            delivery_first_file.observe(job["first_file"])
+        # pos walks the manifest; sent counts only files that went out (not dead or failed ones).
+        job["pos"] += n
+        job["sent"] += sum(len(ids) for ids in sent)
+        job["calls"], job["ok"] = job["calls"] + calls, job["ok"] and ok
+        res = await col_deliveries.update_one({"_id": job["_id"], "owner": INSTANCE}, {"$set": {
+            k: job[k] for k in ("seq", "pos", "sent", "calls", "ok", "status", "first_file")}})
+        if not res.matched_count:
+            self.lost += 1
+            logger.warning(f"Delivery {job['_id']} was taken over by another replica")
+            return False
+        await self.progress(bot, job)
+        return True
+
+    async def progress(self, bot, job):
+        now = time.monotonic()
+        if now - job.get("_edited", 0) < DELIVERY_PROGRESS_EVERY or not job.get("msg"): return
+        job["_edited"] = now
+        try: await bot.edit_message_text(f"📤 Sending files… {job['sent']}/{job['total']}", job["chat"], job["msg"])
+        except Exception: pass
+
+    async def finish(self, bot, job):
+        finished = datetime.utcnow()
+        await col_deliveries.update_one({"_id": job["_id"], "owner": INSTANCE}, {"$set": {
+            "status": "done", "finished": finished, "sent": job["sent"], "calls": job["calls"], "ok": job["ok"]}})
+        elapsed = (finished - job.get("started", job["created"])).total_seconds()
+        delivery_stats.record(job["sent"], job["calls"], elapsed)
+        delivery_outcomes.inc("vault", "complete" if job["ok"] else "partial")
+        logger.info(f"Vault {job['vault']}: {job['sent']} files in {elapsed:.2f}s with {job['calls']} API calls ({VAULT_DELIVERY_MODE})")
+        self.done += 1
+        if job.get("msg"):
+            try: await bot.delete_message(job["chat"], job["msg"])
+            except Exception: pass
+        try: await bot.send_message(job["chat"], "✅ All files sent!\n⚠️ Content will disappear in 10 minutes.")
+        except Exception: pass
+        return False
+
+    def stats(self):
+        ff = self.first_files
+        return {"workers": f"{self.busy}/{self.workers} busy", "users_waiting": len(self.jobs),
+                "jobs": sum(len(q) for q in self.jobs.values()), "files_remaining": self.backlog_files,
+                "done": self.done, "resumed": self.resumed, "lost_lease": self.lost,
+                "first_file_p50": f"{percentile(ff, .5):.2f}s" if ff else "-", "first_file_p95": f"{percentile(ff, .95):.2f}s" if ff else "-"}
+
+deliveries = DeliveryQueue()
+STATS_SOURCES["Delivery queue"] = deliveries.stats
+metrics.add(Exported("bot_delivery_backlog_jobs", "Vault delivery jobs queued or running here", "gauge",
+                     lambda: {(): sum(len(q) for q in deliveries.jobs.values())}))
+metrics.add(Exported("bot_delivery_backlog_files", "Files still to send for those jobs", "gauge", lambda: {(): deliveries.backlog_files}))
+
 # --- CONTENT DELIVERY ---
 async def vault_select_sub(update, context):
     query = update.callback_query
@@ -503,7 +2632,7 @@ async def vault_select_sub(update, context):
         await query.answer()
         vid = query.data.replace("vitem_", "")
         context.user_data["target_v"] = vid
-        item = await col_vaults.find_one({"_id": ObjectId(vid)})
+        item = await col_vaults.find_one({"_id": ObjectId(vid)}, {"files": 0})
         
         if item:
             await query.message.delete()
@@ -516,51 +2645,34 @@ async def vault_select_sub(update, context):
     # Handle Standard Folder Selection (User typed Number)
     try:
         idx = int(update.message.text) - 1
-        items = await col_vaults.find({"folder": context.user_data.get("active_vault_folder")}).sort("_id", 1).to_list(100)
-        if 0 <= idx < len(items):
-            item = items[idx]
+        folder = context.user_data.get("active_vault_folder")
+        count, oid = snapshots.pick(update.effective_user.id, ("vault", folder), idx + 1)
+        if count is None:
+            entries, count = await catalog_items(folder, max(idx, 0), 1)
+            count = min(count, 100)
+            oid = entries[0]["id"] if entries and 0 <= idx < count else None
+        item = await col_vaults.find_one({"_id": oid}, {"files": 0}) if oid else None
+        if item:
             context.user_data["target_v"] = item["_id"]
             if item.get("poster"):
                 await update.message.reply_photo(item["poster"], caption=f"📁 <b>{item['sub_name']}</b>\n\n{item['desc']}\n\n🔐 <b>Enter Key:</b>", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="u_vault_folders")]]))
             else:
                 await update.message.reply_text(f"📁 <b>{item['sub_name']}</b>\n\n{item['desc']}\n\n🔐 <b>Enter Key:</b>", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="u_vault_folders")]]))
             return V_KEY_INPUT
-        else: await update.message.reply_text(f"❌ Invalid Number. 1-{len(items)}")
+        else: await update.message.reply_text(f"❌ Invalid Number. 1-{count}")
     except ValueError: await update.message.reply_text("❌ Send a Number.")
     return U_V_SUB_SELECT
 
 async def vault_key_check(update, context):
-    v = await col_vaults.find_one({"_id": ObjectId(context.user_data.get("target_v"))})
+    v = await col_vaults.find_one({"_id": ObjectId(context.user_data.get("target_v"))}, {"key": 1, "file_count": 1})
     if v and update.message.text.strip() == v["key"]:
-        count = len(v['files'])
+        count = v["file_count"] if "file_count" in v else await migrate_manifest(v["_id"]) or 0
+        user = update.effective_user.id
+        if deliveries.pending(user) >= DELIVERY_USER_JOBS:
+            await update.message.reply_text("⏳ Your previous packs are still being sent. Try again when they finish.")
+            return ConversationHandler.END
         status_msg = await update.message.reply_text(f"🔓 Key Accepted! Sending {count} files...\nPlease wait.")
-        
-        success_all = True
-        
-        for f in v["files"]:
-            if isinstance(f, dict): fid, ftype = f['id'], f.get('type', 'document')
-            else: fid, ftype = f, 'unknown'
-            
-            sent_msg = None
-            try:
-                await asyncio.sleep(0.05) 
-                if ftype == 'video': sent_msg = await update.message.reply_video(fid)
-                elif ftype == 'photo': sent_msg = await update.message.reply_photo(fid)
-                elif ftype == 'animation': sent_msg = await update.message.reply_animation(fid)
-                else: sent_msg = await update.message.reply_document(fid) 
-            except Exception:
-                try: 
-                    sent_msg = await update.message.reply_document(fid)
-                except: 
-                    success_all = False
-            
-            if sent_msg:
-                context.job_queue.run_once(del_msg, 600, data=sent_msg.message_id, chat_id=update.effective_chat.id)
-
-        try: await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=status_msg.message_id)
-        except: pass
-        
-        await update.message.reply_text("✅ All files sent!\n⚠️ Content will disappear in 10 minutes.")
+        await deliveries.submit(user, update.effective_chat.id, v["_id"], count, status_msg.message_id)
         return ConversationHandler.END
         
     else: await update.message.reply_text("❌ Wrong Key")
@@ -582,17 +2694,22 @@ async def guide_show(update, context):
         try:
             user_input = int(update.message.text)
             search_query = context.user_data.get("search_query")
+            shown, oid = snapshots.pick(update.effective_user.id, ("guides", view_type), user_input)
+            target_idx = 0
             
-            if search_query:
-                # Search mode
-                regex_pattern = re.escape(search_query)
-                items = await col_guides.find({"type": view_type, "name": {"$regex": regex_pattern, "$options": "i"}}).sort("_id", 1).limit(50).to_list(50)
+            if oid:
+                items = await col_guides.find({"_id": oid}).to_list(1)
+            elif search_query:
+                # Search mode (a live snapshot without this number means it's out of range)
+                items = [] if shown is not None else await fetch_ordered(col_guides, await search_ids(view_type, search_query, 50))
                 target_idx = user_input - 1
             else:
                 # Normal list
-                target_idx = user_input - 1
-                items = await col_guides.find({"type": view_type}).sort("_id", 1).skip(target_idx).limit(1).to_list(1)
-                target_idx = 0 
+                if ordinal_index.ready:
+                    oid = ordinal_index.at(view_type, user_input)
+                    items = await col_guides.find({"_id": oid}).to_list(1) if oid else []
+                else:
+                    items = await browse(col_guides).find({"type": view_type}).sort("_id", 1).skip(user_input - 1).limit(1).to_list(1)
 
         except ValueError:
             await update.message.reply_text("❌ Send a valid number or text to search.")
@@ -619,27 +2736,17 @@ async def guide_show(update, context):
             mtype = item.get("media_type", "photo") 
             fid = item["file"]
             
-            success = False
-            sent_msg = None
-            
-            try:
-                if mtype == "video": sent_msg = await update.message.reply_video(fid, caption=caption)
-                elif mtype == "animation": sent_msg = await update.message.reply_animation(fid, caption=caption)
-                elif mtype == "document": sent_msg = await update.message.reply_document(fid, caption=caption)
-                else: sent_msg = await update.message.reply_photo(fid, caption=caption)
-                success = True
-            except Exception:
-                try:
-                    sent_msg = await update.message.reply_document(fid, caption=caption)
-                    success = True
-                except: pass
+            send = lambda t: getattr(update.message, f"reply_{t}")(fid, caption=caption)
+            sent_msg, _ = await media_health.send(fid, mtype, send, ("guide", item["_id"]), item.get("file_dead", False))
+            success = sent_msg is not None
             
             try: await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=msg.message_id)
             except: pass
             
+            delivery_outcomes.inc("guide", "ok" if success and sent_msg else "failed")
             if success and sent_msg:
                 # SCHEDULE DELETE
-                context.job_queue.run_once(del_msg, 600, data=sent_msg.message_id, chat_id=update.effective_chat.id)
+                await expiry_queue.schedule(update.effective_chat.id, [sent_msg.message_id], 600)
                 # SEND CONFIRMATION
                 await update.message.reply_text("⚠️ Content will disappear in 10 minutes.")
                 return U_GUIDE_SELECT
@@ -656,7 +2763,80 @@ async def guide_show(update, context):
     return U_GUIDE_SELECT
 
 # --- DELETE & MISC ---
+# Delete rows are keyed "<collection>_<id>" ("g" guides, "v" vaults, "a" adult
+# channel index). Each listing is a scope: "g:<type>", "v", "a", or
+# "q:<text>" for a search. user_data["del_sel"] keeps, per scope, either the
+# ids picked or, after "Select all", the ids taken back out (plus the scope's
+# size then), so selecting thousands of items is one tap and stores nothing
+# per item. Pages are DEL_PAGE name-only rows paged by _id cursor ("a<_id>"
+# after, "b<_id>" before); the view is kept in user_data["del_view"], so a
+# tap re-renders it without a query. "Delete selected" resolves the scopes
+# and removes the lot with one delete_many per collection, then cascades to
+# counters, the vault catalog and manifests, the in-memory indexes and the
+# render cache.
+DEL_PAGE = 20
+
+def del_selection(context):
+    sel = context.user_data.get("del_sel")
+    if not isinstance(sel, dict) or "g" in sel: sel = context.user_data["del_sel"] = {}   # pre-scope format
+    return sel
+
+def del_scope(context, scope): return del_selection(context).setdefault(scope, {"all": False, "n": 0, "ids": []})
+
+def del_selected(sel, scope, key):
+    s = sel.get(scope)
+    return bool(s) and (key in s["ids"]) != s["all"]
+
+def del_count(sel): return sum(s["n"] - len(s["ids"]) if s["all"] else len(s["ids"]) for s in sel.values())
+
+def del_markup(context):
+    view, sel = context.user_data["del_view"], del_selection(context)
+    scope, rows = view["scope"], view["rows"]
+    kb = [[InlineKeyboardButton(f"{'☑️' if del_selected(sel, scope, key) else '▫️'} {name}", callback_data=f"dsel_{key}")] for key, name in rows]
+    if view["nav"]: kb.append([InlineKeyboardButton(label, callback_data=data) for label, data in view["nav"]])
+    if rows:
+        every = sel.get(scope, {}).get("all")
+        page_on = all(del_selected(sel, scope, key) for key, _ in rows)
+        kb.append([InlineKeyboardButton("▫️ Unselect page" if page_on else "☑️ Select page", callback_data="dpg"),
+                   InlineKeyboardButton("▫️ Unselect all" if every else f"☑️ Select all{' matching' if scope[0] == 'q' else ''} ({view['total']})",
+                                        callback_data="dall")])
+    n = del_count(sel)
+    if n: kb.append([InlineKeyboardButton(f"🗑 Delete selected ({n})", callback_data="dgo"), InlineKeyboardButton("✖️ Clear", callback_data="dclr")])
+    kb.append([InlineKeyboardButton("🔙 Back", callback_data="a_del")])
+    return InlineKeyboardMarkup(kb)
+
+# Renders page `page` of a listing. Without a cursor past the first page (a
+# button from before cursors) it skips there once.
+async def del_page(context, dtype, page, cursor=""):
+    if dtype == "adult":
+        channels = (await settings_cache.get("adult")).get("channels", [])
+        rows = [(f"a_{i}", c["name"]) for i, c in enumerate(channels)][page * DEL_PAGE:(page + 1) * DEL_PAGE + 1]
+        scope, total, more, first, last = "a", len(channels), len(rows) > DEL_PAGE, "", ""
+        rows = rows[:DEL_PAGE]
+    else:
+        c, col, flt, field = ("v", col_vaults, {}, "sub_name") if dtype == "vault" else ("g", col_guides, {"type": dtype}, "name")
+        back = cursor[:1] == "b"
+        if cursor: flt = {**flt, "_id": {"$lt" if back else "$gt": ObjectId(cursor[1:])}}
+        found = col.find(flt, {field: 1}).sort("_id", -1 if back else 1)
+        if page and not cursor: found = found.skip(page * DEL_PAGE)
+        docs = await found.limit(DEL_PAGE + 1).to_list(DEL_PAGE + 1)
+        more = back or len(docs) > DEL_PAGE
+        docs = docs[:DEL_PAGE]
+        if back: docs.reverse()
+        rows = [(f"{c}_{d['_id']}", d.get(field) or "?") for d in docs]
+        scope = "v" if c == "v" else f"g:{dtype}"
+        total = await col_vaults.count_documents({}) if c == "v" else await guide_count(dtype)
+        first, last = (f"b{docs[0]['_id']}", f"a{docs[-1]['_id']}") if docs else ("", "")
+    nav = []
+    if page: nav.append(("◀️ Prev", f"del_{dtype}_{page - 1}" + (f"_{first}" if page > 1 and first else "")))
+    if more: nav.append(("Next ▶️", f"del_{dtype}_{page + 1}" + (f"_{last}" if last else "")))
+    context.user_data["del_view"] = {"scope": scope, "rows": rows, "nav": nav, "total": total,
+                                     "title": f"Tap items to select (page {page + 1}):" if rows else "❌ No items found."}
+    return context.user_data["del_view"]["title"], del_markup(context)
+
 async def admin_del_menu(update, context):
+    context.user_data.pop("del_sel", None)
+    context.user_data.pop("del_view", None)
     kb = [[InlineKeyboardButton("Anime", callback_data="del_anime"), InlineKeyboardButton("Movie", callback_data="del_movies")],
           [InlineKeyboardButton("Vault", callback_data="del_vault"), InlineKeyboardButton("Adult Link", callback_data="del_adult")],
           [InlineKeyboardButton("🔍 Search to Delete", callback_data="adm_search_start")],
@@ -668,73 +2848,457 @@ async def admin_del_process(update, context):
         await update.callback_query.edit_message_text("🔍 Send Name to Search & Delete:")
         return ADM_SEARCH_STATE
 
-    dtype = update.callback_query.data.split("_")[1]
-    context.user_data["del_type"] = dtype
-    if dtype == "adult":
-        _, ad, _ = await get_settings()
-        kb = [[InlineKeyboardButton(c["name"], callback_data=f"confirm_del_{i}")] for i, c in enumerate(ad.get("channels", []))]
-    else:
-        col = col_guides if dtype in ["anime", "movies"] else col_vaults
-        items = await col.find({"type": dtype} if dtype != "vault" else {}).to_list(100)
-        kb = [[InlineKeyboardButton(x.get("name") or x.get("sub_name"), callback_data=f"confirm_del_{x['_id']}")] for x in items]
-    kb.append([InlineKeyboardButton("🔙 Back", callback_data="a_del")])
-    await update.callback_query.edit_message_text("Select item to delete:", reply_markup=InlineKeyboardMarkup(kb))
+    parts = update.callback_query.data.split("_")
+    text, markup = await del_page(context, parts[1], int(parts[2]) if len(parts) > 2 else 0, parts[3] if len(parts) > 3 else "")
+    await update.callback_query.edit_message_text(text, reply_markup=markup)
+
+DEL_SEARCH = (("anime", "g", "[Anime]", "name"), ("movies", "g", "[Movie]", "name"), ("vault", "v", "[Vault]", "sub_name"))
 
 async def admin_perform_search_del(update, context):
     query_text = update.message.text
-    results = []
-    
-    ani = await col_guides.find({"type": "anime", "name": {"$regex": query_text, "$options": "i"}}).limit(5).to_list(5)
-    for x in ani: results.append({"id": x["_id"], "name": f"[Anime] {x['name']}", "type": "anime"})
-    
-    mov = await col_guides.find({"type": "movies", "name": {"$regex": query_text, "$options": "i"}}).limit(5).to_list(5)
-    for x in mov: results.append({"id": x["_id"], "name": f"[Movie] {x['name']}", "type": "movies"})
-    
-    vlt = await col_vaults.find({"sub_name": {"$regex": query_text, "$options": "i"}}).limit(5).to_list(5)
-    for x in vlt: results.append({"id": x["_id"], "name": f"[Vault] {x['sub_name']}", "type": "vault"})
-
-    if not results:
+    rows, total = [], 0
+    for scope, c, label, field in DEL_SEARCH:
+        ids = await search_ids(scope, query_text)
+        total += len(ids)
+        for x in await fetch_ordered(col_vaults if c == "v" else col_guides, ids[:5], {field: 1}):
+            rows.append((f"{c}_{x['_id']}", f"{label} {x[field]}"))
+
+    if not rows:
         await update.message.reply_text("❌ No items found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_del")]]))
         return ADM_DEL_SELECT
-        
-    kb = []
-    for r in results:
-        kb.append([InlineKeyboardButton(f"🗑 {r['name']}", callback_data=f"confirm_del_{r['id']}")])
-        
-    kb.append([InlineKeyboardButton("🔙 Back", callback_data="a_del")])
-    await update.message.reply_text("Select to DELETE PERMANENTLY:", reply_markup=InlineKeyboardMarkup(kb))
+
+    context.user_data["del_view"] = {"scope": f"q:{query_text}", "rows": rows, "nav": [], "total": total,
+                                     "title": f"Select to DELETE PERMANENTLY ({len(rows)} of {total} matches shown):"}
+    await update.message.reply_text(context.user_data["del_view"]["title"], reply_markup=del_markup(context))
     return ADM_DEL_SELECT
 
+async def del_refresh(update, context):
+    if "del_view" not in context.user_data:
+        await update.callback_query.answer("⌛ This list expired, please reopen it.", show_alert=True)
+        return ADM_DEL_SELECT
+    await update.callback_query.edit_message_text(context.user_data["del_view"]["title"], reply_markup=del_markup(context))
+    return ADM_DEL_SELECT
+
+async def admin_del_toggle(update, context):
+    key = update.callback_query.data[len("dsel_"):]
+    view = context.user_data.get("del_view")
+    if view:
+        ids = del_scope(context, view["scope"])["ids"]
+        if key in ids: ids.remove(key)
+        else: ids.append(key)
+    return await del_refresh(update, context)
+
+async def admin_del_page(update, context):
+    view = context.user_data.get("del_view")
+    if view:
+        sel = del_selection(context)
+        on = not all(del_selected(sel, view["scope"], key) for key, _ in view["rows"])
+        s = del_scope(context, view["scope"])
+        for key, _ in view["rows"]:
+            if del_selected(sel, view["scope"], key) != on:
+                if key in s["ids"]: s["ids"].remove(key)
+                else: s["ids"].append(key)
+    return await del_refresh(update, context)
+
+async def admin_del_all(update, context):
+    view = context.user_data.get("del_view")
+    if view:
+        s = del_scope(context, view["scope"])
+        s.update(all=not s["all"], n=view["total"], ids=[])
+    return await del_refresh(update, context)
+
+async def admin_del_clear(update, context):
+    context.user_data.pop("del_sel", None)
+    return await del_refresh(update, context)
+
+# Row keys in a whole scope, read when the delete runs.
+async def del_members(scope):
+    if scope == "a": return [f"a_{i}" for i in range(len((await settings_cache.get("adult")).get("channels", [])))]
+    if scope == "v": return [f"v_{d['_id']}" async for d in col_vaults.find({}, {"_id": 1})]
+    if scope.startswith("g:"): return [f"g_{d['_id']}" async for d in col_guides.find({"type": scope[2:]}, {"_id": 1})]
+    text = scope[2:]
+    return [f"{c}_{oid}" for s, c, _, _ in DEL_SEARCH for oid in await search_ids(s, text)]
+
+# del_sel -> {"g": [ids], "v": [ids], "a": [channel indexes]} for delete_items.
+async def resolve_selection(sel):
+    keys = set()
+    for scope, s in sel.items():
+        keys.update(set(await del_members(scope)) - set(s["ids"]) if s["all"] else s["ids"])
+    out = {"g": [], "v": [], "a": []}
+    for key in keys:
+        c, i = key.split("_", 1)
+        out[c].append(i)
+    return out
+
+# Removes {"g": [ids], "v": [ids], "a": [channel indexes]}; returns how many went.
+async def delete_items(sel):
+    n = 0
+    if sel.get("g"):
+        gone = await col_guides.find({"_id": {"$in": [ObjectId(i) for i in sel["g"]]}}, {"type": 1}).to_list(None)
+        if gone:
+            res = await col_guides.delete_many({"_id": {"$in": [d["_id"] for d in gone]}})
+            n += res.deleted_count
+            by_type = defaultdict(int)
+            for d in gone: by_type[d.get("type")] += 1
+            for g_type, k in by_type.items():
+                await counters.incr(f"guides:{g_type}", -k)
+                render_cache.invalidate("list", g_type)
+            for d in gone:
+                search_index.remove(d["_id"])
+                ordinal_index.remove(d["_id"])
+    if sel.get("v"):
+        gone = await col_vaults.find({"_id": {"$in": [ObjectId(i) for i in sel["v"]]}}, {"folder": 1}).to_list(None)
+        if gone:
+            ids = [d["_id"] for d in gone]
+            res = await col_vaults.delete_many({"_id": {"$in": ids}})
+            n += res.deleted_count
+            await col_vault_files.delete_many({"vault_id": {"$in": ids}})
+            await catalog_remove_many(gone)
+            for folder in {d.get("folder") for d in gone}: invalidate_vault_pages(folder)
+            for oid in ids: search_index.remove(oid)
+    if sel.get("a"):
+        drop = {int(i) for i in sel["a"]}
+        channels = (await settings_cache.get("adult")).get("channels", [])
+        keep = [ch for i, ch in enumerate(channels) if i not in drop]
+        await col_settings.update_one({"type": "adult"}, {"$set": {"channels": keep}})
+        await settings_cache.refresh("adult")
+        n += len(channels) - len(keep)
+    return n
+
+async def admin_del_selected(update, context):
+    n = await delete_items(await resolve_selection(del_selection(context)))
+    context.user_data.pop("del_sel", None)
+    context.user_data.pop("del_view", None)
+    await update.callback_query.edit_message_text(f"✅ Deleted {n} item(s)!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_del")]]))
+    return ADM_DEL_SELECT
+
+# Buttons left over from the one-tap delete flow: confirm_del_<id> for a guide
+# or vault pack. Adult channels were addressed by list index, which may point
+# at another channel by now, so those taps are turned away.
 async def admin_confirm_delete(update, context):
-    oid = update.callback_query.data.split("_")[-1]
-    
-    res = await col_guides.delete_one({"_id": ObjectId(oid)})
-    if res.deleted_count == 0:
-        await col_vaults.delete_one({"_id": ObjectId(oid)})
-    
+    oid = update.callback_query.data[len("confirm_del_"):]
+    if not ObjectId.is_valid(oid):
+        await update.callback_query.answer("⌛ This button expired, please reopen the list.", show_alert=True)
+        return ADM_DEL_SELECT
+    await delete_items({"g": [oid], "v": [oid]})
     await update.callback_query.edit_message_text("✅ Deleted (if existed)!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="a_del")]]))
     return ADM_DEL_SELECT
 
-# --- APP ---
-server = Flask(__name__)
-@server.route('/')
-def h(): return "OK"
+# --- UPDATE DISPATCH ---
+# Updates from different users run in parallel (at most UPDATE_CONCURRENCY at
+# once); each user's updates run strictly in arrival order, which the single
+# ConversationHandler depends on. PTB's own semaphore caps everything admitted
+# (running or waiting its turn) at UPDATE_MAX_PENDING. A user with
+# UPDATE_USER_QUEUE updates outstanding has further ones dropped, as are repeat
+# taps on a button whose callback is still queued or running. The admin is
+# exempt from the queue cap: a forwarded batch of files arrives all at once.
+class UserOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING, per_user=UPDATE_USER_QUEUE):
+        super().__init__(max_pending)
+        self.concurrency, self.per_user = concurrency, per_user
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tails = {}                 # user key -> future resolved when its last update finishes
+        self._depth = defaultdict(int)   # user key -> updates outstanding
+        self._taps = set()               # (user key, callback data) outstanding
+        self.pending = self.running = self.dropped_full = self.dropped_taps = 0
+        self.waits, self.latencies = deque(maxlen=4096), deque(maxlen=4096)
+
+    @property
+    def saturated(self): return self.pending >= self.max_concurrent_updates
+
+    async def initialize(self): pass
+    async def shutdown(self): pass
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        chat = getattr(update, "effective_chat", None)
+        key = user.id if user else chat.id if chat else None
+        if key is None: return await coroutine
+        cq = getattr(update, "callback_query", None)
+        tap = (key, cq.data) if cq else None
+        if tap in self._taps or (self._depth[key] >= self.per_user and key != ADMIN_ID):
+            coroutine.close()
+            if tap in self._taps: self.dropped_taps += 1
+            else: self.dropped_full += 1
+            if cq: asyncio.create_task(self._answer(cq))
+            if not self._depth[key]: del self._depth[key]
+            return
+        if tap: self._taps.add(tap)
+        arrived = time.monotonic()
+        prev, done = self._tails.get(key), asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        self._depth[key] += 1
+        self.pending += 1
+        try:
+            if prev: await prev
+            async with self._slots:
+                started = time.monotonic()
+                self.running += 1
+                try: await coroutine
+                finally: self.running -= 1
+            self.waits.append(started - arrived)
+            self.latencies.append(time.monotonic() - arrived)
+        finally:
+            self.pending -= 1
+            done.set_result(None)
+            if self._tails.get(key) is done: del self._tails[key]
+            self._depth[key] -= 1
+            if not self._depth[key]: del self._depth[key]
+            if tap: self._taps.discard(tap)
+
+    @staticmethod
+    async def _answer(cq):
+        try: await cq.answer()
+        except Exception: pass
+
+    def stats(self):
+        return {"running": f"{self.running}/{self.concurrency}", "pending": self.pending, "users": len(self._tails),
+                "dropped_full": self.dropped_full, "dropped_taps": self.dropped_taps,
+                "wait_p99_ms": f"{percentile(self.waits, .99) * 1000:.0f}",
+                "latency_p50_ms": f"{percentile(self.latencies, .5) * 1000:.0f}",
+                "latency_p99_ms": f"{percentile(self.latencies, .99) * 1000:.0f}"}
+
+update_processor = UserOrderedProcessor()
+metrics.add(Exported("bot_updates_pending", "Updates admitted and not finished", "gauge", lambda: {(): update_processor.pending}))
+metrics.add(Exported("bot_updates_dropped_total", "Updates dropped by the dispatcher", "counter",
+                     lambda: {("user_queue_full",): update_processor.dropped_full, ("duplicate_tap",): update_processor.dropped_taps}, "reason"))
+STATS_SOURCES["Update dispatch"] = update_processor.stats
+
+# --- STARTUP ---
+# The HTTP server and update intake come up first; index reconciliation, the
+# in-memory search and ordinal indexes, the vault catalog, manifest migration
+# and cache warm-up then run in the background, each retrying with backoff
+# while Mongo is unreachable. "/" is liveness and always answers; "/ready"
+# answers 200 once updates are being taken, the search and ordinal indexes
+# and the catalog are built, warm-up is done and Mongo answers a ping. Every
+# phase is timed from process start; first_response is the first handler to
+# finish.
+GUIDE_TYPES = ("anime", "movies")
+
+# (collection, keys, options). Only missing ones are built; extra indexes
+# (e.g. from /queries create) are left alone.
+INDEXES = [
+    ("vaults", [("key", 1)], {"unique": True}),
+    ("expiry", [("due", 1)], {}),
+    ("guides", [("type", 1), ("search_keys", 1)], {}),
+    ("guides", [("type", 1), ("_id", 1)], {}),
+    ("vaults", [("search_keys", 1)], {}),
+    ("vault_files", [("vault_id", 1), ("seq", 1)], {"unique": True}),
+    ("deliveries", [("status", 1), ("lease_until", 1)], {}),
+    ("deliveries", [("finished", 1)], {"expireAfterSeconds": 86400}),
+]
+
+async def ensure_indexes():
+    wanted = defaultdict(list)
+    for name, keys, opts in INDEXES: wanted[name].append((keys, opts))
+
+    async def reconcile(name):
+        have = {tuple(ix["key"].items()): ix.get("unique", False) async for ix in db[name].list_indexes()}
+        missing = []
+        for keys, opts in wanted[name]:
+            if tuple(keys) not in have: missing.append(IndexModel(keys, **opts))
+            elif have[tuple(keys)] != opts.get("unique", False): logger.warning(f"{name}: index {keys} exists with unique={have[tuple(keys)]}")
+        if missing: await db[name].create_indexes(missing)
+        return len(missing)
+
+    built = sum(await asyncio.gather(*(reconcile(name) for name in wanted)))
+    logger.info(f"Indexes reconciled: {built} built, {len(INDEXES) - built} already present")
+    return built
+
+# Settings, the folder menu, the first WARM_FOLDERS folder pages and page 1 of
+# each guide list, all at once. Runs after ensure_catalog.
+async def warm_up():
+    folders = await catalog_folders()
+    await asyncio.gather(
+        settings_cache.reload_all(),
+        render_cache.page(("folders",), render_folders),
+        *(render_cache.page(("list", t, 0, ""), functools.partial(render_list, t, 0, "")) for t in GUIDE_TYPES),
+        *(render_cache.page(("vfold", f), functools.partial(render_folder, f)) for f in folders[:WARM_FOLDERS]))
+
+class Startup:
+    def __init__(self):
+        self.began = time.monotonic()   # import time, close enough to process start
+        self.marks = {}                 # phase -> seconds since began
+        self.errors = {}
+
+    def mark(self, phase):
+        if phase not in self.marks:
+            self.marks[phase] = time.monotonic() - self.began
+            logger.info(f"Startup: {phase} after {self.marks[phase]:.2f}s")
+
+    async def step(self, phase, fn):
+        delay = 1
+        while True:
+            try:
+                await fn()
+                self.errors.pop(phase, None)
+                return self.mark(phase)
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                self.errors[phase] = str(e)[:200]
+                logger.warning(f"Startup {phase} failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def run(self):
+        await asyncio.gather(self.step("indexes", ensure_indexes), self.step("search", start_search_index),
+                             self.step("ordinal", ordinal_index.rebuild), self.step("manifests", migrate_manifests),
+                             self.catalog_then_warm())
+
+    # Warm-up renders the folder pages, so it waits for the catalog behind them.
+    async def catalog_then_warm(self):
+        await self.step("catalog", ensure_catalog)
+        await self.step("warm", warm_up)
+
+    READY_PHASES = ("serving", "search", "ordinal", "catalog", "warm")
+
+    @property
+    def ready(self): return all(p in self.marks for p in self.READY_PHASES)
+
+    def stats(self):
+        return {"ready": self.ready, **{p: f"{t:.2f}s" for p, t in self.marks.items()}, **{f"{p}_error": e for p, e in self.errors.items()}}
+
+startup = Startup()
+STATS_SOURCES["Startup"] = startup.stats
+metrics.add(Exported("bot_startup_phase_seconds", "Seconds from process start to each startup phase", "gauge",
+                     lambda: {(p,): t for p, t in startup.marks.items()}, "phase"))
+metrics.add(Exported("bot_ready", "1 once serving, indexed and warmed up", "gauge", lambda: {(): int(startup.ready)}))
+
+# --- HTTP SERVER ---
+# One aiohttp server on PORT answers health checks on "/" and, in webhook mode,
+# takes updates on WEBHOOK_PATH. Updates go straight onto the bounded update
+# queue; when it is full we answer 503 and Telegram redelivers later.
+class WebhookStats:
+    def __init__(self):
+        self.received = self.rejected = self.forbidden = 0
+        self.queue = None
+
+    def stats(self):
+        return {"received": self.received, "rejected_full": self.rejected, "bad_secret": self.forbidden,
+                "queue": f"{self.queue.qsize()}/{self.queue.maxsize}" if self.queue else "-"}
+
+webhook_stats = WebhookStats()
+STATS_SOURCES["Webhook"] = webhook_stats.stats
+
+async def health(request): return web.Response(text="OK")
+
+async def ready(request):
+    try: mongo = bool(await asyncio.wait_for(db.command("ping"), 2))
+    except Exception: mongo = False
+    ok = startup.ready and mongo
+    return web.json_response({"ready": ok, "mongo": mongo, "search_index": search_index.ready, "ordinal_index": ordinal_index.ready,
+                              **startup.stats()}, status=200 if ok else 503)
+
+async def metrics_page(request): return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def webhook(request):
+    if WEBHOOK_SECRET and not secrets.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+        webhook_stats.forbidden += 1
+        return web.Response(status=403)
+    app = request.app["bot_app"]
+    if getattr(app.update_processor, "saturated", False):
+        webhook_stats.rejected += 1
+        return web.Response(status=503)
+    try: update = Update.de_json(await request.json(), app.bot)
+    except ValueError: return web.Response(status=400)
+    try: app.update_queue.put_nowait(update)
+    except asyncio.QueueFull:
+        webhook_stats.rejected += 1
+        return web.Response(status=503)
+    webhook_stats.received += 1
+    return web.Response()
+
+def web_app(app, with_webhook):
+    server = web.Application()
+    server["bot_app"] = app
+    server.router.add_get("/", health)
+    server.router.add_get("/ready", ready)
+    server.router.add_get("/metrics", metrics_page)
+    if with_webhook: server.router.add_post(WEBHOOK_PATH, webhook)
+    return server
+
+# Mirrors Application.run_polling's lifecycle, with our HTTP server alongside.
+async def serve(app, webhook_url=WEBHOOK_URL, port=PORT, stop=None):
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError): pass
+    webhook_stats.queue = app.update_queue
+    runner = web.AppRunner(web_app(app, bool(webhook_url)), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    startup.mark("http")
+    try:
+        await app.initialize()
+        if app.post_init: await app.post_init(app)
+        await app.start()
+        if webhook_url:
+            if not WEBHOOK_SECRET: logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+            # Replicas share one webhook, so re-registering must not drop pending updates.
+            await app.bot.set_webhook(webhook_url.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                                      allowed_updates=Update.ALL_TYPES, max_connections=WEBHOOK_MAX_CONNECTIONS)
+            logger.info(f"Webhook mode on port {port}")
+        else:
+            await app.updater.start_polling(drop_pending_updates=True)
+            logger.info("Polling mode")
+        startup.mark("serving")
+        await stop.wait()
+    finally:
+        if app.updater and app.updater.running: await app.updater.stop()
+        if app.running: await app.stop()
+        await stop_background()
+        await app.shutdown()
+        await runner.cleanup()
 
+# --- APP ---
 async def error_handler(update, context): logger.error(f"Error {context.error}")
 
-def main():
+# post_init runs before app.start(), so its loops are plain asyncio tasks kept
+# here; serve() stops them with stop_background() before app.shutdown().
+background = []
+
+async def post_init(app):
+    query_profiler.loop = asyncio.get_running_loop()
+    background[:] = [asyncio.create_task(c) for c in (
+        startup.run(),
+        watch_collection(col_settings, settings_cache.on_change, settings_cache.reload_all),
+        expiry_queue.run(app.bot),
+        deliveries.run(app.bot),
+        stager.run(app.bot),
+        watch_collection(col_guides, on_guides_change, poll_guides),
+        watch_collection(col_vaults, on_vaults_change, poll_vaults))]
+
+# Lets delivery workers finish the album in flight and writes out buffered
+# uploads, then cancels and awaits every background loop.
+async def stop_background():
+    for step in (deliveries.stop(), stager.flush_all()):
+        try: await step
+        except Exception as e: logger.error(f"Shutdown step failed: {e}")
+    for task in background: task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+
+# base_url points the bot at another Bot API server (bench/fake_telegram.py).
+def build_app(token=TOKEN, base_url=None, webhook=bool(WEBHOOK_URL)):
     defaults = Defaults(parse_mode=ParseMode.HTML)
-    app = Application.builder().token(TOKEN).defaults(defaults).build()
-    
-    async def init(): 
-        await col_vaults.create_index("key", unique=True)
-        await col_guides.create_index([("name", "text")]) 
-    asyncio.get_event_loop().run_until_complete(init())
+    builder = Application.builder().token(token).defaults(defaults).rate_limiter(governor).persistence(persistence).post_init(post_init)
+    builder.update_queue(asyncio.Queue(UPDATE_QUEUE_SIZE)).concurrent_updates(update_processor)
+    builder.request(LaneRequest(control_lane, media_lane))
+    if base_url: builder.base_url(base_url)
+    if webhook: builder.updater(None)
+    else: builder.get_updates_request(updates_lane)
+    app = builder.build()
 
     global_handlers = [
         CommandHandler("start", start),
         CommandHandler("admin", admin_panel),
         CommandHandler("cancel", cancel),
+        CommandHandler("stats", admin_stats),
+        CommandHandler("queries", admin_queries),
+        CommandHandler("broken", admin_broken),
+        CommandHandler("import", admin_import),
+        CommandHandler("export", admin_export),
         CallbackQueryHandler(start, pattern="^main$"),
         CallbackQueryHandler(admin_panel, pattern="^a_panel_back$"),
         CallbackQueryHandler(user_router, pattern="^u_"),
@@ -748,7 +3312,7 @@ def main():
         CallbackQueryHandler(del_upd_link, pattern="^upd_del_")
     ]
 
-    conv = ConversationHandler(
+    conv = (SharedConversationHandler if SESSION_SYNC else ConversationHandler)(
         entry_points=global_handlers,
         states={
             W_TXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_w_txt)], 
@@ -781,16 +3345,25 @@ def main():
             SEARCH_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, perform_search), CallbackQueryHandler(user_router)],
             V_SEARCH_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, perform_vault_search), CallbackQueryHandler(user_router)],
             ADM_SEARCH_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_perform_search_del), CallbackQueryHandler(admin_del_menu)],
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL, import_file)],
             
-            ADM_DEL_SELECT: [CallbackQueryHandler(admin_del_process, pattern="^del_"), CallbackQueryHandler(admin_del_process, pattern="^adm_search_start"), CallbackQueryHandler(admin_confirm_delete, pattern="^confirm_del_"), CallbackQueryHandler(admin_del_menu, pattern="^a_back$"), CallbackQueryHandler(admin_del_menu, pattern="^a_del$")],
+            ADM_DEL_SELECT: [CallbackQueryHandler(admin_del_process, pattern="^del_"), CallbackQueryHandler(admin_del_process, pattern="^adm_search_start"), CallbackQueryHandler(admin_confirm_delete, pattern="^confirm_del_"), CallbackQueryHandler(admin_del_toggle, pattern="^dsel_"), CallbackQueryHandler(admin_del_selected, pattern="^dgo$"), CallbackQueryHandler(admin_del_clear, pattern="^dclr$"), CallbackQueryHandler(admin_del_page, pattern="^dpg$"), CallbackQueryHandler(admin_del_all, pattern="^dall$"), CallbackQueryHandler(admin_del_menu, pattern="^a_back$"), CallbackQueryHandler(admin_del_menu, pattern="^a_del$")],
         },
         fallbacks=global_handlers,
-        allow_reentry=True
+        allow_reentry=True,
+        name="main",
+        persistent=True
     )
+    for h in {id(h): h for h in itertools.chain(conv.entry_points, conv.fallbacks, *conv.states.values())}.values():
+        h.callback = timed(h.callback)
+    if SESSION_SYNC: app.add_handler(TypeHandler(Update, functools.partial(sync_conversation, conv)), group=-1)
     app.add_handler(conv)
     app.add_error_handler(error_handler)
-    Thread(target=lambda: server.run(host='0.0.0.0', port=PORT)).start()
-    app.run_polling(drop_pending_updates=True)
+    return app
+
+def main():
+    app = build_app()
+    asyncio.get_event_loop().run_until_complete(serve(app))
 
 if __name__ == "__main__":
     main()